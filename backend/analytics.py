@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+from .performance import points_to_series, series_to_points
+
+TRADING_DAYS = 252
+
+
+def cash_flows(history, index, stocks):
+    '''
+    Aligns the portfolio's contributions (buys) and withdrawals (sells) to its trading days.
+    Each transaction lands on the first trading day on or after it, the same day its shares start being valued.
+
+    Args:
+        history (list): The portfolio's transactions, with stock, total_price and date_purchased
+        index (pd.DatetimeIndex): The portfolio's trading days
+        stocks (set): The tickers that are valued, so that transactions of unpriced tickers are ignored
+
+    Returns:
+        flows (pd.Series): The net cash flow on each trading day
+    '''
+    flows = np.zeros(len(index))
+    entries = [entry for entry in history if entry["stock"] in stocks]
+    if entries and len(index):
+        dates = pd.to_datetime([str(entry["date_purchased"]).split("T")[0] for entry in entries])
+        rows = index.searchsorted(dates)
+        keep = rows < len(index)
+        np.add.at(flows, rows[keep], np.array([entry["total_price"] for entry in entries], dtype=float)[keep])
+    return pd.Series(flows, index=index)
+
+
+def daily_returns(values, flows):
+    '''
+    Computes time-weighted daily returns, so that buying or selling shares is not counted as a gain or loss.
+    Contributions are treated as arriving at the start of the day and withdrawals as leaving at its end:
+    r = (V_t - V_t-1 - F_t) / (V_t-1 + max(F_t, 0))
+
+    Args:
+        values (pd.Series): The portfolio's value on each trading day
+        flows (pd.Series): The net cash flow on each trading day
+
+    Returns:
+        returns (pd.Series): The daily returns, 0 on days with nothing invested
+    '''
+    previous = values.shift(1, fill_value=0.0)
+    invested = previous + flows.clip(lower=0)
+    gains = values - previous - flows
+    returns = np.divide(gains, invested, out=np.zeros(len(values)), where=invested.to_numpy() > 0)
+    return pd.Series(returns, index=values.index)
+
+
+def max_drawdown(growth):
+    '''
+    Finds the largest peak-to-trough decline of a growth index.
+
+    Args:
+        growth (pd.Series): The growth of 1 invested, indexed by date
+
+    Returns:
+        drawdown (pd.Series): The decline from the running peak on each day (0 or negative)
+        summary (dict): The max drawdown and the dates of its peak and trough
+    '''
+    drawdown = growth / growth.cummax() - 1
+    if drawdown.empty or drawdown.min() == 0:
+        return drawdown, {"max_drawdown": 0.0, "peak": None, "trough": None}
+    trough = drawdown.idxmin()
+    peak = growth[:trough].idxmax()
+    return drawdown, {
+        "max_drawdown": float(drawdown[trough]),
+        "peak": peak.strftime("%Y-%m-%d"),
+        "trough": trough.strftime("%Y-%m-%d"),
+    }
+
+
+def compute_analytics(info, benchmark_closes=None, benchmark="SPY", window=21):
+    '''
+    Computes the portfolio's return and risk analytics from its value series in one vectorized pass.
+    Returns are adjusted for cash contributions and withdrawals, so each buy or sell is not a jump in value.
+
+    Args:
+        info (dict): The portfolio snapshot, with performance, components and history
+        benchmark_closes (pd.Series): The benchmark's daily closes, indexed by date, or None to skip the comparison
+        benchmark (str): The benchmark's ticker
+        window (int): The number of trading days in the rolling volatility window
+
+    Returns:
+        analytics (dict): {series: {name: [[date, value], ...]}, summary: {metric: value}, benchmark: ticker}
+        Series are daily_returns, cumulative_return (time-weighted), cost_basis (net contributions),
+        return_on_cost, drawdown, rolling_volatility (annualized) and benchmark_return.
+    '''
+    values = points_to_series(info["performance"])
+    flows = cash_flows(info["history"], values.index, set(info["components"]))
+
+    returns = daily_returns(values, flows)
+    growth = (1 + returns).cumprod()
+    cost_basis = flows.cumsum()
+    return_on_cost = (values - cost_basis).div(cost_basis.where(cost_basis > 0))
+    drawdown, drawdown_summary = max_drawdown(growth)
+    volatility = returns.rolling(window).std() * np.sqrt(TRADING_DAYS)
+
+    years = len(returns) / TRADING_DAYS
+    total_return = float(growth.iloc[-1] - 1) if len(growth) else 0.0
+    summary = {
+        "total_return": total_return,
+        "annualized_return": float((1 + total_return) ** (1 / years) - 1) if years >= 1 else None,
+        "return_on_cost": float(return_on_cost.iloc[-1]) if len(return_on_cost.dropna()) else None,
+        "cost_basis": float(cost_basis.iloc[-1]) if len(cost_basis) else 0.0,
+        "volatility": float(returns.std() * np.sqrt(TRADING_DAYS)) if len(returns) > 1 else None,
+        **drawdown_summary,
+    }
+    series = {
+        "daily_returns": returns,
+        "cumulative_return": growth - 1,
+        "cost_basis": cost_basis,
+        "return_on_cost": return_on_cost.dropna(),
+        "drawdown": drawdown,
+        "rolling_volatility": volatility.dropna(),
+    }
+
+    if benchmark_closes is not None and len(values):
+        # Benchmark closes on the portfolio's trading days, carried forward over days the benchmark did not trade
+        closes = benchmark_closes.sort_index().reindex(values.index.union(benchmark_closes.index)).ffill().reindex(values.index)
+        benchmark_returns = closes.pct_change().fillna(0.0)
+        benchmark_growth = (1 + benchmark_returns).cumprod()
+        series["benchmark_return"] = (benchmark_growth - 1).dropna()
+        summary["benchmark_return"] = float(benchmark_growth.iloc[-1] - 1)
+        summary["excess_return"] = total_return - summary["benchmark_return"]
+        variance = benchmark_returns.var()
+        summary["beta"] = float(returns.cov(benchmark_returns) / variance) if len(returns) > 1 and variance > 0 else None
+        summary["correlation"] = float(returns.corr(benchmark_returns)) if len(returns) > 1 and variance > 0 else None
+
+    return {
+        "series": {name: series_to_points(points) for name, points in series.items()},
+        "summary": summary,
+        "benchmark": benchmark if benchmark_closes is not None else None,
+    }
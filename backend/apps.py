@@ -0,0 +1,29 @@
+import os
+import sys
+
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class BackendConfig(AppConfig):
+    name = "backend"
+
+    def ready(self):
+        # Keep active users' portfolio snapshots warm from this server process, without an external broker
+        if settings.REFRESH_IN_PROCESS and serves_requests():
+            from .refresh import start_scheduler
+            start_scheduler()
+
+
+def serves_requests():
+    '''
+    Checks whether this process serves requests, rather than running a management command.
+    Under runserver, only the process restarted by the autoreloader serves requests.
+
+    Returns:
+        serves_requests (bool): Whether this is a server process
+    '''
+    program = sys.argv[0] if sys.argv else ""
+    if os.path.basename(program) not in ("manage.py", "django-admin") and not program.endswith(os.path.join("django", "__main__.py")):
+        return True # A WSGI or ASGI server, e.g. gunicorn or uvicorn
+    return sys.argv[1:2] == ["runserver"] and (os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv)
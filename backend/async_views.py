@@ -0,0 +1,297 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from .concurrency import limited, run_blocking
+from .metrics import record_cache_lookup, timed
+from .price_store import get_price_store, is_valid_ticker
+from .refresh import get_refresher, mark_active
+from .snapshot import decode_snapshot, decode_stamp
+from .utils import get_async_supabase_client
+from .views import (
+    PORTFOLIOS_TABLE, STOCK_DATA_COLUMNS, STOCK_DATA_TABLE,
+    analytics_response, cache_portfolio, earliest_purchases, get_cache_key, group_dates_by_ticker,
+    history_response, invalid_ticker_response, performance_response, price_ranges_response,
+)
+from .rag.chatbot import astream_vector_search, avector_search
+
+logger = logging.getLogger(__name__)
+
+
+def async_api_view(methods):
+    '''
+    Stands in for DRF's @api_view, which does not support async views:
+    other methods are rejected with a 405, and the view is exempt from CSRF checks as with @api_view.
+
+    Args:
+        methods (list): The allowed HTTP methods
+    '''
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def read_snapshot(cache_key):
+    '''
+    Async version of views.read_snapshot.
+    '''
+    with timed("cache", "get"):
+        data = await cache.aget(cache_key)
+    info = decode_snapshot(data)
+    record_cache_lookup("portfolio", info is not None)
+    return info
+
+
+async def load_portfolio(email, portfolio):
+    '''
+    Async version of views.load_portfolio: reads a portfolio from the cache,
+    rebuilding it on a miss and refreshing it in the background when stale.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        info (dict): The portfolio's performance, positions and history
+    '''
+    info = await read_snapshot(get_cache_key(email, portfolio))
+    if info is None:
+        client = await get_async_supabase_client()
+        query = client.table(STOCK_DATA_TABLE).select(*STOCK_DATA_COLUMNS).eq("owner", email).eq("portfolio", portfolio)
+        read_at = time.time()
+        with timed("supabase", "stock_data"):
+            response = await limited(query.execute())
+        price_histories = await read_price_histories(response.data)
+        return await run_blocking(cache_portfolio, response.data, email, portfolio, price_histories, read_at)
+    if time.time() - info["built_at"] > settings.CACHE_TIMEOUT:
+        get_refresher().refresh_portfolio(email, portfolio)
+    return info
+
+
+async def load_built_at(email, portfolio):
+    '''
+    Async version of views.load_built_at, reading only the snapshot's header.
+    '''
+    with timed("cache", "get"):
+        data = await cache.aget(get_cache_key(email, portfolio))
+    stamp = decode_stamp(data)
+    return stamp["built_at"] if stamp else None
+
+
+async def read_price_histories(rows):
+    '''
+    Async version of views.read_price_histories, reading the tickers concurrently.
+    '''
+    price_store = get_price_store()
+    earliest_purchase = earliest_purchases(rows)
+    histories = await asyncio.gather(*(
+        run_blocking(price_store.get_history, stock, start) for stock, start in earliest_purchase.items()
+    ))
+    return dict(zip(earliest_purchase, histories))
+
+
+async def cache_portfolios(rows, email, portfolios, read_at=None):
+    '''
+    Async version of views.cache_all_portfolios, given the user's rows.
+    The price history of every ticker across the portfolios is read concurrently (once per ticker,
+    from its earliest purchase in any of them), then the portfolios are built concurrently on threads.
+    A portfolio that fails to build is logged and skipped, so the others are still cached.
+    If the shared read fails, each portfolio reads its own tickers instead, as in views.cache_all_portfolios.
+
+    Args:
+        rows (list): The user's rows from the stock data table
+        email (str): The user's email
+        portfolios (list): The portfolios to cache
+        read_at (float): When the rows were read from the database, as a Unix timestamp. Defaults to now.
+
+    Returns:
+        infos (dict): {portfolio: info} for the portfolios that were cached
+    '''
+    rows_by_portfolio = defaultdict(list)
+    for row in rows:
+        rows_by_portfolio[row["portfolio"]].append(row)
+    try:
+        price_histories = await read_price_histories([row for portfolio in portfolios for row in rows_by_portfolio[portfolio]])
+    except Exception:
+        # Let each portfolio read its own tickers, so that one failing ticker only fails its portfolios
+        logger.exception("Failed to read price histories for %s", email)
+        price_histories = None
+
+    async def cache_portfolio_safely(portfolio):
+        portfolio_rows = rows_by_portfolio[portfolio]
+        portfolio_histories = None
+        if price_histories is not None:
+            stocks = {row["stock"] for row in portfolio_rows}
+            portfolio_histories = {stock: history for stock, history in price_histories.items() if stock in stocks}
+        try:
+            return await run_blocking(cache_portfolio, portfolio_rows, email, portfolio, portfolio_histories, read_at)
+        except Exception:
+            logger.exception("Failed to cache portfolio %r for %s", portfolio, email)
+            return None
+
+    infos = await asyncio.gather(*(cache_portfolio_safely(portfolio) for portfolio in portfolios))
+    return {portfolio: info for portfolio, info in zip(portfolios, infos) if info is not None}
+
+
+@async_api_view(["POST"])
+async def get_all_portfolios(request):
+    '''
+    Async version of views.get_all_portfolios.
+    The snapshots are checked concurrently, and the missing ones are built with one stock data query.
+
+    Args:
+        email (str): The user's email
+        [Optional] rebuild (list): Portfolios to rebuild even if cached, e.g. after add_transaction failed
+
+    Returns:
+        portfolios (list): A list of all the user's portfolios
+    '''
+    # Extract email from POST request body
+    data = json.loads(request.body.decode("utf-8"))
+    email = data["email"]
+    rebuild = set(data.get("rebuild") or [])
+
+    # Fetch all the user's portfolios
+    client = await get_async_supabase_client()
+    with timed("supabase", "portfolios"):
+        response = await limited(client.table(PORTFOLIOS_TABLE).select("portfolio", "is_public").eq("email", email).execute())
+    portfolios = [row["portfolio"] for row in response.data]
+
+    # Store in cache, rebuilding only what is not cached yet
+    cached = [portfolio for portfolio in portfolios if portfolio not in rebuild]
+    snapshots = dict.fromkeys(portfolios)
+    snapshots.update(zip(cached, await asyncio.gather(*(load_built_at(email, portfolio) for portfolio in cached))))
+    missing = [portfolio for portfolio, built_at in snapshots.items() if built_at is None]
+    if missing:
+        read_at = time.time()
+        with timed("supabase", "stock_data"):
+            response = await limited(client.table(STOCK_DATA_TABLE).select(*STOCK_DATA_COLUMNS).eq("owner", email).execute())
+        await cache_portfolios(response.data, email, missing, read_at)
+    if any(built_at is not None and time.time() - built_at > settings.CACHE_TIMEOUT for built_at in snapshots.values()):
+        get_refresher().refresh_user(email, portfolios)
+    await run_blocking(mark_active, email, portfolios)
+
+    return JsonResponse(portfolios, safe=False)
+
+
+@async_api_view(["POST"])
+async def get_portfolio_performance(request):
+    '''
+    Async version of views.get_portfolio_performance.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    portfolio_data = await load_portfolio(data["email"], data["portfolio"])
+    return performance_response(portfolio_data, data)
+
+
+@async_api_view(["POST"])
+async def get_portfolio_holdings(request):
+    '''
+    Async version of views.get_portfolio_holdings.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    portfolio_data = await load_portfolio(data["email"], data["portfolio"])
+    return JsonResponse(portfolio_data["positions"])
+
+
+@async_api_view(["POST"])
+async def get_portfolio_history(request):
+    '''
+    Async version of views.get_portfolio_history.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    portfolio_data = await load_portfolio(data["email"], data["portfolio"])
+    return history_response(portfolio_data, data)
+
+
+@async_api_view(["POST"])
+async def get_portfolio_analytics(request):
+    '''
+    Async version of views.get_portfolio_analytics.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    portfolio_data = await load_portfolio(data["email"], data["portfolio"])
+    return analytics_response(portfolio_data, data)
+
+
+@async_api_view(["POST"])
+async def get_daily_price_range(request):
+    '''
+    Async version of views.get_daily_price_range.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    ticker = data["ticker"]
+    date_str = data["date"].split("T")[0] # Remove timezone info
+    if not is_valid_ticker(ticker):
+        return invalid_ticker_response(ticker)
+
+    price_range = await run_blocking(get_price_store().get_daily_range, ticker, date_str)
+    if price_range is None:
+        return JsonResponse({"error": f"No trading day near {date_str} for {ticker}"}, status=404)
+    _, low, high = price_range
+    return JsonResponse((low, high), safe=False)
+
+
+@async_api_view(["POST"])
+async def get_daily_price_ranges(request):
+    '''
+    Async version of views.get_daily_price_ranges, reading the tickers' ranges concurrently.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    entries = [dict(entry, date=entry["date"].split("T")[0]) for entry in data["entries"]] # Remove timezone info
+    invalid = [entry["ticker"] for entry in entries if not is_valid_ticker(entry["ticker"])]
+    if invalid:
+        return invalid_ticker_response(*invalid)
+
+    price_store = get_price_store()
+    dates_by_ticker = group_dates_by_ticker(entries)
+    ranges = await asyncio.gather(*(
+        run_blocking(price_store.get_daily_ranges, ticker, dates) for ticker, dates in dates_by_ticker.items()
+    ))
+    return price_ranges_response(entries, dict(zip(dates_by_ticker, ranges)))
+
+
+@async_api_view(["POST"])
+async def get_chatbot_response(request):
+    '''
+    Async version of views.get_chatbot_response.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    filters = {key: data.get(key) for key in ("form", "start_date", "end_date")}
+    if not is_valid_ticker(data["ticker"]):
+        return invalid_ticker_response(data["ticker"])
+
+    response = await avector_search(data["ticker"], data["query"], filters)
+    return JsonResponse(response, safe=False)
+
+
+@async_api_view(["POST"])
+async def get_chatbot_stream(request):
+    '''
+    Async version of views.get_chatbot_stream.
+    '''
+    data = json.loads(request.body.decode("utf-8"))
+    filters = {key: data.get(key) for key in ("form", "start_date", "end_date")}
+    if not is_valid_ticker(data["ticker"]):
+        return invalid_ticker_response(data["ticker"])
+
+    async def events():
+        async for chunk in astream_vector_search(data["ticker"], data["query"], filters):
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "event: done\ndata: \n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # Stop proxies from buffering the stream
+    return response
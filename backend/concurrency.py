@@ -0,0 +1,53 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# One semaphore per event loop, since a semaphore cannot be shared across loops
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_upstream_semaphore():
+    '''
+    Returns the running event loop's semaphore, which bounds the number of
+    concurrent upstream calls (Supabase, Yahoo, the vector store) to settings.UPSTREAM_CONCURRENCY.
+
+    Returns:
+        semaphore (asyncio.Semaphore): The event loop's semaphore
+    '''
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(settings.UPSTREAM_CONCURRENCY)
+    return semaphore
+
+
+async def limited(awaitable):
+    '''
+    Awaits an upstream call once the upstream semaphore allows it.
+
+    Args:
+        awaitable (Awaitable): The upstream call, e.g. an async Supabase query
+
+    Returns:
+        result: The call's result
+    '''
+    async with get_upstream_semaphore():
+        return await awaitable
+
+
+async def run_blocking(function, *args, **kwargs):
+    '''
+    Runs a blocking function (e.g. a price store read or a Pinecone query) on a thread,
+    once the upstream semaphore allows it, so that it does not block the event loop.
+
+    Args:
+        function (callable): The blocking function
+        *args, **kwargs: Its arguments
+
+    Returns:
+        result: The function's result
+    '''
+    async with get_upstream_semaphore():
+        return await sync_to_async(function, thread_sensitive=False)(*args, **kwargs)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from .performance import points_to_series
+
+# Resolutions precomputed into the snapshot, with the pandas frequency of their buckets
+RESOLUTIONS = {
+    "weekly": "W-FRI",
+    "monthly": "M",
+}
+
+
+def compute_levels(performance):
+    '''
+    Buckets the daily performance series into weekly and monthly OHLC levels, so that charts
+    over long ranges keep each bucket's extremes instead of sampling a single day.
+
+    Args:
+        performance (list): The portfolio's value as [[date, total_value], ...]
+
+    Returns:
+        levels (dict): {resolution: {dates, open, high, low, close}}, where dates are each bucket's
+        last trading day (YYYY-MM-DD) and the others are lists of floats
+    '''
+    series = points_to_series(performance)
+    levels = {}
+    for resolution, frequency in RESOLUTIONS.items():
+        periods = series.index.to_period(frequency)
+        ohlc = series.groupby(periods).agg(["first", "max", "min", "last"])
+        last_days = series.index.to_series().groupby(periods).last()
+        levels[resolution] = {
+            "dates": pd.DatetimeIndex(last_days).strftime("%Y-%m-%d").tolist(),
+            "open": ohlc["first"].astype(float).tolist(),
+            "high": ohlc["max"].astype(float).tolist(),
+            "low": ohlc["min"].astype(float).tolist(),
+            "close": ohlc["last"].astype(float).tolist(),
+        }
+    return levels
+
+
+def lttb(values, max_points):
+    '''
+    Picks the indices of at most max_points points that preserve the shape of a line chart,
+    using the Largest-Triangle-Three-Buckets algorithm. The first and last points are always kept.
+
+    Args:
+        values (np.ndarray): The y values, evenly spaced in x
+        max_points (int): The maximum number of points to keep
+
+    Returns:
+        indices (np.ndarray): The sorted indices of the points to keep
+    '''
+    n = len(values)
+    if max_points >= n or max_points < 3:
+        return np.arange(n) if max_points >= n else np.linspace(0, n - 1, max(max_points, 1)).astype(int)
+
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int) # Buckets between the first and last point
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_start, next_stop = stop, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x, average_y = x[next_start:next_stop].mean(), values[next_start:next_stop].mean()
+
+        # Area of the triangle formed by the previous pick, each candidate, and the next bucket's average
+        areas = np.abs(
+            (x[previous] - average_x) * (values[start:stop] - values[previous])
+            - (x[previous] - x[start:stop]) * (average_y - values[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    return indices
+
+
+def select_points(info, resolution="daily", max_points=None):
+    '''
+    Selects a portfolio's performance at a resolution, reduced to at most max_points with LTTB.
+
+    Args:
+        info (dict): The portfolio snapshot, with performance and levels
+        resolution (str): "daily", "weekly" or "monthly"
+        max_points (int): The maximum number of points to return (at least 1), or None for all
+
+    Returns:
+        columns (dict): {dates, values}, plus open, high and low for weekly and monthly resolutions,
+        where values are the bucket's close
+    '''
+    if resolution == "daily":
+        columns = {
+            "dates": [date for date, _ in info["performance"]],
+            "values": [value for _, value in info["performance"]],
+        }
+    elif resolution in RESOLUTIONS:
+        level = info["levels"][resolution]
+        columns = {"dates": level["dates"], "values": level["close"], "open": level["open"], "high": level["high"], "low": level["low"]}
+    else:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    if max_points is not None and max_points < 1:
+        raise ValueError(f"max_points must be positive: {max_points}")
+
+    if max_points is not None and max_points < len(columns["dates"]):
+        indices = lttb(np.asarray(columns["values"], dtype=float), max_points)
+        columns = {name: [column[i] for i in indices] for name, column in columns.items()}
+    return columns
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from .ledger import Ledger
+from .performance import close_matrix, compute_components, points_to_series, series_to_points
+
+
+def apply_transaction(info, row, stock_data):
+    '''
+    Patches a cached portfolio snapshot with a newly appended transaction.
+    Only the transaction's ticker is recomputed: its component series is rebuilt from
+    its own lots, and the difference from the old component is applied to the performance
+    series, so the cost is proportional to the number of days held for that one ticker.
+
+    Args:
+        info (dict): The portfolio snapshot, updated in place
+        row (dict): The new transaction, with stock, amount, unit_price, total_price and date_purchased
+        stock_data (pd.DataFrame): The ticker's OHLCV bars, starting on or before its earliest purchase
+
+    Returns:
+        info (dict): The updated portfolio snapshot
+    '''
+    stock, amount, total_price = row["stock"], row["amount"], row["total_price"]
+
+    if stock in info["positions"]:
+        info["positions"][stock]["total_value"] += total_price
+        info["positions"][stock]["total_shares"] += amount
+    else:
+        info["positions"][stock] = {
+            "total_value": total_price,
+            "total_shares": amount
+        }
+
+    history = Ledger(info["history"])
+    history.add({
+        "stock": stock,
+        "amount": amount,
+        "unit_price": row["unit_price"],
+        "total_price": total_price,
+        "date_purchased": row["date_purchased"]
+    })
+    info["history"] = history.entries
+
+    # Rebuild the ticker's component from its own lots and swap it into the total
+    lots = [(entry["stock"], entry["amount"], entry["date_purchased"]) for entry in info["history"] if entry["stock"] == stock]
+    new_component = compute_components(lots, close_matrix({stock: stock_data}))[stock].dropna()
+    old_component = points_to_series(info["components"].get(stock, []))
+    performance = points_to_series(info["performance"])
+    performance = performance.sub(old_component, fill_value=0).add(new_component, fill_value=0)
+
+    info["components"][stock] = series_to_points(new_component)
+    info["performance"] = series_to_points(performance.sort_index())
+    return info
+
+
+def append_trading_days(info, close_prices):
+    '''
+    Brings a cached portfolio snapshot up to the latest closes. Its last date is revised,
+    since it may have been priced before its session closed, and the trading days closed after it are appended.
+    Each held ticker's component takes its current share count times the closes.
+
+    Args:
+        info (dict): The portfolio snapshot, updated in place
+        close_prices (pd.DataFrame): Daily close prices from the snapshot's last date, indexed by date with one column per ticker
+
+    Returns:
+        info (dict): The updated portfolio snapshot
+    '''
+    if info["performance"]:
+        close_prices = close_prices[close_prices.index >= pd.Timestamp(info["performance"][-1][0])]
+    if close_prices.empty:
+        return info
+    first_date = close_prices.index[0].strftime("%Y-%m-%d")
+
+    updated = False
+    for stock, position in info["positions"].items():
+        if stock in info["components"] and stock in close_prices.columns:
+            new_component = (close_prices[stock] * position["total_shares"]).dropna()
+            info["components"][stock] = [point for point in info["components"][stock] if point[0] < first_date] + series_to_points(new_component)
+            updated = True
+
+    if updated:
+        # Re-sum the revised and appended days over every component, including those without new closes
+        components = pd.DataFrame({
+            stock: points_to_series([point for point in points if point[0] >= first_date])
+            for stock, points in info["components"].items()
+        })
+        new_performance = components.sum(axis=1, min_count=1).dropna()
+        info["performance"] = [point for point in info["performance"] if point[0] < first_date] + series_to_points(new_performance.sort_index())
+    return info
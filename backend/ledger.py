@@ -0,0 +1,72 @@
+import bisect
+
+
+class Ledger:
+    '''
+    A portfolio's transaction history, kept ordered by date_purchased.
+    Entries are sorted once on construction and inserted with bisect afterwards,
+    and date-range reads are answered with binary search instead of a full scan.
+
+    Args:
+        entries (iterable): The transactions, as {stock, amount, unit_price, total_price, date_purchased}
+    '''
+    def __init__(self, entries=()):
+        self.entries = sorted(entries, key=lambda x: x["date_purchased"])
+        self._dates = [entry["date_purchased"] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def add(self, entry):
+        '''
+        Inserts a transaction after any existing transactions on the same date.
+
+        Args:
+            entry (dict): The transaction to insert
+        '''
+        index = bisect.bisect_right(self._dates, entry["date_purchased"])
+        self._dates.insert(index, entry["date_purchased"])
+        self.entries.insert(index, entry)
+
+    def between(self, start_date=None, end_date=None):
+        '''
+        Retrieves the transactions within a date range.
+
+        Args:
+            start_date (str): The first date to include (YYYY-MM-DD). Defaults to the first transaction.
+            end_date (str): The last date to include (YYYY-MM-DD). Defaults to the last transaction.
+
+        Returns:
+            entries (list): The transactions in the range, ordered by date
+        '''
+        low, high = self._bounds(start_date, end_date)
+        return self.entries[low:high]
+
+    def page(self, start_date=None, end_date=None, offset=0, limit=None):
+        '''
+        Retrieves one page of the transactions within a date range.
+
+        Args:
+            start_date (str): The first date to include (YYYY-MM-DD)
+            end_date (str): The last date to include (YYYY-MM-DD)
+            offset (int): The number of transactions in the range to skip, at least 0
+            limit (int): The maximum number of transactions to return, at least 0. Defaults to all of them.
+
+        Returns:
+            entries (list): The transactions on the page, ordered by date
+            total (int): The number of transactions in the whole range
+        '''
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError(f"offset and limit must not be negative: {offset}, {limit}")
+        low, high = self._bounds(start_date, end_date)
+        start = min(low + offset, high)
+        stop = high if limit is None else min(start + limit, high)
+        return self.entries[start:stop], high - low
+
+    def _bounds(self, start_date, end_date):
+        low = bisect.bisect_left(self._dates, start_date) if start_date else 0
+        high = bisect.bisect_right(self._dates, end_date) if end_date else len(self._dates)
+        return low, high
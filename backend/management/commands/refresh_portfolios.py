@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from backend import views
+from backend.refresh import Refresher, active_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the cached portfolio snapshots of active users that are due: brings them up to the latest closes "
+        "after a market close, or rebuilds them before they are evicted. Run it from cron after the market closes, "
+        "or keep it running with --loop instead of REFRESH_IN_PROCESS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", nargs="*", default=[], help="Only refresh these users, whether or not they are due")
+        parser.add_argument("--loop", action="store_true", help="Keep checking every REFRESH_INTERVAL seconds")
+        parser.add_argument("--workers", type=int, default=2, help="The number of users refreshed at once")
+
+    def handle(self, *args, **options):
+        refresher = Refresher(
+            views.rebuild_portfolio, views.rebuild_user_portfolios, views.update_user_closes, views.load_built_at, options["workers"],
+        )
+        if options["loop"]:
+            refresher.run_forever()
+            return
+
+        users = active_users()
+        if options["email"]:
+            futures = [refresher.refresh_user(email, users.get(email, {}).get("portfolios") or _portfolios(email)) for email in options["email"]]
+        else:
+            futures = refresher.refresh_active_users()
+        for future in futures:
+            future.result()
+        self.stdout.write(f"Refreshed {len(futures)} users")
+
+
+def _portfolios(email):
+    client = views.get_supabase_client()
+    response = client.table(views.PORTFOLIOS_TABLE).select("portfolio").eq("email", email).execute()
+    return [row["portfolio"] for row in response.data]
@@ -0,0 +1,236 @@
+import cProfile
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds (the Prometheus client defaults)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    '''
+    A Prometheus counter with labels, kept in this process.
+
+    Args:
+        name (str): The metric name
+        documentation (str): The metric's help text
+        labels (tuple): The label names
+    '''
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {} # {label values: count}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    '''
+    A Prometheus histogram with labels, kept in this process.
+
+    Args:
+        name (str): The metric name
+        documentation (str): The metric's help text
+        labels (tuple): The label names
+        buckets (tuple): The upper bounds of the buckets
+    '''
+    def __init__(self, name, documentation, labels, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {} # {label values: [count per bucket..., sum, count]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            values = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, values in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (str(bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + ('+Inf',))} {values[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {values[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time until the response is returned, by endpoint.", ("endpoint",))
+REQUESTS = Counter("http_requests_total", "Requests by endpoint, method and status.", ("endpoint", "method", "status"))
+UPSTREAM_SECONDS = Histogram(
+    "upstream_call_duration_seconds", "Latency of calls to Supabase, Yahoo, the vector store, OpenAI and the cache.", ("upstream", "operation"),
+)
+UPSTREAM_ERRORS = Counter("upstream_call_errors_total", "Upstream calls that raised an exception.", ("upstream", "operation"))
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+METRICS = (REQUEST_SECONDS, REQUESTS, UPSTREAM_SECONDS, UPSTREAM_ERRORS, CACHE_LOOKUPS)
+
+
+@contextmanager
+def timed(upstream, operation):
+    '''
+    Records the latency of an upstream call, and counts it as an error if it raises.
+    Works around awaited calls as well, e.g. `with timed("supabase", "portfolios"): await query.execute()`.
+
+    Args:
+        upstream (str): The service called, e.g. "supabase"
+        operation (str): What was called, e.g. "portfolios"
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(upstream=upstream, operation=operation)
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=upstream, operation=operation)
+
+
+def record_cache_lookup(cache, hit):
+    '''
+    Counts a cache hit or miss.
+
+    Args:
+        cache (str): The cache looked up, e.g. "portfolio"
+        hit (bool): Whether the lookup was a hit
+    '''
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics():
+    '''
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns:
+        text (str): The metrics
+    '''
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class IsAdminOrMetricsToken(BasePermission):
+    '''
+    Allows staff users, and scrapers sending "Authorization: Bearer <settings.METRICS_TOKEN>" if a token is set.
+    '''
+    def has_permission(self, request, view):
+        if settings.METRICS_TOKEN and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+class MetricsMiddleware:
+    '''
+    Records each request's latency (until its response is returned, so excluding the body of a stream)
+    and status, labelled by the URL pattern it matched.
+
+    With settings.PROFILE_REQUESTS, a request sent with the "X-Profile: 1" header is also run under cProfile,
+    and the stats are dumped to settings.PROFILE_DIR, named in the X-Profile-File response header.
+    Only one request is profiled at a time; under ASGI the profile also includes the other requests
+    running on the event loop meanwhile.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    _profile_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        profiler = self._start_profile(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile_path = self._stop_profile(request, profiler)
+        return self._record(request, response, start, profile_path)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        profiler = self._start_profile(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile_path = self._stop_profile(request, profiler)
+        return self._record(request, response, start, profile_path)
+
+    def _record(self, request, response, start, profile_path):
+        endpoint = _endpoint(request)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if profile_path is not None:
+            response["X-Profile-File"] = profile_path
+        return response
+
+    def _start_profile(self, request):
+        if not settings.PROFILE_REQUESTS or request.headers.get("X-Profile") != "1":
+            return None
+        if not self._profile_lock.acquire(blocking=False):
+            logger.info("Not profiling %s: another request is being profiled", request.path)
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profile(self, request, profiler):
+        if profiler is None:
+            return None
+        profiler.disable()
+        self._profile_lock.release()
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9]+", "_", _endpoint(request)).strip("_") or "root"
+        path = os.path.join(settings.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        logger.info("Profile of %s written to %s", request.path, path)
+        return path
+
+
+def _endpoint(request):
+    '''
+    The URL pattern a request matched, so that the endpoint label has few values.
+    '''
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "unmatched"
+
+
+def _labels(names, values):
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+
+def close_matrix(price_histories):
+    '''
+    Aligns the Close column of each ticker's price history into a single frame.
+
+    Args:
+        price_histories (dict): A mapping of ticker to its OHLCV DataFrame
+
+    Returns:
+        close_prices (pd.DataFrame): Daily close prices, indexed by date with one column per ticker
+    '''
+    if not price_histories:
+        return pd.DataFrame(dtype=float)
+    return pd.DataFrame({stock: frame["Close"] for stock, frame in price_histories.items()}).sort_index()
+
+
+def compute_components(lots, close_prices):
+    '''
+    Computes the daily value contributed by each ticker from the portfolio's lots using array operations.
+    Each ticker's share count is a step function that increases on the first
+    trading day on or after each purchase, which is multiplied by its close prices.
+
+    Args:
+        lots (list): A list of (ticker, shares, purchase_date) tuples
+        close_prices (pd.DataFrame): Daily close prices, indexed by date with one column per ticker
+
+    Returns:
+        components (pd.DataFrame): Each ticker's value, indexed by date with one column per ticker.
+        NaN before the ticker's first purchase and on days it has no close.
+    '''
+    if not lots or close_prices.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([]), dtype=float)
+
+    tickers, shares, dates = zip(*lots)
+    columns = close_prices.columns.get_indexer(list(tickers))
+    purchase_dates = pd.to_datetime([str(date).split("T")[0] for date in dates])
+    rows = close_prices.index.searchsorted(purchase_dates) # First trading day on or after purchase
+
+    # Ignore lots for unknown tickers or purchased after the last available close
+    keep = (columns >= 0) & (rows < len(close_prices.index))
+    rows, columns = rows[keep], columns[keep]
+
+    # Share count step function per ticker, plus a lot count to know when each ticker starts
+    share_deltas = np.zeros(close_prices.shape)
+    lot_deltas = np.zeros(close_prices.shape)
+    np.add.at(share_deltas, (rows, columns), np.asarray(shares, dtype=float)[keep])
+    np.add.at(lot_deltas, (rows, columns), 1)
+    held_shares = share_deltas.cumsum(axis=0)
+    held_lots = lot_deltas.cumsum(axis=0)
+
+    prices = close_prices.to_numpy(dtype=float)
+    active = (held_lots > 0) & ~np.isnan(prices)
+    values = np.where(active, prices * held_shares, np.nan)
+    return pd.DataFrame(values, index=close_prices.index, columns=close_prices.columns)
+
+
+def compute_performance(lots, close_prices):
+    '''
+    Computes the daily value of a portfolio from its lots, as the row sum of compute_components.
+
+    Args:
+        lots (list): A list of (ticker, shares, purchase_date) tuples
+        close_prices (pd.DataFrame): Daily close prices, indexed by date with one column per ticker
+
+    Returns:
+        performance (pd.Series): The portfolio's total value, indexed by date.
+        Only days on which at least one held ticker has a close are included.
+    '''
+    components = compute_components(lots, close_prices)
+    return components.sum(axis=1, min_count=1).dropna()
+
+
+def series_to_points(series):
+    '''
+    Converts a date-indexed series into the [[date, value], ...] form stored in the snapshot.
+
+    Args:
+        series (pd.Series): The values, indexed by date
+
+    Returns:
+        points (list): A list of [date (YYYY-MM-DD), value] pairs
+    '''
+    if series.empty:
+        return []
+    return [list(point) for point in zip(series.index.strftime("%Y-%m-%d"), series.tolist())]
+
+
+def points_to_series(points):
+    '''
+    Converts [[date, value], ...] pairs from the snapshot back into a date-indexed series.
+
+    Args:
+        points (list): A list of [date (YYYY-MM-DD), value] pairs
+
+    Returns:
+        series (pd.Series): The values, indexed by date
+    '''
+    if not points:
+        return pd.Series(index=pd.DatetimeIndex([]), dtype=float)
+    dates, values = zip(*points)
+    return pd.Series(values, index=pd.to_datetime(list(dates)), dtype=float)
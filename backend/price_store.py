@@ -0,0 +1,261 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+import yfinance as yf
+from django.conf import settings
+
+from .metrics import timed
+from .refresh import last_market_close, market_is_open
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+SNAP_DAYS = 7 # How far a weekend or holiday may be from the trading day it snaps to
+TICKER_PATTERN = re.compile(r"[A-Z0-9.\-^=]{1,15}") # Tickers name files, so nothing that could leave the directory
+
+
+class PriceStore:
+    '''
+    Local store of daily OHLCV bars, kept in one SQLite file per ticker.
+    Past bars never change, so only the range missing from the store is downloaded:
+    the head before the earliest requested date, and the tail since the last refresh.
+    The tail is settled once it was refreshed after the last market close while no session is in progress;
+    otherwise it is downloaded again, starting from the last stored bar, since that bar may
+    have been stored before its session closed. Requests for the same ticker are
+    serialized so that concurrent callers do not download the same bars twice.
+    Daily price ranges are also memoized per (ticker, date) in a small LRU cache.
+
+    Args:
+        directory (str): The directory holding the per-ticker SQLite files
+        downloader (callable): A function with the signature of yf.download
+        range_cache_size (int): The maximum number of memoized daily price ranges
+    '''
+    def __init__(self, directory, downloader=yf.download, range_cache_size=4096):
+        self.directory = directory
+        self.downloader = downloader
+        self.range_cache_size = range_cache_size
+        os.makedirs(directory, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._ranges = OrderedDict() # {(ticker, date): (trading_date, low, high)}
+        self._ranges_lock = threading.Lock()
+
+    def get_history(self, ticker, start, end=None):
+        '''
+        Retrieves the daily bars of a ticker, downloading only what is not stored yet.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            start (str): The first date requested (YYYY-MM-DD)
+            end (str): The date to stop at, exclusive (YYYY-MM-DD). Defaults to today.
+
+        Returns:
+            stock_data (pd.DataFrame): The OHLCV bars, indexed by date
+        '''
+        start = _parse_date(start)
+        end = _parse_date(end) if end else None
+        now = _now()
+
+        with self._lock(ticker), closing(self._connect(ticker)) as conn:
+            covered_from, refreshed_at = self._coverage(conn)
+            if covered_from is None:
+                self._download(conn, ticker, start, None)
+                covered_from, refreshed_at = start, now
+            else:
+                if start < covered_from:
+                    self._download(conn, ticker, start, covered_from)
+                    covered_from = start
+                if not _tail_settled(refreshed_at, now) and not _range_settled(end, refreshed_at):
+                    last_bar = conn.execute("SELECT MAX(date) FROM bars").fetchone()[0]
+                    self._download(conn, ticker, _parse_date(last_bar) if last_bar else covered_from, None)
+                    refreshed_at = now
+            self._set_coverage(conn, covered_from, refreshed_at)
+            return self._read(conn, start, end)
+
+    def get_daily_range(self, ticker, day):
+        '''
+        Retrieves a ticker's price range on a date, snapping weekends and holidays to the nearest trading day.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            day (str): The date (YYYY-MM-DD)
+
+        Returns:
+            price_range (tuple): The (trading_date, low, high) of the nearest trading day, or None if there is none
+        '''
+        return self.get_daily_ranges(ticker, [day])[_parse_date(day)]
+
+    def get_daily_ranges(self, ticker, days):
+        '''
+        Retrieves a ticker's price ranges on several dates with a single range read,
+        snapping weekends and holidays to the nearest trading day (the earlier one on a tie).
+        Ranges are memoized once a later bar is stored, since they can no longer change.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            days (list): The dates (YYYY-MM-DD)
+
+        Returns:
+            price_ranges (dict): The (trading_date, low, high) of each date, or None if no trading day is near it
+        '''
+        ticker = ticker.upper()
+        days = {_parse_date(day) for day in days}
+        price_ranges = {}
+        with self._ranges_lock:
+            for day in days:
+                if (ticker, day) in self._ranges:
+                    self._ranges.move_to_end((ticker, day))
+                    price_ranges[day] = self._ranges[(ticker, day)]
+        missing = sorted(days - set(price_ranges))
+        if not missing:
+            return price_ranges
+
+        stock_data = self.get_history(ticker, missing[0] - timedelta(days=SNAP_DAYS), missing[-1] + timedelta(days=SNAP_DAYS + 1))
+        trading_days = stock_data.index.date
+        today = date.today()
+        for day in missing:
+            price_ranges[day] = None
+            position = trading_days.searchsorted(day)
+            candidates = [i for i in (position - 1, position) if 0 <= i < len(trading_days)]
+            if not candidates:
+                continue
+            nearest = min(candidates, key=lambda i: abs((trading_days[i] - day).days)) # Earlier candidate first, so it wins ties
+            if abs((trading_days[nearest] - day).days) > SNAP_DAYS:
+                continue
+            price_ranges[day] = (trading_days[nearest], float(stock_data["Low"].iloc[nearest]), float(stock_data["High"].iloc[nearest]))
+
+            # Once a later bar is stored, neither the snap nor the bar itself can change
+            if trading_days[-1] > day and trading_days[nearest] < today:
+                with self._ranges_lock:
+                    self._ranges[(ticker, day)] = price_ranges[day]
+                    while len(self._ranges) > self.range_cache_size:
+                        self._ranges.popitem(last=False)
+        return price_ranges
+
+    def _lock(self, ticker):
+        with self._locks_guard:
+            return self._locks.setdefault(ticker.upper(), threading.Lock())
+
+    def _connect(self, ticker):
+        if not is_valid_ticker(ticker):
+            raise ValueError(f"Invalid ticker: {ticker!r}")
+        conn = sqlite3.connect(os.path.join(self.directory, f"{ticker.upper()}.sqlite3"))
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bars ("
+            "date TEXT PRIMARY KEY, open REAL, high REAL, low REAL, close REAL, volume REAL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS coverage (covered_from TEXT, refreshed_at TEXT)")
+        if "refreshed_on" in {column[1] for column in conn.execute("PRAGMA table_info(coverage)")}:
+            # Stores written before refreshes were timestamped hold a date, which is parsed as unknown
+            with conn:
+                conn.execute("ALTER TABLE coverage RENAME COLUMN refreshed_on TO refreshed_at")
+        return conn
+
+    def _coverage(self, conn):
+        row = conn.execute("SELECT covered_from, refreshed_at FROM coverage").fetchone()
+        if row is None:
+            return None, None
+        return _parse_date(row[0]), _parse_timestamp(row[1])
+
+    def _set_coverage(self, conn, covered_from, refreshed_at):
+        with conn:
+            conn.execute("DELETE FROM coverage")
+            conn.execute(
+                "INSERT INTO coverage VALUES (?, ?)",
+                (covered_from.isoformat(), refreshed_at.isoformat() if refreshed_at else None),
+            )
+
+    def _download(self, conn, ticker, start, end):
+        with timed("yfinance", "download"):
+            stock_data = self.downloader(
+                ticker,
+                start=start.isoformat(),
+                end=end.isoformat() if end else None,
+                progress=False,
+            )
+        if stock_data is None or stock_data.empty:
+            return
+        if isinstance(stock_data.columns, pd.MultiIndex): # Newer yfinance versions nest columns under the ticker
+            stock_data.columns = stock_data.columns.get_level_values(0)
+
+        rows = zip(stock_data.index.strftime("%Y-%m-%d"), *(stock_data[column].astype(float) for column in COLUMNS))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _read(self, conn, start, end):
+        query = "SELECT date, open, high, low, close, volume FROM bars WHERE date >= ?"
+        params = [start.isoformat()]
+        if end:
+            query += " AND date < ?"
+            params.append(end.isoformat())
+        stock_data = pd.read_sql_query(query + " ORDER BY date", conn, params=params, index_col="date")
+        stock_data.index = pd.to_datetime(stock_data.index)
+        stock_data.index.name = "Date"
+        stock_data.columns = COLUMNS
+        return stock_data
+
+
+def is_valid_ticker(ticker):
+    '''
+    Checks whether a ticker (in any case) is safe to name a file with: up to 15 letters, digits, '.', '-', '^' or '='.
+    '''
+    return isinstance(ticker, str) and TICKER_PATTERN.fullmatch(ticker.upper()) is not None
+
+
+def _parse_date(value):
+    '''
+    Parses a YYYY-MM-DD string (optionally with a time suffix) or a date into a date.
+    '''
+    return date.fromisoformat(str(value)[:10])
+
+
+def _parse_timestamp(value):
+    '''
+    Parses a timezone-aware ISO timestamp, or returns None for a missing value or a bare date.
+    '''
+    if not value or len(value) <= 10:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _tail_settled(refreshed_at, now):
+    '''
+    Checks whether the bars downloaded at refreshed_at are all final: no session has closed since, and none is in progress.
+    '''
+    return refreshed_at is not None and refreshed_at >= last_market_close(now) and not market_is_open(now)
+
+
+def _range_settled(end, refreshed_at):
+    '''
+    Checks whether every bar before end (exclusive) belongs to a session that had closed when the tail was refreshed.
+    '''
+    return end is not None and refreshed_at is not None and end <= last_market_close(refreshed_at).date() + timedelta(days=1)
+
+
+_price_store = None
+_price_store_lock = threading.Lock()
+
+
+def get_price_store():
+    '''
+    Returns the process-wide price store, created on first use from settings.PRICE_STORE_DIR.
+    Portfolios are built on several threads at once, so creation is locked: two stores would not share
+    their per-ticker locks, and could download the same bars twice.
+
+    Returns:
+        price_store (PriceStore): The shared price store
+    '''
+    global _price_store
+    if _price_store is None:
+        with _price_store_lock:
+            if _price_store is None:
+                _price_store = PriceStore(settings.PRICE_STORE_DIR, range_cache_size=settings.PRICE_RANGE_CACHE_SIZE)
+    return _price_store
@@ -0,0 +1,132 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    '''
+    Normalizes a question so that trivially different phrasings share a cache entry.
+
+    Args:
+        query (str): The question inputted by the user.
+
+    Returns:
+        normalized (str): The lowercased question, with whitespace collapsed and trailing punctuation removed
+    '''
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?!. ")
+
+
+class AnswerCache:
+    '''
+    An in-process cache of chatbot answers keyed on (ticker, normalized query),
+    evicting the least recently used entry once full and expiring entries after a TTL.
+    When a similarity threshold is given, a second tier matches a new question against
+    the cached questions for the same ticker by the cosine similarity of their embeddings.
+
+    Args:
+        max_entries (int): The maximum number of cached answers
+        ttl (float): The number of seconds an answer stays valid
+        similarity_threshold (float): The minimum cosine similarity for a semantic hit, or None to disable
+    '''
+    def __init__(self, max_entries=1024, ttl=86400, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # {(ticker, query): (answer, expires_at, embedding)}
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self):
+        return self.similarity_threshold is not None
+
+    def get(self, ticker, query, embed=None):
+        '''
+        Looks up a cached answer, first by exact (normalized) query and then, if enabled, by similarity.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            query (str): The question inputted by the user.
+            embed (callable): Returns the query's embedding; only called on an exact miss with the second tier enabled
+
+        Returns:
+            answer (str): The cached answer, or None on a miss
+        '''
+        key = (ticker, normalize_query(query))
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        if self.semantic and embed is not None:
+            embedding = _unit(embed())
+            with self._lock:
+                match = self._most_similar(ticker, embedding)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match][0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, ticker, query, answer, embedding=None):
+        '''
+        Caches an answer, evicting the least recently used entry if the cache is full.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            query (str): The question inputted by the user.
+            answer (str): The chatbot's answer.
+            embedding (list): The query's embedding, used by the second tier
+        '''
+        key = (ticker, normalize_query(query))
+        embedding = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        Returns the cache's counters for monitoring.
+
+        Returns:
+            stats (dict): The number of entries, exact hits, semantic hits and misses
+        '''
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+    def _expire(self, now):
+        expired = [key for key, (_, expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def _most_similar(self, ticker, embedding):
+        keys = [key for key, entry in self._entries.items() if key[0] == ticker and entry[2] is not None]
+        if not keys:
+            return None
+        similarities = np.stack([self._entries[key][2] for key in keys]) @ embedding
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
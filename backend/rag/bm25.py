@@ -0,0 +1,246 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+# Written by the ingestion scripts and read by the backend, so it lives outside of the Django settings
+DEFAULT_DIR = os.path.join(Path(__file__).resolve().parent.parent.parent, "bm25_index")
+
+# Tickers name the index files, so nothing that could leave the directory (as in price_store.TICKER_PATTERN)
+TICKER_PATTERN = re.compile(r"[A-Z0-9.\-^=]{1,15}")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or that the "
+    "their this to was were what when which who why will with".split()
+)
+
+
+def tokenize(text):
+    '''
+    Splits text into lowercased terms, keeping numbers such as years and decimals whole.
+
+    Args:
+        text (str): The text to tokenize
+
+    Returns:
+        terms (list): The terms, without stopwords
+    '''
+    return [term for term in re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text.lower()) if term not in STOPWORDS]
+
+
+def filing_date_key(value):
+    '''
+    Converts a date to the integer stored in chunk metadata (e.g. 20231103),
+    since Pinecone only supports range filters on numbers.
+
+    Args:
+        value (str | date): The date, as YYYY-MM-DD or a date object
+
+    Returns:
+        key (int): The date as YYYYMMDD, or None if no date is given
+    '''
+    if value is None:
+        return None
+    return int(str(value)[:10].replace("-", ""))
+
+
+def chunk_metadata(ticker, source, filed, id, text):
+    '''
+    Builds the metadata stored with a chunk in the vector store.
+    The filing date is left out when unknown, since Pinecone rejects null metadata values.
+
+    Args:
+        ticker (str): The ticker of the company
+        source (str): The source of the text (10-K or 10-Q)
+        filed (str): The filing date (YYYY-MM-DD), or None if unknown
+        id (str): The chunk's ID, so that retrieval can narrow the vector search to keyword matches
+        text (str): The chunk's text
+
+    Returns:
+        metadata (dict): {ticker, source, [filed], chunk_id, text}
+    '''
+    metadata = {"ticker": ticker, "source": source, "chunk_id": id, "text": text}
+    if filed is not None:
+        metadata["filed"] = filing_date_key(filed)
+    return metadata
+
+
+def metadata_filter(ticker, form=None, start_date=None, end_date=None):
+    '''
+    Builds the metadata filter for a ticker with optional form and filing date pre-filters,
+    in the Pinecone filter syntax that the local stores also understand.
+
+    Args:
+        ticker (str): The stock ticker (e.g. AAPL)
+        form (str): Only include chunks of this form (10-K or 10-Q)
+        start_date (str): Only include filings filed on or after this date (YYYY-MM-DD)
+        end_date (str): Only include filings filed on or before this date (YYYY-MM-DD)
+
+    Returns:
+        filter (dict): The metadata filter
+    '''
+    filter = {"ticker": ticker}
+    if form:
+        filter["source"] = form
+    filed = {}
+    if start_date:
+        filed["$gte"] = filing_date_key(start_date)
+    if end_date:
+        filed["$lte"] = filing_date_key(end_date)
+    if filed:
+        filter["filed"] = filed
+    return filter
+
+
+def matches(metadata, filter):
+    '''
+    Checks chunk metadata against a filter of exact values and $gte/$lte/$in conditions.
+    A chunk without the filtered field never matches.
+    '''
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        if value is None:
+            return False
+        if "$gte" in condition and value < condition["$gte"]:
+            return False
+        if "$lte" in condition and value > condition["$lte"]:
+            return False
+        if "$in" in condition and value not in condition["$in"]:
+            return False
+    return True
+
+
+class BM25Index:
+    '''
+    Per-ticker inverted indexes of filing chunks for BM25 keyword search, built at ingestion time.
+    Each ticker's index is one JSON file of its chunks and their term postings,
+    loaded into memory on first search and again whenever it changes on disk.
+
+    Args:
+        directory (str): The directory holding one JSON file per ticker
+        k1 (float): The BM25 term frequency saturation
+        b (float): The BM25 document length normalization
+    '''
+    def __init__(self, directory=DEFAULT_DIR, k1=1.5, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._loaded = {} # {ticker: (mtime, index)}
+
+    def add(self, ticker, chunks, source, filed=None):
+        '''
+        Adds a filing's chunks to the ticker's index. Chunks already indexed are skipped.
+
+        Args:
+            ticker (str): The ticker of the company
+            chunks (list): A list of (id, text) pairs
+            source (str): The source of the text (10-K or 10-Q)
+            filed (str): The filing date (YYYY-MM-DD), if known
+        '''
+        with self._lock:
+            index = self._read(ticker)
+            for id, text in chunks:
+                if id in index["docs"]:
+                    continue
+                terms = Counter(tokenize(text))
+                index["docs"][id] = {"text": text, "source": source, "filed": filing_date_key(filed), "length": sum(terms.values())}
+                for term, frequency in terms.items():
+                    index["postings"].setdefault(term, {})[id] = frequency
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(ticker)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(temp_path, path)
+
+    def search(self, ticker, query, k=5, filter=None):
+        '''
+        Ranks the ticker's chunks against the query by BM25.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL)
+            query (str): The question
+            k (int): The number of chunks to return
+            filter (dict): Additional metadata conditions, e.g. {"source": "10-K", "filed": {"$gte": 20230101}}
+
+        Returns:
+            results (list): A list of (Document, score) pairs, best first, with the chunk's ID as the chunk_id metadata;
+            chunks matching no query term are left out
+        '''
+        index = self._load(ticker)
+        docs = index["docs"]
+        if not docs:
+            return []
+        filter = {key: value for key, value in (filter or {}).items() if key != "ticker"}
+        average_length = index["total_length"] / len(docs)
+
+        scores = Counter()
+        for term in set(tokenize(query)):
+            postings = index["postings"].get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for id, frequency in postings.items():
+                length = docs[id]["length"]
+                scores[id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+
+        results = []
+        for id, score in scores.most_common():
+            doc = docs[id]
+            metadata = {"ticker": ticker, "source": doc["source"], "filed": doc["filed"], "chunk_id": id}
+            if filter and not matches(metadata, filter):
+                continue
+            results.append((Document(page_content=doc["text"], metadata=metadata), score))
+            if len(results) == k:
+                break
+        return results
+
+    def _load(self, ticker):
+        path = self._path(ticker)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        cached = self._loaded.get(ticker)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        index = self._read(ticker)
+        index["total_length"] = sum(doc["length"] for doc in index["docs"].values())
+        self._loaded[ticker] = (mtime, index)
+        return index
+
+    def _read(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return {"docs": {}, "postings": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def _path(self, ticker):
+        if not isinstance(ticker, str) or TICKER_PATTERN.fullmatch(ticker.upper()) is None:
+            raise ValueError(f"Invalid ticker: {ticker!r}")
+        return os.path.join(self.directory, f"{ticker}.json")
+
+
+_index = None
+
+
+def get_bm25_index():
+    '''
+    Returns the process-wide BM25 index, stored in BM25_INDEX_DIR if set.
+
+    Returns:
+        index (BM25Index): The shared BM25 index
+    '''
+    global _index
+    if _index is None:
+        _index = BM25Index(os.environ.get("BM25_INDEX_DIR", DEFAULT_DIR))
+    return _index
@@ -1,45 +1,516 @@
+import logging
 import os
+import threading
+import time
+from django.conf import settings
 from dotenv import load_dotenv
-from langchain_openai import OpenAI, OpenAIEmbeddings
-from langchain.chains import RetrievalQA
-from langchain_pinecone import PineconeVectorStore
+from langchain_core.prompts import format_document
+from langchain_openai import OpenAI
+from langchain.chains.question_answering import load_qa_chain
+from ..concurrency import run_blocking
+from ..metrics import record_cache_lookup, timed
+from .answer_cache import AnswerCache
+from .bm25 import get_bm25_index, metadata_filter
+from .context import pack_context
+from .vector_store import build_vector_store
 
+logger = logging.getLogger(__name__)
 
-def vector_search(ticker, query):
+load_dotenv()
+
+
+class RAGPipeline:
+    '''
+    The long-lived objects used to answer chatbot questions: the vector store (with its
+    embedding model), an optional BM25 keyword index, and the LLM behind a "stuff"
+    question answering chain. These are built once per process and shared across requests;
+    the ticker and any form or date filters are passed at call time instead of being baked into a retriever.
+    Retrieved chunks are packed into a token budget before they reach the LLM.
+
+    Args:
+        vector_store (VectorStore): The vector store holding the filing embeddings
+        llm (BaseLLM): The LLM used to generate answers
+        k (int): The number of chunks retrieved per question
+        sparse_index (BM25Index): The keyword index fused with the vector results, or None for vector search only
+        context_tokens (int): The maximum number of context tokens sent to the LLM, or None for no limit
+        shortlist (int): The number of keyword matches the vector search is narrowed to, or 0 to search all of a ticker's chunks
+    '''
+    def __init__(self, vector_store, llm, k=5, sparse_index=None, context_tokens=None, shortlist=50):
+        self.vector_store = vector_store
+        self.llm = llm
+        self.k = k
+        self.sparse_index = sparse_index
+        self.context_tokens = context_tokens
+        self.shortlist = shortlist
+        self.chain = load_qa_chain(llm, chain_type="stuff")
+
+    def embed_query(self, ticker, query):
+        '''
+        Embeds the query the same way it is embedded for retrieval.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question inputted by the user.
+
+        Returns:
+            embedding (list): The query's embedding
+        '''
+        with timed("openai", "embedding"):
+            return self.vector_store.embeddings.embed_query(ticker + ": " + query)
+
+    def retrieve(self, ticker, query, embedding=None, filters=None):
+        '''
+        Retrieves the chunks most relevant to the query for the given ticker.
+        The form and date filters are pushed down into both the vector and keyword searches.
+        With a keyword index, the keyword search runs first and, when it finds at least k chunks,
+        the vector search only ranks its shortlist (by chunk ID) instead of every chunk of the ticker.
+        The two rankings are then merged by reciprocal rank fusion, so keyword-heavy questions
+        (e.g. "EBITDA 2023") still reach the exact chunks while the LLM is given no more than k chunks.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question, with the ticker already injected.
+            embedding (list): The query's embedding, if already computed by embed_query
+            filters (dict): Optional form, start_date and end_date pre-filters
+
+        Returns:
+            documents (list): The retrieved chunks
+        '''
+        filter = metadata_filter(ticker, **(filters or {}))
+        if embedding is None:
+            with timed("openai", "embedding"):
+                embedding = self.vector_store.embeddings.embed_query(query)
+        if self.sparse_index is None:
+            return self.dense_search(embedding, filter)
+
+        sparse = [document for document, _ in self.sparse_index.search(ticker, query, k=max(self.shortlist, self.k), filter=filter)]
+        dense = []
+        if self.shortlist and len(sparse) >= self.k:
+            dense = self.dense_search(embedding, dict(filter, chunk_id={"$in": [document.metadata["chunk_id"] for document in sparse]}))
+        if len(dense) < self.k:
+            # Too few keyword matches, or chunks embedded before their chunk_id was stored, so search every chunk
+            dense = self.dense_search(embedding, filter)
+        return reciprocal_rank_fusion([dense, sparse[:self.k]], self.k)
+
+    def dense_search(self, embedding, filter):
+        '''
+        Retrieves the k chunks closest to the query embedding that match the filter.
+
+        Args:
+            embedding (list): The query's embedding
+            filter (dict): The metadata filter, in the Pinecone filter syntax
+
+        Returns:
+            documents (list): The retrieved chunks, most similar first
+        '''
+        with timed("vector_store", "search"):
+            return [document for document, _ in self.vector_store.similarity_search_by_vector_with_score(embedding, k=self.k, filter=filter)]
+
+    def pack(self, ticker, query, documents):
+        '''
+        Merges overlapping and near-duplicate chunks, reranks them and packs them into the token budget,
+        logging the context tokens saved.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL), for logging
+            query (str): The question, with the ticker already injected.
+            documents (list): The retrieved chunks
+
+        Returns:
+            documents (list): The chunks to send to the LLM
+        '''
+        documents, stats = pack_context(documents, query, self.context_tokens, self.llm.get_num_tokens)
+        logger.info(
+            "context %s: %d chunks, %d -> %d tokens (saved %d)",
+            ticker, len(documents), stats["tokens_before"], stats["tokens_after"], stats["tokens_saved"],
+        )
+        return documents
+
+    def answer(self, ticker, query, embedding=None, filters=None):
+        '''
+        Retrieves the chunks most relevant to the query for the given ticker and generates an answer.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question inputted by the user.
+            embedding (list): The query's embedding, if already computed by embed_query
+            filters (dict): Optional form, start_date and end_date pre-filters
+
+        Returns:
+            answer (str): The LLM's answer.
+            timings (dict): The seconds spent on retrieval and generation
+        '''
+        query = ticker + ": " + query # Inject ticker into query to filter documents
+
+        start = time.perf_counter()
+        documents = self.pack(ticker, query, self.retrieve(ticker, query, embedding, filters))
+        retrieved = time.perf_counter()
+        with timed("openai", "completion"):
+            answer = self.chain.invoke({"input_documents": documents, "question": query})["output_text"]
+        generated = time.perf_counter()
+
+        return answer, {"retrieval": retrieved - start, "generation": generated - retrieved}
+
+    def stream(self, ticker, query, embedding=None, filters=None):
+        '''
+        Same as answer, but yields the LLM's answer in chunks as they are generated.
+        The prompt is built exactly as the "stuff" chain builds it.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question inputted by the user.
+            embedding (list): The query's embedding, if already computed by embed_query
+            filters (dict): Optional form, start_date and end_date pre-filters
+
+        Yields:
+            chunk (str): The next piece of the answer
+        '''
+        query = ticker + ": " + query # Inject ticker into query to filter documents
+        documents = self.pack(ticker, query, self.retrieve(ticker, query, embedding, filters))
+        with timed("openai", "completion_stream"): # Until the whole answer is streamed
+            yield from self.llm.stream(self.prompt(query, documents))
+
+    def prompt(self, query, documents):
+        '''
+        Builds the prompt exactly as the "stuff" chain builds it.
+
+        Args:
+            query (str): The question, with the ticker already injected.
+            documents (list): The chunks to send to the LLM
+
+        Returns:
+            prompt (str): The LLM prompt
+        '''
+        context = self.chain.document_separator.join(
+            format_document(document, self.chain.document_prompt) for document in documents
+        )
+        return self.chain.llm_chain.prompt.format(**{self.chain.document_variable_name: context, "question": query})
+
+    async def aanswer(self, ticker, query, embedding=None, filters=None):
+        '''
+        Async version of answer, for the async views. The query is embedded and the answer generated
+        with the async OpenAI clients; the vector and keyword searches, which have blocking clients,
+        run on a thread.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question inputted by the user.
+            embedding (list): The query's embedding, if already computed by embed_query
+            filters (dict): Optional form, start_date and end_date pre-filters
+
+        Returns:
+            answer (str): The LLM's answer.
+            timings (dict): The seconds spent on retrieval and generation
+        '''
+        query = ticker + ": " + query # Inject ticker into query to filter documents
+
+        start = time.perf_counter()
+        documents = self.pack(ticker, query, await self.aretrieve(ticker, query, embedding, filters))
+        retrieved = time.perf_counter()
+        with timed("openai", "completion"):
+            answer = (await self.chain.ainvoke({"input_documents": documents, "question": query}))["output_text"]
+        generated = time.perf_counter()
+
+        return answer, {"retrieval": retrieved - start, "generation": generated - retrieved}
+
+    async def astream(self, ticker, query, embedding=None, filters=None):
+        '''
+        Async version of stream, yielding the LLM's answer in chunks as they are generated.
+
+        Args:
+            ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+            query (str): The question inputted by the user.
+            embedding (list): The query's embedding, if already computed by embed_query
+            filters (dict): Optional form, start_date and end_date pre-filters
+
+        Yields:
+            chunk (str): The next piece of the answer
+        '''
+        query = ticker + ": " + query # Inject ticker into query to filter documents
+        documents = self.pack(ticker, query, await self.aretrieve(ticker, query, embedding, filters))
+        with timed("openai", "completion_stream"): # Until the whole answer is streamed
+            async for chunk in self.llm.astream(self.prompt(query, documents)):
+                yield chunk
+
+    async def aretrieve(self, ticker, query, embedding=None, filters=None):
+        '''
+        Async version of retrieve. The query, with the ticker already injected, is embedded asynchronously
+        (as embed_query would), and the searches run on a thread.
+        '''
+        if embedding is None:
+            with timed("openai", "embedding"):
+                embedding = await self.vector_store.embeddings.aembed_query(query)
+        return await run_blocking(self.retrieve, ticker, query, embedding, filters)
+
+
+def build_pipeline():
+    '''
+    Builds the RAG pipeline from the OpenAI environment variables,
+    on the vector store backend selected in settings (Pinecone or local),
+    fused with the BM25 keyword index (narrowed to settings.CHATBOT_SHORTLIST) and packed into the context budget from settings.
+
+    Returns:
+        pipeline (RAGPipeline): The RAG pipeline
+    '''
+    vector_store = build_vector_store(settings.VECTOR_STORE_BACKEND)
+
+    llm = OpenAI(
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        temperature=0,
+    )
+    return RAGPipeline(
+        vector_store, llm, sparse_index=get_bm25_index(),
+        context_tokens=settings.CHATBOT_CONTEXT_TOKENS, shortlist=settings.CHATBOT_SHORTLIST,
+    )
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    '''
+    Returns the process-wide RAG pipeline, building it on first use.
+
+    Returns:
+        pipeline (RAGPipeline): The shared RAG pipeline
+    '''
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = build_pipeline()
+    return _pipeline
+
+
+_answer_cache = None
+
+
+def get_answer_cache():
+    '''
+    Returns the process-wide chatbot answer cache, configured from settings on first use.
+
+    Returns:
+        answer_cache (AnswerCache): The shared answer cache
+    '''
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            max_entries=settings.CHATBOT_CACHE_SIZE,
+            ttl=settings.CHATBOT_CACHE_TTL,
+            similarity_threshold=settings.CHATBOT_CACHE_SIMILARITY,
+        )
+    return _answer_cache
+
+
+def vector_search(ticker, query, filters=None):
     '''
     Performs vector search on Pinecone to retrieve relevant embeddings
     while filtering results based on ticker specified.
     Uses OpenAI's gpt-3.5-turbo to generate a response given the retrieved embeddings.
+    Answers are cached per (ticker, filters, normalized query), and optionally matched to similar cached questions.
 
     Args:
         ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
         query (str): The question inputted by the user.
+        filters (dict): Optional form (10-K or 10-Q), start_date and end_date (YYYY-MM-DD) pre-filters
 
     Returns:
         retriever_output (str): The chatbot's answer.
     '''
-    load_dotenv()
-    os.environ['PINECONE_API_KEY'] = os.getenv("PINECONE_API_KEY")
+    start = time.perf_counter()
+    pipeline = get_pipeline()
+    setup = time.perf_counter() - start
 
-    # Define the filter based on the metadata field and value
-    vector_search = PineconeVectorStore(
-        embedding=OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")),
-        pinecone_api_key=os.getenv("PINECONE_API_KEY"),
-        index_name=os.getenv("VECTOR_SEARCH_INDEX"),
-    )
+    retriever_output, scope, embedding = _lookup_answer("vector_search", pipeline, ticker, query, filters)
+    if retriever_output is not None:
+        return retriever_output
 
-    llm = OpenAI(
-        openai_api_key=os.getenv("OPENAI_API_KEY"),
-        temperature=0,
-    )
-    
-    retriever = vector_search.as_retriever(search_kwargs={"k": 5, "filter": {"ticker": ticker}})
-    qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
+    retriever_output, timings = pipeline.answer(ticker, query, embedding[0], filters)
+    return _store_answer("vector_search", ticker, query, scope, embedding, retriever_output, setup, timings)
+
+
+def stream_vector_search(ticker, query, filters=None):
+    '''
+    Streaming version of vector_search, yielding the chatbot's answer in chunks as they are generated.
+    Dollar signs are escaped and leading whitespace is stripped on the fly,
+    and the full answer is added to the answer cache once the stream completes.
+
+    Args:
+        ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+        query (str): The question inputted by the user.
+        filters (dict): Optional form (10-K or 10-Q), start_date and end_date (YYYY-MM-DD) pre-filters
+
+    Yields:
+        chunk (str): The next piece of the chatbot's answer.
+    '''
+    start = time.perf_counter()
+    pipeline = get_pipeline()
+
+    retriever_output, scope, embedding = _lookup_answer("stream_vector_search", pipeline, ticker, query, filters)
+    if retriever_output is not None:
+        yield retriever_output
+        return
+
+    stream = _AnswerStream("stream_vector_search", ticker, start)
+    for chunk in pipeline.stream(ticker, query, embedding[0], filters):
+        chunk = stream.clean(chunk)
+        if chunk:
+            yield chunk
+    stream.store(query, scope, embedding)
+
+
+async def avector_search(ticker, query, filters=None):
+    '''
+    Async version of vector_search, for the async views.
+    The cache lookup (which may embed the query for the similarity tier) runs on a thread.
+
+    Args:
+        ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+        query (str): The question inputted by the user.
+        filters (dict): Optional form (10-K or 10-Q), start_date and end_date (YYYY-MM-DD) pre-filters
+
+    Returns:
+        retriever_output (str): The chatbot's answer.
+    '''
+    start = time.perf_counter()
+    pipeline = await run_blocking(get_pipeline)
+    setup = time.perf_counter() - start
+
+    retriever_output, scope, embedding = await run_blocking(_lookup_answer, "avector_search", pipeline, ticker, query, filters)
+    if retriever_output is not None:
+        return retriever_output
+
+    retriever_output, timings = await pipeline.aanswer(ticker, query, embedding[0], filters)
+    return _store_answer("avector_search", ticker, query, scope, embedding, retriever_output, setup, timings)
+
+
+async def astream_vector_search(ticker, query, filters=None):
+    '''
+    Async version of stream_vector_search, for the async views.
+
+    Args:
+        ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+        query (str): The question inputted by the user.
+        filters (dict): Optional form (10-K or 10-Q), start_date and end_date (YYYY-MM-DD) pre-filters
+
+    Yields:
+        chunk (str): The next piece of the chatbot's answer.
+    '''
+    start = time.perf_counter()
+    pipeline = await run_blocking(get_pipeline)
+
+    retriever_output, scope, embedding = await run_blocking(_lookup_answer, "astream_vector_search", pipeline, ticker, query, filters)
+    if retriever_output is not None:
+        yield retriever_output
+        return
+
+    stream = _AnswerStream("astream_vector_search", ticker, start)
+    async for chunk in pipeline.astream(ticker, query, embedding[0], filters):
+        chunk = stream.clean(chunk)
+        if chunk:
+            yield chunk
+    stream.store(query, scope, embedding)
+
+
+def reciprocal_rank_fusion(rankings, k, c=60):
+    '''
+    Merges several rankings of chunks into one, scoring each chunk by the sum of 1 / (c + rank)
+    over the rankings it appears in. Chunks are matched by their text, since Pinecone results carry no IDs.
+
+    Args:
+        rankings (list): Lists of documents, each ordered best first
+        k (int): The number of documents to return
+        c (int): Dampens the weight of the top ranks
+
+    Returns:
+        documents (list): The k best documents
+    '''
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            scores[document.page_content] = scores.get(document.page_content, 0) + 1 / (c + rank + 1)
+            documents.setdefault(document.page_content, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[text] for text in best]
+
+
+def _cache_scope(ticker, filters):
+    '''
+    Answers to the same question with different filters are cached separately.
+    '''
+    filters = {key: value for key, value in (filters or {}).items() if value}
+    if not filters:
+        return ticker
+    return ticker + "|" + "|".join(f"{key}={filters[key]}" for key in sorted(filters))
+
+
+def _lazy_embedding(pipeline, ticker, query):
+    '''
+    The query embedding is only computed if the answer cache's similarity tier asks for it,
+    and is then reused for retrieval. Returns a one-item list holding the embedding (or None)
+    and the function that computes it.
+    '''
+    embedding = [None]
+    def embed():
+        embedding[0] = pipeline.embed_query(ticker, query)
+        return embedding[0]
+    return embedding, embed
+
+
+def _lookup_answer(name, pipeline, ticker, query, filters):
+    '''
+    Looks a question up in the answer cache, recording the hit or miss. Returns the cached answer (or None),
+    the cache scope, and the one-item list holding the query embedding if the lookup computed it.
+    '''
+    embedding, embed = _lazy_embedding(pipeline, ticker, query)
+    scope = _cache_scope(ticker, filters)
+    retriever_output = get_answer_cache().get(scope, query, embed)
+    record_cache_lookup("chatbot_answer", retriever_output is not None)
+    if retriever_output is not None:
+        logger.info("%s %s: answered from cache", name, ticker)
+    return retriever_output, scope, embedding
+
+
+def _store_answer(name, ticker, query, scope, embedding, retriever_output, setup, timings):
+    '''
+    Logs how long a generated answer took, cleans it up and adds it to the answer cache.
+    '''
+    logger.info(
+        "%s %s: setup=%.3fs retrieval=%.3fs generation=%.3fs",
+        name, ticker, setup, timings["retrieval"], timings["generation"],
     )
-    
-    # Inject ticker into query to filter documents
-    retriever_output = qa.invoke({"query": ticker + ": " + query})["result"]
-    return retriever_output.replace("$", "\$").lstrip() # Escape dollar signs to prevent LaTeX rendering issues
\ No newline at end of file
+    retriever_output = _escape_dollars(retriever_output).lstrip()
+    get_answer_cache().set(scope, query, retriever_output, embedding[0])
+    return retriever_output
+
+
+class _AnswerStream:
+    '''
+    Cleans up the chunks of a streamed answer as they arrive, the same way _store_answer cleans up a whole answer,
+    and adds the full answer to the answer cache once the stream completes.
+    '''
+    def __init__(self, name, ticker, start):
+        self.name = name
+        self.ticker = ticker
+        self.start = start
+        self.chunks = []
+
+    def clean(self, chunk):
+        if not self.chunks:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return None
+            logger.info("%s %s: first token after %.3fs", self.name, self.ticker, time.perf_counter() - self.start)
+        chunk = _escape_dollars(chunk)
+        self.chunks.append(chunk)
+        return chunk
+
+    def store(self, query, scope, embedding):
+        logger.info("%s %s: completed after %.3fs", self.name, self.ticker, time.perf_counter() - self.start)
+        get_answer_cache().set(scope, query, "".join(self.chunks), embedding[0])
+
+
+def _escape_dollars(text):
+    return text.replace("$", "\\$") # Escape dollar signs to prevent LaTeX rendering issues
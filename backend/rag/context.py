@@ -0,0 +1,143 @@
+import math
+from collections import Counter
+
+from langchain_core.documents import Document
+from .bm25 import tokenize
+
+
+def merge_overlapping(documents, min_overlap=50):
+    '''
+    Merges chunks of the same filing whose text overlaps, as neighbouring chunks from the
+    text splitter do, so the overlapping text is only sent to the LLM once.
+    A chunk contained in another is dropped.
+
+    Args:
+        documents (list): The retrieved chunks, best first
+        min_overlap (int): The minimum number of overlapping characters to merge on
+
+    Returns:
+        documents (list): The merged chunks, in the order of their best-ranked part
+    '''
+    merged = []
+    for document in documents:
+        text = document.page_content
+        for i, other in enumerate(merged):
+            if other.metadata.get("ticker") != document.metadata.get("ticker") or other.metadata.get("source") != document.metadata.get("source"):
+                continue
+            combined = _merge_text(other.page_content, text, min_overlap)
+            if combined is not None:
+                merged[i] = Document(page_content=combined, metadata=other.metadata)
+                break
+        else:
+            merged.append(document)
+
+    # Merging can make two earlier chunks overlap, e.g. when the middle of three neighbours ranks last
+    if len(merged) < len(documents):
+        return merge_overlapping(merged, min_overlap)
+    return merged
+
+
+def drop_near_duplicates(documents, threshold=0.8):
+    '''
+    Drops chunks whose word trigrams mostly repeat those of a better-ranked chunk,
+    such as boilerplate repeated across a company's 10-K and 10-Q.
+
+    Args:
+        documents (list): The chunks, best first
+        threshold (float): The Jaccard similarity above which a chunk is a duplicate
+
+    Returns:
+        documents (list): The chunks that are not near-duplicates
+    '''
+    kept, kept_shingles = [], []
+    for document in documents:
+        words = document.page_content.lower().split()
+        shingles = {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(document)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def rerank(documents, query, retrieval_weight=0.5):
+    '''
+    Reorders chunks by a cheap local score: the IDF-weighted share of the query's terms
+    each chunk contains, blended with its retrieval rank.
+
+    Args:
+        documents (list): The chunks, best first
+        query (str): The question
+        retrieval_weight (float): The weight of the retrieval rank against the term score
+
+    Returns:
+        documents (list): The chunks, best first
+    '''
+    terms = set(tokenize(query))
+    if not terms or len(documents) < 2:
+        return documents
+
+    chunk_terms = [set(tokenize(document.page_content)) for document in documents]
+    frequencies = Counter(term for chunk in chunk_terms for term in chunk & terms)
+    weights = {term: math.log(1 + len(documents) / (1 + frequencies[term])) for term in terms}
+    total = sum(weights.values())
+
+    def score(i):
+        coverage = sum(weights[term] for term in chunk_terms[i] & terms) / total
+        return (1 - retrieval_weight) * coverage + retrieval_weight * (1 - i / len(documents))
+
+    return [documents[i] for i in sorted(range(len(documents)), key=score, reverse=True)]
+
+
+def pack_context(documents, query, token_budget, count_tokens):
+    '''
+    Assembles the chunks sent to the LLM: merges overlapping neighbours, drops near-duplicates,
+    reranks, and keeps the best chunks that fit in the token budget. If the best chunk
+    does not fit on its own, it is cut to the budget.
+
+    Args:
+        documents (list): The retrieved chunks, best first
+        query (str): The question
+        token_budget (int): The maximum number of context tokens, or None for no limit
+        count_tokens (callable): Returns the number of tokens in a text
+
+    Returns:
+        documents (list): The chunks to send, best first
+        stats (dict): The context tokens before and after packing, and the tokens saved
+    '''
+    tokens_before = sum(count_tokens(document.page_content) for document in documents)
+    candidates = rerank(drop_near_duplicates(merge_overlapping(documents)), query)
+
+    packed, tokens_after = [], 0
+    for document in candidates:
+        tokens = count_tokens(document.page_content)
+        if token_budget is not None and tokens_after + tokens > token_budget:
+            if packed:
+                continue
+            # The best chunk is always sent, cut to the budget if needed
+            text = document.page_content[:len(document.page_content) * token_budget // tokens]
+            document = Document(page_content=text, metadata=document.metadata)
+            tokens = count_tokens(text)
+        packed.append(document)
+        tokens_after += tokens
+
+    return packed, {"tokens_before": tokens_before, "tokens_after": tokens_after, "tokens_saved": tokens_before - tokens_after}
+
+
+def _merge_text(first, second, min_overlap):
+    '''
+    Joins two texts if one contains the other or if the end of one is the start of the other.
+    Returns None if they do not overlap.
+    '''
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for left, right in ((first, second), (second, first)):
+        probe = right[:min_overlap]
+        start = left.find(probe, max(len(left) - len(right), 0))
+        while start != -1:
+            if right.startswith(left[start:]):
+                return left + right[len(left) - start:]
+            start = left.find(probe, start + 1)
+    return None
@@ -1,45 +1,69 @@
 import edgar
 import os
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_pinecone import PineconeVectorStore
+from backend.rag.bm25 import chunk_metadata, get_bm25_index
+from backend.rag.embedding_manifest import chunk_id, get_embedding_manifest, pending_chunks
+from backend.rag.ticker_registry import get_ticker_registry
+from backend.rag.vector_store import build_vector_store, vector_store_key
 
 
-def generate_embeddings(text, ticker, source, chunk_size=1500, chunk_overlap=500):
+def split_text(text, chunk_size=1500, chunk_overlap=500):
+    '''
+    Splits the text extracted from a company's 10-K or 10-Q into overlapping chunks for embedding.
+
+    Args:
+        text (str): The text extracted from the company's 10-K or 10-Q
+        chunk_size (int): The size of the chunks to split the text into
+        chunk_overlap (int): The amount of overlap between chunks
+
+    Returns:
+        texts (list): The chunks of text
+    '''
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_text(text)
+
+
+def generate_embeddings(text, ticker, source, chunk_size=1500, chunk_overlap=500, accession=None, filed=None, backend=None):
     '''
     Given the text extracted from a company's 10-K or 10-Q, 
-    use OpenAI to generate the vector embeddings and store in Pinecone.
+    use OpenAI to generate the vector embeddings and store in Pinecone
+    (or in the local vector store, with backend="local" or VECTOR_STORE_BACKEND=local).
+    Chunks get deterministic IDs, and chunks already recorded in the embedding
+    manifest are skipped, so re-running on the same filing embeds nothing again.
     
     Args:
         text (str): The text extracted from the company's 10-K or 10-Q
         ticker (str): The ticker of the company, for filtering
         source (str): The source of the text (10-K or 10-Q)
+        accession (str): The filing's accession number, part of each chunk's ID
+        filed (str): The filing date (YYYY-MM-DD), for date filtering
         chunk_size (int): The size of the chunks to split the text into
         chunk_overlap (int): The amount of overlap between chunks
+        backend (str): The vector store backend, "pinecone" or "local"
     
     Returns:
         embeddings (list): A list of the embeddings generated
     '''
 
-    # Connect to Pinecone
     load_dotenv()
-    os.environ['PINECONE_API_KEY'] = os.getenv("PINECONE_API_KEY")
 
-    # Split the text into smaller chunks and embed
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    texts = text_splitter.split_text(text)
+    # Split the text into smaller chunks and embed only those not embedded yet
+    manifest = get_embedding_manifest(vector_store_key(backend))
+    chunks = split_text(text, chunk_size, chunk_overlap)
+    texts, ids = pending_chunks(chunks, ticker, source, accession, manifest)
+
+    metadata = [chunk_metadata(ticker, source, filed, id, text) for text, id in zip(texts, ids)]
+
+    if texts:
+        build_vector_store(backend).add_texts(texts, metadatas=metadata, ids=ids)
+        manifest.add(ids, ticker, source)
 
-    metadata = []
-    for text in texts:
-        metadata.append({"ticker": ticker, "source": source, "text": text})
+    # Index every chunk for keyword search, including those embedded before
+    get_bm25_index().add(ticker, [(chunk_id(ticker, source, accession, chunk), chunk) for chunk in chunks], source, filed)
 
-    PineconeVectorStore.from_texts(
-        texts,
-        embedding=OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")),
-        metadatas=metadata,
-        index_name=os.getenv("VECTOR_SEARCH_INDEX"),
-    )
+    # Record the ticker so the backend can list it without querying the vector store
+    get_ticker_registry().add(ticker, source)
 
 
 if __name__ == "__main__":
@@ -49,4 +73,4 @@ if __name__ == "__main__":
     EMAIL = os.environ.get("EMAIL")
     edgar.set_identity(NAME + " " + EMAIL)
     filings = edgar.Company(ticker).get_filings(form=source).latest(1)
-    generate_embeddings(filings.text(), ticker, source)
\ No newline at end of file
+    generate_embeddings(filings.text(), ticker, source, accession=filings.accession_no, filed=str(filings.filing_date))
\ No newline at end of file
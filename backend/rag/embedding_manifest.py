@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+DEFAULT_PATH = os.path.join(Path(__file__).resolve().parent.parent.parent, "embedding_manifest.sqlite3")
+
+
+def chunk_id(ticker, source, accession, text):
+    '''
+    Builds a deterministic vector ID for a chunk, so re-ingesting the same filing
+    produces the same IDs and upserts overwrite instead of duplicating.
+
+    Args:
+        ticker (str): The ticker of the company
+        source (str): The source of the text (10-K or 10-Q)
+        accession (str): The filing's accession number, or None if unknown
+        text (str): The chunk's text
+
+    Returns:
+        id (str): The chunk's ID, e.g. "AAPL:10-K:0000320193-23-000106:3f2a..."
+    '''
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    return f"{ticker}:{source}:{accession or 'unknown'}:{text_hash}"
+
+
+def pending_chunks(texts, ticker, source, accession, manifest):
+    '''
+    Assigns each chunk its ID and keeps only the chunks that are not embedded yet,
+    dropping repeated chunks within the filing.
+
+    Args:
+        texts (list): The chunks of the filing
+        ticker (str): The ticker of the company
+        source (str): The source of the text (10-K or 10-Q)
+        accession (str): The filing's accession number, or None if unknown
+        manifest (EmbeddingManifest): The record of embedded chunks
+
+    Returns:
+        texts (list): The chunks to embed, in their original order
+        ids (list): The IDs of those chunks
+    '''
+    ids = {}
+    for text in texts:
+        ids.setdefault(chunk_id(ticker, source, accession, text), text)
+    missing = manifest.missing(list(ids))
+    pending = [(id, text) for id, text in ids.items() if id in missing]
+    return [text for _, text in pending], [id for id, _ in pending]
+
+
+class EmbeddingManifest:
+    '''
+    A local SQLite record of the chunk IDs that have already been embedded and upserted,
+    so that re-runs only pay to embed new or changed chunks.
+    IDs are recorded per vector store, so switching stores (e.g. from Pinecone to local) embeds everything into the new one.
+    Chunks recorded before stores were distinguished (in the chunks table) are ignored, since their store is unknown.
+
+    Args:
+        path (str): The path of the SQLite file
+        store (str): The vector store the chunks are upserted into, as named by vector_store.vector_store_key
+    '''
+    def __init__(self, path=DEFAULT_PATH, store=""):
+        self.path = path
+        self.store = store
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedded_chunks "
+                "(store TEXT, id TEXT, ticker TEXT, source TEXT, PRIMARY KEY (store, id))"
+            )
+
+    def missing(self, ids):
+        '''
+        Filters a list of chunk IDs down to those not embedded yet.
+
+        Args:
+            ids (list): The chunk IDs
+
+        Returns:
+            missing (set): The IDs that are not in the manifest
+        '''
+        with self._lock, closing(self._connect()) as conn:
+            conn.execute("CREATE TEMP TABLE candidates (id TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO candidates VALUES (?)", ((id,) for id in ids))
+            rows = conn.execute(
+                "SELECT id FROM candidates WHERE id NOT IN (SELECT id FROM embedded_chunks WHERE store = ?)", (self.store,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, ids, ticker, source):
+        '''
+        Records chunk IDs as embedded, after they have been upserted.
+
+        Args:
+            ids (list): The chunk IDs
+            ticker (str): The ticker of the company
+            source (str): The source of the text (10-K or 10-Q)
+        '''
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO embedded_chunks VALUES (?, ?, ?, ?)", ((self.store, id, ticker, source) for id in ids))
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+
+_manifests = {}
+
+
+def get_embedding_manifest(store):
+    '''
+    Returns the process-wide embedding manifest of a vector store, stored at EMBEDDING_MANIFEST_PATH if set.
+
+    Args:
+        store (str): The vector store, as named by vector_store.vector_store_key
+
+    Returns:
+        manifest (EmbeddingManifest): The shared embedding manifest of the store
+    '''
+    if store not in _manifests:
+        _manifests[store] = EmbeddingManifest(os.environ.get("EMBEDDING_MANIFEST_PATH", DEFAULT_PATH), store)
+    return _manifests[store]
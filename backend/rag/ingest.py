@@ -0,0 +1,230 @@
+'''
+Bulk ingestion of 10-K and 10-Q filings into the vector index.
+
+Filings are fetched and split in a process pool, and their chunks are embedded and
+upserted in batches on a bounded thread pool. Each completed (ticker, form) pair is
+recorded in a checkpoint file, so an interrupted run resumes where it stopped.
+Chunks already in the embedding manifest are never embedded again, so even a
+filing interrupted halfway only embeds its remaining batches. Each filing's chunks
+are also added to its ticker's BM25 keyword index.
+
+Usage (from the project root):
+    python -m backend.rag.ingest --tickers AAPL MSFT NVDA --forms 10-K 10-Q
+    python -m backend.rag.ingest --tickers-file sp500.txt --processes 8 --embed-workers 4
+'''
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import edgar
+from dotenv import load_dotenv
+from backend.rag.bm25 import chunk_metadata, get_bm25_index
+from backend.rag.embed import split_text
+from backend.rag.embedding_manifest import chunk_id, get_embedding_manifest, pending_chunks
+from backend.rag.ticker_registry import get_ticker_registry
+from backend.rag.vector_store import build_vector_store, vector_store_key
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    '''
+    A JSON file of the (ticker, form) pairs that have been fully ingested, per vector store.
+    It is rewritten atomically after every completed pair.
+    A checkpoint written before stores were distinguished is ignored, since its store is unknown.
+
+    Args:
+        path (str): The path of the checkpoint file
+        store (str): The vector store being ingested into, as named by vector_store.vector_store_key
+    '''
+    def __init__(self, path, store=""):
+        self.path = path
+        self.store = store
+        self._lock = threading.Lock()
+        self._stores = {} # {store: [[ticker, form], ...]}
+        if os.path.exists(path):
+            with open(path) as f:
+                done = json.load(f)["done"]
+            if isinstance(done, dict):
+                self._stores = done
+        self._done = {tuple(job) for job in self._stores.get(store, [])}
+
+    def __contains__(self, job):
+        return tuple(job) in self._done
+
+    def mark_done(self, ticker, form):
+        with self._lock:
+            self._done.add((ticker, form))
+            self._stores[self.store] = sorted(self._done)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"done": self._stores}, f)
+            os.replace(temp_path, self.path)
+
+
+def set_edgar_identity():
+    '''
+    Sets the identity EDGAR requires, from the NAME and EMAIL environment variables.
+    Used as the initializer of each worker process.
+    '''
+    load_dotenv()
+    edgar.set_identity(os.environ.get("NAME") + " " + os.environ.get("EMAIL"))
+
+
+def fetch_latest_filing(ticker, form):
+    '''
+    Downloads the text of a company's latest filing of the given form from EDGAR.
+
+    Args:
+        ticker (str): The ticker of the company
+        form (str): The form of the filing (10-K or 10-Q)
+
+    Returns:
+        text (str): The text of the filing
+        accession (str): The filing's accession number
+        filed (str): The filing date (YYYY-MM-DD)
+    '''
+    filing = edgar.Company(ticker).get_filings(form=form).latest(1)
+    return filing.text(), filing.accession_no, str(filing.filing_date)
+
+
+def split_filing(fetch_filing, ticker, form, chunk_size=1500, chunk_overlap=500):
+    '''
+    Fetches a filing and splits it into chunks. Runs in a worker process.
+
+    Args:
+        fetch_filing (callable): Returns the text, accession number and filing date of a (ticker, form) filing; must be picklable
+        ticker (str): The ticker of the company
+        form (str): The form of the filing (10-K or 10-Q)
+        chunk_size (int): The size of the chunks to split the text into
+        chunk_overlap (int): The amount of overlap between chunks
+
+    Returns:
+        texts (list): The chunks of the filing
+        accession (str): The filing's accession number
+        filed (str): The filing date (YYYY-MM-DD)
+    '''
+    text, accession, filed = fetch_filing(ticker, form)
+    return split_text(text, chunk_size, chunk_overlap), accession, filed
+
+
+def ingest(jobs, vector_store, fetch_filing=fetch_latest_filing, checkpoint=None, registry=None, manifest=None,
+           sparse_index=None, processes=4, embed_workers=4, batch_size=100, process_initializer=set_edgar_identity):
+    '''
+    Ingests a list of filings into the vector store, skipping those already in the checkpoint.
+    A filing that fails is logged and left out of the checkpoint, so it is retried on the next run.
+
+    Args:
+        jobs (list): A list of (ticker, form) pairs to ingest
+        vector_store (VectorStore): The vector store to add the chunks to, which embeds them
+        fetch_filing (callable): Returns the text, accession number and filing date of a (ticker, form) filing; must be picklable
+        checkpoint (Checkpoint): The record of completed pairs, or None to always ingest everything
+        registry (TickerRegistry): The ticker registry to record ingested tickers in
+        manifest (EmbeddingManifest): The record of embedded chunks, or None to embed every chunk
+        sparse_index (BM25Index): The keyword index to add the chunks to, or None
+        processes (int): The number of processes fetching and splitting filings (0 to do it in this process)
+        embed_workers (int): The maximum number of embedding requests in flight
+        batch_size (int): The number of chunks per embedding request
+        process_initializer (callable): Run once in each worker process
+
+    Returns:
+        failed (list): The (ticker, form) pairs that could not be ingested
+    '''
+    pending = [(ticker, form) for ticker, form in jobs if checkpoint is None or (ticker, form) not in checkpoint]
+    logger.info("Ingesting %d filings (%d already done)", len(pending), len(jobs) - len(pending))
+    failed = []
+
+    def embed_batch(batch, ticker, form, filed):
+        texts, ids = zip(*batch)
+        metadatas = [chunk_metadata(ticker, form, filed, id, text) for text, id in batch]
+        vector_store.add_texts(list(texts), metadatas=metadatas, ids=list(ids))
+        if manifest is not None:
+            manifest.add(ids, ticker, form)
+
+    def embed_filing(ticker, form, texts, accession, filed):
+        total = len(texts)
+        if sparse_index is not None:
+            # Every chunk is indexed, so filings embedded before the keyword index existed are picked up too
+            sparse_index.add(ticker, [(chunk_id(ticker, form, accession, text), text) for text in texts], form, filed)
+        if manifest is not None:
+            texts, ids = pending_chunks(texts, ticker, form, accession, manifest)
+        else:
+            ids = [chunk_id(ticker, form, accession, text) for text in texts]
+        chunks = list(zip(texts, ids))
+        batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+        list(embed_pool.map(lambda batch: embed_batch(batch, ticker, form, filed), batches))
+        if checkpoint is not None:
+            checkpoint.mark_done(ticker, form)
+        if registry is not None:
+            registry.add(ticker, form)
+        logger.info("Ingested %s %s (%d new of %d chunks)", ticker, form, len(texts), total)
+
+    with ThreadPoolExecutor(max_workers=embed_workers) as embed_pool:
+        if processes:
+            split_pool = ProcessPoolExecutor(max_workers=processes, initializer=process_initializer)
+            futures = {split_pool.submit(split_filing, fetch_filing, ticker, form): (ticker, form) for ticker, form in pending}
+            splits = ((futures[future], future) for future in as_completed(futures))
+        else:
+            split_pool = None
+            splits = (((ticker, form), None) for ticker, form in pending)
+
+        try:
+            for (ticker, form), future in splits:
+                try:
+                    texts, accession, filed = future.result() if future else split_filing(fetch_filing, ticker, form)
+                    embed_filing(ticker, form, texts, accession, filed)
+                except Exception:
+                    logger.exception("Failed to ingest %s %s", ticker, form)
+                    failed.append((ticker, form))
+        finally:
+            if split_pool is not None:
+                split_pool.shutdown(cancel_futures=True)
+
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", nargs="*", default=[], help="The tickers to ingest")
+    parser.add_argument("--tickers-file", help="A file with one ticker per line")
+    parser.add_argument("--forms", nargs="+", default=["10-K"], help="The forms to ingest for each ticker")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json", help="The checkpoint file to resume from, kept per vector store")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--backend", choices=["pinecone", "local"], help="The vector store to write to (default: VECTOR_STORE_BACKEND or pinecone)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    load_dotenv()
+
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        with open(args.tickers_file) as f:
+            tickers += [line.strip().upper() for line in f if line.strip()]
+    jobs = [(ticker, form) for ticker in tickers for form in args.forms]
+
+    vector_store = build_vector_store(args.backend)
+    store = vector_store_key(args.backend)
+    failed = ingest(
+        jobs,
+        vector_store,
+        checkpoint=Checkpoint(args.checkpoint, store),
+        registry=get_ticker_registry(),
+        manifest=get_embedding_manifest(store),
+        sparse_index=get_bm25_index(),
+        processes=args.processes,
+        embed_workers=args.embed_workers,
+        batch_size=args.batch_size,
+    )
+    if failed:
+        logger.error("Failed to ingest: %s", ", ".join(f"{ticker} {form}" for ticker, form in failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
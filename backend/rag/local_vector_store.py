@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from .bm25 import matches
+
+
+class LocalVectorStore(VectorStore):
+    '''
+    An in-process vector store for corpora that fit on one machine.
+    Unit-normalized embeddings are appended to a single float32 matrix file that is
+    memory-mapped for search, with one JSON line of metadata per row. A per-ticker index
+    of (start, stop) row ranges restricts a ticker-filtered search to that ticker's rows,
+    so the top-k is a matrix-vector product over only those rows.
+    Files written by another process (e.g. the ingestion CLI) are picked up on the next search,
+    parsing only the rows appended since the last one.
+
+    Args:
+        directory (str): The directory holding vectors.f32 and metadata.jsonl
+        embedding (Embeddings): The embedding model used for texts and queries
+    '''
+    def __init__(self, directory, embedding):
+        self.directory = directory
+        self.embedding = embedding
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.metadata_path = os.path.join(directory, "metadata.jsonl")
+        self.dimension_path = os.path.join(directory, "dimension")
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._dimension = None
+        self._matrix = None
+        self._metadata = []
+        self._ids = {}
+        self._ranges = {} # {ticker: [[start, stop], ...]}
+        self._metadata_bytes = 0
+        self._loaded_size = None
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory=None, **kwargs):
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        '''
+        Embeds texts and appends them to the store. Texts whose ID is already stored are skipped,
+        including those stored by another thread while they were being embedded.
+
+        Args:
+            texts (list): The texts to add
+            metadatas (list): One metadata dict per text, with at least a ticker
+            ids (list): One ID per text, defaulting to a hash of the text
+
+        Returns:
+            ids (list): The IDs of the texts
+        '''
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] for text in texts] # Stable across processes, as chunk_id
+
+        with self._lock:
+            self._refresh()
+            new = [i for i, id in enumerate(ids) if id not in self._ids]
+        if not new:
+            return list(ids)
+        # Embedding is a network call, so it runs outside the lock, and the IDs are checked again after it
+        vectors = _normalize(np.asarray(self.embedding.embed_documents([texts[i] for i in new]), dtype=np.float32))
+
+        with self._lock:
+            self._refresh()
+            still_new = [j for j, i in enumerate(new) if ids[i] not in self._ids]
+            if not still_new:
+                return list(ids)
+            new, vectors = [new[j] for j in still_new], vectors[still_new]
+            if self._dimension is None:
+                self._dimension = vectors.shape[1]
+                with open(self.dimension_path, "w") as f:
+                    f.write(str(self._dimension))
+
+            # Vectors are written before metadata; on load, rows without metadata are ignored,
+            # and a write interrupted halfway is cut off here before appending
+            if os.path.exists(self.metadata_path):
+                os.truncate(self.vectors_path, len(self._metadata) * self._dimension * 4)
+                os.truncate(self.metadata_path, self._metadata_bytes)
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.metadata_path, "a") as f:
+                for i in new:
+                    f.write(json.dumps({"id": ids[i], "text": texts[i], **metadatas[i]}) + "\n")
+            self._refresh()
+        return list(ids)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        '''
+        Retrieves the k rows with the highest cosine similarity to the embedding.
+
+        Args:
+            embedding (list): The query embedding
+            k (int): The number of documents to return
+            filter (dict): Metadata conditions the rows must meet, e.g. {"ticker": "AAPL", "filed": {"$gte": 20230101}}
+
+        Returns:
+            results (list): A list of (Document, score) pairs, most similar first
+        '''
+        with self._lock:
+            self._refresh()
+            matrix, metadata = self._matrix, self._metadata
+            rows = self._candidate_rows(filter)
+        if matrix is None or len(rows) == 0:
+            return []
+
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        scores = np.concatenate([matrix[start:stop] @ query for start, stop in _runs(rows)])
+        top = np.argsort(-scores)[:k] if k < len(scores) else np.argsort(-scores)
+        return [(_to_document(metadata[rows[i]]), float(scores[i])) for i in top]
+
+    def _candidate_rows(self, filter):
+        filter = dict(filter or {})
+        ticker = filter.pop("ticker", None)
+        chunk_ids = filter.pop("chunk_id", None)
+        if chunk_ids is not None:
+            # Stored IDs are the chunk IDs, so a shortlist is looked up directly instead of scanning the ticker's rows
+            rows = np.array(sorted(self._ids[id] for id in chunk_ids["$in"] if id in self._ids), dtype=int)
+            if ticker is not None:
+                filter["ticker"] = ticker
+        elif ticker is None:
+            rows = np.arange(len(self._metadata))
+        else:
+            ranges = self._ranges.get(ticker, [])
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges]) if ranges else np.array([], dtype=int)
+        if filter:
+            rows = np.array([row for row in rows if matches(self._metadata[row], filter)], dtype=int)
+        return rows
+
+    def _refresh(self):
+        if not os.path.exists(self.metadata_path):
+            return
+        size = (os.path.getsize(self.vectors_path), os.path.getsize(self.metadata_path))
+        if size == self._loaded_size:
+            return
+
+        if self._dimension is None:
+            with open(self.dimension_path) as f:
+                self._dimension = int(f.read())
+        if size[1] < self._metadata_bytes or size[0] < len(self._metadata) * self._dimension * 4:
+            # Cut back by another process, so parse everything again (into new objects, as searches may hold the old ones)
+            self._metadata, self._ids, self._ranges, self._metadata_bytes = [], {}, {}, 0
+
+        # Only the complete lines appended since the last refresh are parsed, and only as many as have their vectors written
+        with open(self.metadata_path, "rb") as f:
+            f.seek(self._metadata_bytes)
+            lines = [line for line in f if line.endswith(b"\n")]
+        lines = lines[:max(size[0] // 4 // self._dimension - len(self._metadata), 0)]
+        for line in lines:
+            entry = json.loads(line)
+            row = len(self._metadata)
+            self._metadata.append(entry)
+            self._ids[entry["id"]] = row
+            ticker_ranges = self._ranges.setdefault(entry.get("ticker"), [])
+            if ticker_ranges and ticker_ranges[-1][1] == row:
+                ticker_ranges[-1][1] = row + 1
+            else:
+                ticker_ranges.append([row, row + 1])
+
+        rows = len(self._metadata)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dimension)) if rows else None
+        self._metadata_bytes += sum(len(line) for line in lines)
+        self._loaded_size = size
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _runs(rows):
+    '''
+    Splits sorted row numbers into contiguous (start, stop) runs, so each run is a view of the memory map.
+    '''
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    for run in np.split(rows, breaks):
+        yield run[0], run[-1] + 1
+
+
+def _to_document(entry):
+    metadata = {key: value for key, value in entry.items() if key not in ("id", "text")}
+    return Document(page_content=entry["text"], metadata=metadata)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Written by the ingestion scripts and read by the backend, so it lives outside of the Django settings
+DEFAULT_PATH = os.path.join(Path(__file__).resolve().parent.parent.parent, "ticker_registry.json")
+
+
+class TickerRegistry:
+    '''
+    A small JSON manifest of the tickers whose filings have been embedded, written at ingestion time.
+    Reads are served from memory, and the file is only parsed again when it changes on disk.
+
+    Args:
+        path (str): The path of the JSON manifest
+    '''
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._data = {}
+        self._tickers = []
+        self._etag = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def add(self, ticker, source):
+        '''
+        Records that a ticker's filing has been embedded.
+
+        Args:
+            ticker (str): The ticker of the company
+            source (str): The source of the filing (10-K or 10-Q)
+        '''
+        self.update({ticker: [source]})
+
+    def update(self, sources_by_ticker):
+        '''
+        Records several embedded tickers at once, writing the manifest atomically.
+
+        Args:
+            sources_by_ticker (dict): A mapping of ticker to the sources embedded for it
+        '''
+        with self._lock:
+            data = self._read()
+            now = datetime.now(timezone.utc).isoformat()
+            for ticker, sources in sources_by_ticker.items():
+                entry = data.setdefault(ticker, {"sources": [], "updated_at": now})
+                entry["sources"] = sorted(set(entry["sources"]) | set(sources))
+                entry["updated_at"] = now
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+            self._mtime = None # Parse again on the next read
+
+    def tickers(self):
+        '''
+        Returns the registered tickers.
+
+        Returns:
+            tickers (list): A sorted list of all registered tickers
+        '''
+        self._refresh()
+        return self._tickers
+
+    @property
+    def etag(self):
+        self._refresh()
+        return self._etag
+
+    @property
+    def last_modified(self):
+        self._refresh()
+        return datetime.fromtimestamp(self._mtime / 1e9, timezone.utc) if self._mtime else None
+
+    def _refresh(self):
+        mtime = os.stat(self.path).st_mtime_ns if self.exists() else None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            self._data = self._read()
+            self._tickers = sorted(self._data)
+            self._etag = hashlib.sha1(json.dumps(self._tickers).encode()).hexdigest()
+            self._mtime = mtime
+
+    def _read(self):
+        if not self.exists():
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+
+_registry = None
+
+
+def get_ticker_registry():
+    '''
+    Returns the process-wide ticker registry, stored at TICKER_REGISTRY_PATH if set.
+
+    Returns:
+        registry (TickerRegistry): The shared ticker registry
+    '''
+    global _registry
+    if _registry is None:
+        _registry = TickerRegistry(os.environ.get("TICKER_REGISTRY_PATH", DEFAULT_PATH))
+    return _registry
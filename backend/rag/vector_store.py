@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+from langchain_pinecone import PineconeVectorStore
+from .local_vector_store import LocalVectorStore
+
+# Shared by the backend and the ingestion scripts, so it is configured from the environment
+DEFAULT_LOCAL_DIR = os.path.join(Path(__file__).resolve().parent.parent.parent, "vector_store")
+
+
+def build_vector_store(backend=None):
+    '''
+    Builds the vector store holding the filing embeddings, embedded with OpenAI.
+
+    Args:
+        backend (str): "pinecone" or "local", defaulting to the VECTOR_STORE_BACKEND environment variable (or "pinecone")
+
+    Returns:
+        vector_store (VectorStore): The vector store
+    '''
+    load_dotenv()
+    backend = backend or os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+    if backend not in ("local", "pinecone"):
+        raise ValueError(f"Unknown vector store backend: {backend}")
+    embedding = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+    if backend == "local":
+        return LocalVectorStore(os.environ.get("LOCAL_VECTOR_STORE_DIR", DEFAULT_LOCAL_DIR), embedding)
+    if backend == "pinecone":
+        return PineconeVectorStore(
+            embedding=embedding,
+            pinecone_api_key=os.getenv("PINECONE_API_KEY"),
+            index_name=os.getenv("VECTOR_SEARCH_INDEX"),
+        )
+
+
+def vector_store_key(backend=None):
+    '''
+    Names the vector store that build_vector_store would build, so that what was ingested
+    into one store (e.g. the embedding manifest and the ingestion checkpoint) is not taken as ingested into another.
+
+    Args:
+        backend (str): "pinecone" or "local", defaulting to the VECTOR_STORE_BACKEND environment variable (or "pinecone")
+
+    Returns:
+        key (str): "pinecone:<index name>" or "local:<absolute directory>"
+    '''
+    load_dotenv()
+    backend = backend or os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+    if backend == "local":
+        return f"local:{os.path.abspath(os.environ.get('LOCAL_VECTOR_STORE_DIR', DEFAULT_LOCAL_DIR))}"
+    if backend == "pinecone":
+        return f"pinecone:{os.getenv('VECTOR_SEARCH_INDEX')}"
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -0,0 +1,288 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time as clock, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# {email: {"seen": timestamp, "portfolios": [...]}}, shared by every worker through the cache.
+# Concurrent updates may drop a touch, which only delays that user's next background refresh.
+ACTIVE_USERS_KEY = "active_users"
+# Held in the cache while a user's portfolios (or one of them) are refreshed, so that only one process refreshes them at a time
+REBUILD_LOCK_KEY = "rebuild_lock:{email}"
+PORTFOLIO_REBUILD_LOCK_KEY = "rebuild_lock:{email}:{portfolio}"
+
+
+@contextmanager
+def rebuild_lock(email, portfolio=None):
+    '''
+    Takes the lock on refreshing a user's portfolios, or one of them, shared by every process through the cache
+    (cache.add only sets a key that is not set yet). It expires after settings.REFRESH_LOCK_TIMEOUT,
+    in case its holder dies, and is only released by its holder.
+    A portfolio's lock is separate from its user's, as the refresher's in-flight keys are,
+    so refreshing one portfolio does not block refreshing another.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The portfolio, or None for all of the user's portfolios
+
+    Yields:
+        acquired (bool): Whether the lock was taken, otherwise another process holds it
+    '''
+    if portfolio is None:
+        key = REBUILD_LOCK_KEY.format(email=email)
+    else:
+        key = PORTFOLIO_REBUILD_LOCK_KEY.format(email=email, portfolio=portfolio)
+    token = uuid.uuid4().hex
+    acquired = cache.add(key, token, timeout=settings.REFRESH_LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def mark_active(email, portfolios):
+    '''
+    Records that a user has just loaded their portfolios, so the scheduler keeps them warm.
+
+    Args:
+        email (str): The user's email
+        portfolios (list): The names of the user's portfolios
+    '''
+    active_users = cache.get(ACTIVE_USERS_KEY) or {}
+    active_users[email] = {"seen": time.time(), "portfolios": list(portfolios)}
+    cutoff = time.time() - settings.REFRESH_ACTIVE_DAYS * 86400
+    active_users = {email: user for email, user in active_users.items() if user["seen"] >= cutoff}
+    cache.set(ACTIVE_USERS_KEY, active_users, timeout=None)
+
+
+def active_users():
+    '''
+    Returns the users seen within settings.REFRESH_ACTIVE_DAYS.
+
+    Returns:
+        active_users (dict): {email: {seen, portfolios}}
+    '''
+    cutoff = time.time() - settings.REFRESH_ACTIVE_DAYS * 86400
+    return {email: user for email, user in (cache.get(ACTIVE_USERS_KEY) or {}).items() if user["seen"] >= cutoff}
+
+
+def last_market_close(now=None):
+    '''
+    Returns the most recent weekday market close (settings.MARKET_CLOSE in settings.MARKET_TIMEZONE) before now.
+
+    Args:
+        now (datetime): The current time, timezone-aware. Defaults to now.
+
+    Returns:
+        close (datetime): The last market close, timezone-aware
+    '''
+    zone = ZoneInfo(settings.MARKET_TIMEZONE)
+    now = (now or datetime.now(zone)).astimezone(zone)
+    hour, minute = map(int, settings.MARKET_CLOSE.split(":"))
+    close = datetime.combine(now.date(), clock(hour, minute), tzinfo=zone)
+    if close > now:
+        close -= timedelta(days=1)
+    while close.weekday() >= 5: # Skip weekends
+        close -= timedelta(days=1)
+    return close
+
+
+def market_is_open(now=None):
+    '''
+    Checks whether a weekday session is in progress, between settings.MARKET_OPEN and settings.MARKET_CLOSE
+    in settings.MARKET_TIMEZONE, so that its daily bar is not final yet.
+
+    Args:
+        now (datetime): The current time, timezone-aware. Defaults to now.
+
+    Returns:
+        is_open (bool): Whether a session is in progress
+    '''
+    zone = ZoneInfo(settings.MARKET_TIMEZONE)
+    now = (now or datetime.now(zone)).astimezone(zone)
+    opens, closes = (clock(*map(int, value.split(":"))) for value in (settings.MARKET_OPEN, settings.MARKET_CLOSE))
+    return now.weekday() < 5 and opens <= now.time() < closes
+
+
+def needs_refresh(built_at, now=None):
+    '''
+    Checks how a snapshot should be refreshed: rebuilt if it is missing or about to be evicted from the cache,
+    or brought up to the latest closes if a market close has happened since it was built.
+
+    Args:
+        built_at (float): When the snapshot was built, as a Unix timestamp, or None if it is not cached
+        now (float): The current Unix timestamp. Defaults to now.
+
+    Returns:
+        refresh (str): "rebuild", "closes", or None if the snapshot is up to date
+    '''
+    now = now or time.time()
+    if built_at is None or now - built_at >= settings.CACHE_TIMEOUT + settings.CACHE_STALE_TIMEOUT - 2 * settings.REFRESH_INTERVAL:
+        return "rebuild"
+    close = last_market_close(datetime.fromtimestamp(now, ZoneInfo(settings.MARKET_TIMEZONE)))
+    return "closes" if built_at < close.timestamp() else None
+
+
+class Refresher:
+    '''
+    Rebuilds portfolio snapshots in the background on a small thread pool, so that
+    requests can serve a stale snapshot instead of waiting for a rebuild.
+    After a market close, cached snapshots are brought up to the new closes instead of being rebuilt.
+    A portfolio (or user) already queued or being rebuilt in this process is not queued again.
+    Across processes, a rebuild is skipped if another process holds the same rebuild lock (the user's or the portfolio's),
+    or has rebuilt the snapshots since the rebuild was queued.
+
+    Args:
+        rebuild_portfolio (callable): Rebuilds and caches one portfolio, given (email, portfolio)
+        rebuild_user (callable): Rebuilds and caches all of a user's portfolios, given (email, portfolios)
+        update_closes (callable): Brings all of a user's cached portfolios up to the latest closes, given (email, portfolios)
+        load_built_at (callable): Returns when a cached portfolio was built, given (email, portfolio), or None if not cached
+        workers (int): The number of rebuilds run at once
+    '''
+    def __init__(self, rebuild_portfolio, rebuild_user, update_closes, load_built_at, workers=2):
+        self.rebuild_portfolio = rebuild_portfolio
+        self.rebuild_user = rebuild_user
+        self.update_closes = update_closes
+        self.load_built_at = load_built_at
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refresh")
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def refresh_portfolio(self, email, portfolio):
+        '''
+        Queues a rebuild of one portfolio, unless one is already queued.
+
+        Returns:
+            future (Future): The queued rebuild, or None if one was already in flight
+        '''
+        return self._submit((email, portfolio), [portfolio], self.rebuild_portfolio, email, portfolio)
+
+    def refresh_user(self, email, portfolios):
+        '''
+        Queues a rebuild of all of a user's portfolios, unless one is already queued.
+
+        Returns:
+            future (Future): The queued rebuild, or None if one was already in flight
+        '''
+        return self._submit((email, None), portfolios, self.rebuild_user, email, portfolios)
+
+    def refresh_user_closes(self, email, portfolios):
+        '''
+        Queues an update of all of a user's portfolios to the latest closes, unless a refresh of the user is already queued.
+
+        Returns:
+            future (Future): The queued update, or None if a refresh was already in flight
+        '''
+        return self._submit((email, None), portfolios, self.update_closes, email, portfolios)
+
+    def refresh_active_users(self):
+        '''
+        Queues a refresh for every active user with a snapshot that needs refreshing:
+        a rebuild if any snapshot is missing or about to be evicted, otherwise an update to the latest closes.
+
+        Returns:
+            futures (list): The queued refreshes
+        '''
+        futures = []
+        for email, user in active_users().items():
+            refreshes = {needs_refresh(self.load_built_at(email, portfolio)) for portfolio in user["portfolios"]}
+            if "rebuild" in refreshes:
+                future = self.refresh_user(email, user["portfolios"])
+            elif "closes" in refreshes:
+                future = self.refresh_user_closes(email, user["portfolios"])
+            else:
+                continue
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def run_forever(self, interval=None, stop=None):
+        '''
+        Checks the active users every interval seconds until stop is set.
+
+        Args:
+            interval (float): The seconds between checks, defaulting to settings.REFRESH_INTERVAL
+            stop (threading.Event): Set to end the loop
+        '''
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                futures = self.refresh_active_users()
+                if futures:
+                    logger.info("Refreshing portfolios of %d active users", len(futures))
+            except Exception:
+                logger.exception("Failed to schedule portfolio refreshes")
+            stop.wait(interval or settings.REFRESH_INTERVAL)
+
+    def _submit(self, key, portfolios, function, *args):
+        email, portfolio = key
+        with self._lock:
+            if key in self._in_flight:
+                return None
+            self._in_flight.add(key)
+        queued_at = time.time()
+
+        def run():
+            try:
+                with rebuild_lock(email, portfolio) as acquired:
+                    if not acquired:
+                        logger.info("Skipping refresh of %s: another process is rebuilding it", key)
+                        return
+                    built_at = [self.load_built_at(email, portfolio) for portfolio in portfolios]
+                    if all(value is not None and value >= queued_at for value in built_at):
+                        return # Rebuilt by another process since it was queued
+                    function(*args)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(key)
+
+        return self._executor.submit(run)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher():
+    '''
+    Returns the process-wide background refresher, built on first use.
+
+    Returns:
+        refresher (Refresher): The shared refresher
+    '''
+    global _refresher
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                from . import views # views uses the refresher, so it is imported lazily
+                _refresher = Refresher(
+                    views.rebuild_portfolio, views.rebuild_user_portfolios, views.update_user_closes, views.load_built_at, settings.REFRESH_WORKERS,
+                )
+    return _refresher
+
+
+def start_scheduler():
+    '''
+    Starts the scheduler loop in a daemon thread of this process.
+
+    Returns:
+        thread (threading.Thread): The scheduler thread
+    '''
+    thread = threading.Thread(
+        target=get_refresher().run_forever,
+        name="refresh-scheduler",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -39,9 +39,11 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "corsheaders",
+    "backend.apps.BackendConfig",
 ]
 
 MIDDLEWARE = [
+    "backend.metrics.MetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -131,10 +133,66 @@ STATICFILES_DIRS = [
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Cache settings
+# Portfolio snapshots must be visible to every worker, so use a shared backend in production, e.g.
+# CACHE_BACKEND="django.core.cache.backends.redis.RedisCache" and CACHE_LOCATION="redis://127.0.0.1:6379"
+CACHE_TIMEOUT = 3600 # 1h, after which a portfolio snapshot is stale and rebuilt in the background
+CACHE_STALE_TIMEOUT = int(os.environ.get("CACHE_STALE_TIMEOUT", 86400)) # How long a stale snapshot is still served
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "unique-snowflake",
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "unique-snowflake"),
+        "TIMEOUT": CACHE_TIMEOUT + CACHE_STALE_TIMEOUT,
     }
 }
-CACHE_TIMEOUT = 3600 # 1h
\ No newline at end of file
+
+# Background refresh of active users' snapshots, after each market close and before they are evicted.
+# Run the scheduler separately with `python manage.py refresh_portfolios --loop`, or in each web server process
+# with REFRESH_IN_PROCESS=1. Either way, a rebuild takes a per-user lock in the shared cache, so each user is rebuilt once.
+REFRESH_IN_PROCESS = os.environ.get("REFRESH_IN_PROCESS", "") == "1"
+REFRESH_LOCK_TIMEOUT = int(os.environ.get("REFRESH_LOCK_TIMEOUT", 600)) # Seconds after which a dead holder's lock expires
+REFRESH_INTERVAL = int(os.environ.get("REFRESH_INTERVAL", 300)) # Seconds between checks
+REFRESH_WORKERS = int(os.environ.get("REFRESH_WORKERS", 2))
+REFRESH_ACTIVE_DAYS = int(os.environ.get("REFRESH_ACTIVE_DAYS", 7)) # Users seen within this many days are kept warm
+MARKET_TIMEZONE = "America/New_York"
+MARKET_OPEN = "09:30"
+MARKET_CLOSE = "16:30" # Daily bars are settled by then
+# add_transaction rebuilds a snapshot built this recently instead of patching it, since it may already include the transaction
+TRANSACTION_REBUILD_WINDOW = int(os.environ.get("TRANSACTION_REBUILD_WINDOW", 60))
+
+# Request and upstream metrics, served in the Prometheus format at backend/metrics/ to staff users,
+# or to scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# With PROFILE_REQUESTS=1, requests sent with the "X-Profile: 1" header are profiled into PROFILE_DIR (load with pstats or snakeviz)
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+
+# Number of portfolios built concurrently per request (1 builds them sequentially)
+PORTFOLIO_WORKERS = int(os.environ.get("PORTFOLIO_WORKERS", 4))
+
+# Async views (backend/async_views.py), served under ASGI, e.g. `uvicorn backend.asgi:application`.
+# With ASYNC_VIEWS=1 they replace the sync views on the portfolio, price range and chatbot routes;
+# otherwise they are only routed under backend/async/.
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "") == "1"
+# Maximum number of concurrent upstream calls per event loop in the async views
+UPSTREAM_CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", 8))
+
+# Local store of daily OHLCV bars, one SQLite file per ticker
+PRICE_STORE_DIR = os.environ.get("PRICE_STORE_DIR", os.path.join(BASE_DIR, "price_store"))
+# Number of (ticker, date) daily price ranges memoized for trade validation
+PRICE_RANGE_CACHE_SIZE = int(os.environ.get("PRICE_RANGE_CACHE_SIZE", 4096))
+
+# Ticker that portfolio analytics are compared against (empty disables the comparison)
+BENCHMARK_TICKER = os.environ.get("BENCHMARK_TICKER", "SPY")
+
+# Vector store for the chatbot's retriever: "pinecone", or "local" for the in-process index in LOCAL_VECTOR_STORE_DIR
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "pinecone")
+# Maximum number of retrieved-context tokens in a chatbot prompt (0 disables the limit)
+CHATBOT_CONTEXT_TOKENS = int(os.environ.get("CHATBOT_CONTEXT_TOKENS", 1500)) or None
+# Number of BM25 keyword matches the vector search is narrowed to (0 always searches all of a ticker's chunks)
+CHATBOT_SHORTLIST = int(os.environ.get("CHATBOT_SHORTLIST", 50))
+
+# Chatbot answer cache, keyed on (ticker, normalized query)
+CHATBOT_CACHE_SIZE = int(os.environ.get("CHATBOT_CACHE_SIZE", 1024))
+CHATBOT_CACHE_TTL = int(os.environ.get("CHATBOT_CACHE_TTL", 86400)) # 24h
+# Minimum cosine similarity for matching a similar cached question, e.g. 0.95 (unset disables)
+CHATBOT_CACHE_SIMILARITY = float(os.environ["CHATBOT_CACHE_SIMILARITY"]) if os.environ.get("CHATBOT_CACHE_SIMILARITY") else None
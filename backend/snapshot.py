@@ -0,0 +1,109 @@
+import struct
+
+import msgpack
+import numpy as np
+
+# Bump whenever the layout below changes; snapshots of other versions are treated as cache misses
+SNAPSHOT_VERSION = 7
+# Fixed-size header of version, built_at and updated_at, so they are read without unpacking the body
+HEADER = struct.Struct("<Idd")
+
+
+def encode_snapshot(info):
+    '''
+    Serializes a portfolio snapshot into a compact, versioned msgpack payload behind a fixed-size header.
+    The performance series, each ticker's component series and each analytics series are stored
+    as two packed arrays (day numbers and float64 values) rather than nested lists of [date, value] pairs.
+    The components are only needed to patch the snapshot, so they are packed into a nested payload
+    that reads skip.
+
+    Args:
+        info (dict): The portfolio snapshot, with performance, levels, components, positions, history, analytics
+        built_at (when its rows were read and its prices brought up to date, as a Unix timestamp)
+        and updated_at (when it was last rebuilt or patched)
+
+    Returns:
+        data (bytes): The serialized snapshot
+    '''
+    header = HEADER.pack(SNAPSHOT_VERSION, info["built_at"], info["updated_at"])
+    return header + msgpack.packb({
+        "performance": _pack_points(info["performance"]),
+        "levels": {resolution: _pack_level(level) for resolution, level in info["levels"].items()},
+        "components": msgpack.packb({stock: _pack_points(points) for stock, points in info["components"].items()}),
+        "positions": info["positions"],
+        "history": info["history"],
+        "analytics": dict(info["analytics"], series={name: _pack_points(points) for name, points in info["analytics"]["series"].items()}),
+    })
+
+
+def decode_stamp(data):
+    '''
+    Reads when a serialized snapshot was built and last updated, from its header only.
+
+    Args:
+        data (bytes): The serialized snapshot, or None on a cache miss
+
+    Returns:
+        stamp (dict): {built_at, updated_at}, or None if data is missing or of another version
+    '''
+    if not isinstance(data, bytes) or len(data) < HEADER.size:
+        return None
+    version, built_at, updated_at = HEADER.unpack_from(data)
+    if version != SNAPSHOT_VERSION:
+        return None
+    return {"built_at": built_at, "updated_at": updated_at}
+
+
+def decode_snapshot(data, components=False):
+    '''
+    Deserializes a portfolio snapshot produced by encode_snapshot.
+
+    Args:
+        data (bytes): The serialized snapshot, or None on a cache miss
+        components (bool): Whether to unpack each ticker's component series, which only patches need.
+        Otherwise components is None.
+
+    Returns:
+        info (dict): The portfolio snapshot, or None if data is missing or of another version
+    '''
+    stamp = decode_stamp(data)
+    if stamp is None:
+        return None
+    snapshot = msgpack.unpackb(memoryview(data)[HEADER.size:])
+
+    return dict(
+        stamp,
+        performance=_unpack_points(snapshot["performance"]),
+        levels={resolution: _unpack_level(packed) for resolution, packed in snapshot["levels"].items()},
+        components={stock: _unpack_points(packed) for stock, packed in msgpack.unpackb(snapshot["components"]).items()} if components else None,
+        positions=snapshot["positions"],
+        history=snapshot["history"],
+        analytics=dict(snapshot["analytics"], series={name: _unpack_points(packed) for name, packed in snapshot["analytics"]["series"].items()}),
+    )
+
+
+def _pack_points(points):
+    dates = [date for date, _ in points]
+    values = [value for _, value in points]
+    return {
+        "dates": np.array(dates, dtype="datetime64[D]").astype("<i4").tobytes(),
+        "values": np.array(values, dtype="<f8").tobytes(),
+    }
+
+
+def _unpack_points(packed):
+    dates = np.frombuffer(packed["dates"], dtype="<i4").astype("datetime64[D]").astype(str)
+    values = np.frombuffer(packed["values"], dtype="<f8")
+    return [list(point) for point in zip(dates.tolist(), values.tolist())]
+
+
+def _pack_level(level):
+    packed = {name: np.array(column, dtype="<f8").tobytes() for name, column in level.items() if name != "dates"}
+    packed["dates"] = np.array(level["dates"], dtype="datetime64[D]").astype("<i4").tobytes()
+    return packed
+
+
+def _unpack_level(packed):
+    level = {name: np.frombuffer(column, dtype="<f8").tolist() for name, column in packed.items() if name != "dates"}
+    level["dates"] = np.frombuffer(packed["dates"], dtype="<i4").astype("datetime64[D]").astype(str).tolist()
+    return level
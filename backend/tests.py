@@ -0,0 +1,757 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+
+import fakeredis
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, override_settings
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake import FakeListLLM
+
+from . import async_views, incremental, price_store, refresh, snapshot, views
+from .analytics import cash_flows, compute_analytics, daily_returns
+from .apps import serves_requests
+from .rag.bm25 import BM25Index
+from .rag import chatbot
+from .rag.answer_cache import AnswerCache
+from .rag.chatbot import RAGPipeline
+from .rag.embedding_manifest import EmbeddingManifest
+from .rag import ingest
+from .rag.ingest import Checkpoint
+from .rag import local_vector_store
+from .rag.local_vector_store import LocalVectorStore
+
+EMAIL = "user@example.com"
+
+
+class StubQuery:
+    '''
+    A Supabase query builder over in-memory rows, filtering on eq().
+    '''
+    def __init__(self, client, table_name):
+        self.supabase = client
+        self.table_name = table_name
+        self.filters = []
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def execute(self):
+        self.supabase.queries.append(self.table_name)
+        rows = [row for row in self.supabase.tables[self.table_name] if all(row.get(column) == value for column, value in self.filters)]
+        return mock.Mock(data=rows)
+
+
+class StubClient:
+    '''
+    A Supabase client serving in-memory tables, recording the table of every query executed.
+    '''
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+
+    def table(self, name):
+        return StubQuery(self, name)
+
+
+def fake_download(ticker, start=None, end=None, progress=False, **kwargs):
+    '''
+    A yf.download stand-in returning a year of daily bars of a random walk.
+    '''
+    dates = pd.bdate_range("2024-01-01", "2024-12-31", name="Date")
+    close = 100 * np.exp(np.cumsum(np.random.default_rng(len(ticker)).normal(0, 0.01, len(dates))))
+    frame = pd.DataFrame({"Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": 1000.0}, index=dates)
+    frame = frame.loc[str(start)[:10]:] if start else frame
+    return frame.loc[:pd.Timestamp(str(end)[:10]) - pd.Timedelta(days=1)] if end else frame
+
+
+def stock_row(portfolio, stock, amount, date_purchased):
+    return {
+        "owner": EMAIL, "portfolio": portfolio, "stock": stock, "amount": amount,
+        "unit_price": 100.0, "total_price": amount * 100.0, "date_purchased": date_purchased,
+    }
+
+
+@override_settings(BENCHMARK_TICKER="")
+class PortfolioTestCase(SimpleTestCase):
+    '''
+    Serves the stock data table from a stub client, and prices from a mocked yf.download into a temporary price store.
+    '''
+    rows = [
+        stock_row("Main", "AAPL", 10, "2024-03-01"),
+        stock_row("Main", "MSFT", 5, "2024-02-01"),
+        stock_row("Main", "AAPL", 2, "2024-06-03"),
+        stock_row("Other", "AAPL", 1, "2024-01-15"), # Earlier than any AAPL purchase in Main
+        stock_row("Other", "NVDA", 3, "2024-05-01"),
+    ]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.download = mock.Mock(side_effect=fake_download)
+        self.supabase = StubClient({
+            "portfolios": [{"email": EMAIL, "portfolio": "Main", "is_public": False}, {"email": EMAIL, "portfolio": "Other", "is_public": False}],
+            "stock_data": self.rows,
+        })
+        for patcher in (
+            mock.patch.object(price_store, "_price_store", price_store.PriceStore(directory, downloader=self.download)),
+            mock.patch.object(views, "get_supabase_client", return_value=self.supabase),
+            mock.patch.object(views, "PORTFOLIOS_TABLE", "portfolios"),
+            mock.patch.object(views, "STOCK_DATA_TABLE", "stock_data"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+
+class CacheAllPortfoliosTests(PortfolioTestCase):
+    def test_downloads_each_ticker_once(self):
+        failed = views.cache_all_portfolios(self.supabase, "stock_data", EMAIL, ["Main", "Other"])
+
+        self.assertEqual(failed, [])
+        self.assertEqual(self.download.call_count, len({row["stock"] for row in self.rows}))
+        downloaded_from = {call.args[0]: call.kwargs["start"] for call in self.download.call_args_list}
+        self.assertEqual(downloaded_from["AAPL"], "2024-01-15")
+
+    @override_settings(PORTFOLIO_WORKERS=1)
+    def test_downloads_each_ticker_once_sequentially(self):
+        views.cache_all_portfolios(self.supabase, "stock_data", EMAIL, ["Main", "Other"])
+
+        self.assertEqual(self.download.call_count, len({row["stock"] for row in self.rows}))
+
+
+    def test_async_builds_the_other_portfolios_when_a_ticker_fails(self):
+        def download(ticker, *args, **kwargs):
+            if ticker == "NVDA":
+                raise ConnectionError("Download failed")
+            return fake_download(ticker, *args, **kwargs)
+        self.download.side_effect = download
+
+        with self.assertLogs("backend.async_views", "ERROR"):
+            infos = asyncio.run(async_views.cache_portfolios(self.rows, EMAIL, ["Main", "Other"]))
+
+        self.assertEqual(list(infos), ["Main"])
+        self.assertIsNotNone(views.read_snapshot(views.get_cache_key(EMAIL, "Main")))
+
+class GetAllPortfoliosTests(PortfolioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.http = Client(HTTP_HOST="localhost")
+
+    def post(self):
+        return self.http.post("/backend/all_portfolios/", {"email": EMAIL}, content_type="application/json")
+
+    def test_fetches_stock_rows_in_one_query(self):
+        response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), ["Main", "Other"])
+        self.assertEqual(self.supabase.queries, ["portfolios", "stock_data"])
+        self.assertIsNotNone(views.load_built_at(EMAIL, "Main"))
+        self.assertIsNotNone(views.load_built_at(EMAIL, "Other"))
+
+    def test_serves_cached_portfolios_without_stock_query(self):
+        self.post()
+        self.supabase.queries.clear()
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.supabase.queries, ["portfolios"])
+
+    def test_rebuilds_requested_portfolios_even_if_cached(self):
+        self.post()
+        self.supabase.queries.clear()
+
+        response = self.http.post("/backend/all_portfolios/", {"email": EMAIL, "rebuild": ["Main"]}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.supabase.queries, ["portfolios", "stock_data"])
+
+
+class PortfolioPerformanceTests(PortfolioTestCase):
+    def post(self, **options):
+        http = Client(HTTP_HOST="localhost")
+        return http.post("/backend/portfolio_performance/", dict(options, email=EMAIL, portfolio="Main"), content_type="application/json")
+
+    def test_reduces_the_series_to_max_points(self):
+        response = self.post(resolution="weekly", max_points=5, format="columnar")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["dates"]), 5)
+
+    def test_rejects_invalid_options(self):
+        for options in ({"resolution": "yearly"}, {"max_points": "many"}, {"max_points": 0}, {"max_points": -5}, {"format": "csv"}):
+            with self.subTest(options=options):
+                response = self.post(**options)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class PortfolioHistoryTests(PortfolioTestCase):
+    def post(self, **options):
+        http = Client(HTTP_HOST="localhost")
+        return http.post("/backend/portfolio_history/", dict(options, email=EMAIL, portfolio="Main"), content_type="application/json")
+
+    def test_pages_within_the_date_range(self):
+        response = self.post(start_date="2024-02-15", offset=1, limit=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry["date_purchased"] for entry in response.json()], ["2024-06-03"])
+        self.assertEqual(response["X-Total-Count"], "2")
+
+    def test_rejects_invalid_offset_and_limit(self):
+        for options in ({"offset": -1}, {"limit": -1}, {"offset": "first"}, {"limit": "all"}):
+            with self.subTest(options=options):
+                response = self.post(start_date="2024-02-15", **options)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class DailyPriceRangeTests(PortfolioTestCase):
+    def test_rejects_tickers_that_are_not_file_names(self):
+        http = Client(HTTP_HOST="localhost")
+        for prefix in ("/backend/", "/backend/async/"):
+            with self.subTest(prefix=prefix):
+                single = http.post(f"{prefix}daily_price_range/", {"ticker": "../../evil", "date": "2024-06-03"}, content_type="application/json")
+                batch = http.post(f"{prefix}daily_price_ranges/", {"entries": [
+                    {"ticker": "AAPL", "date": "2024-06-03"}, {"ticker": "a/b", "date": "2024-06-03"},
+                ]}, content_type="application/json")
+
+                self.assertEqual(single.status_code, 400)
+                self.assertEqual(batch.status_code, 400)
+        self.download.assert_not_called()
+        with self.assertRaises(ValueError):
+            price_store.get_price_store().get_history("../evil", "2024-06-03")
+
+
+class SnapshotTests(PortfolioTestCase):
+    @override_settings(BENCHMARK_TICKER="")
+    def test_round_trips_a_portfolio(self):
+        info = views.cache_portfolio([row for row in self.rows if row["portfolio"] == "Main"], EMAIL, "Main")
+
+        data = snapshot.encode_snapshot(info)
+
+        self.assertEqual(snapshot.decode_snapshot(data, components=True), info)
+        self.assertEqual(snapshot.decode_snapshot(data), dict(info, components=None))
+        self.assertEqual(snapshot.decode_stamp(data), {"built_at": info["built_at"], "updated_at": info["updated_at"]})
+
+    def test_treats_another_version_as_a_miss(self):
+        info = views.cache_portfolio([row for row in self.rows if row["portfolio"] == "Main"], EMAIL, "Main")
+        data = snapshot.encode_snapshot(info)
+
+        with mock.patch.object(snapshot, "SNAPSHOT_VERSION", snapshot.SNAPSHOT_VERSION + 1):
+            self.assertIsNone(snapshot.decode_snapshot(data))
+            self.assertIsNone(snapshot.decode_stamp(data))
+            self.assertIsNone(views.load_built_at(EMAIL, "Main"))
+        self.assertIsNone(snapshot.decode_snapshot(None))
+
+
+class RedisCacheTests(PortfolioTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        caches = {"default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://localhost:6379",
+            "OPTIONS": {"connection_class": fakeredis.FakeConnection, "server": self.server},
+        }}
+        patcher = override_settings(CACHES=caches)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        super().setUp()
+
+    def test_serves_portfolios_from_redis(self):
+        http = Client(HTTP_HOST="localhost")
+        first = http.post("/backend/portfolio_holdings/", {"email": EMAIL, "portfolio": "Main"}, content_type="application/json")
+        self.supabase.queries.clear()
+
+        second = http.post("/backend/portfolio_holdings/", {"email": EMAIL, "portfolio": "Main"}, content_type="application/json")
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.supabase.queries, [])
+        keys = fakeredis.FakeRedis(server=self.server).keys()
+        self.assertTrue(any(key.endswith(views.get_cache_key(EMAIL, "Main").encode()) for key in keys))
+
+
+class PriceStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.close = 100.0
+        self.download = mock.Mock(side_effect=lambda ticker, start=None, end=None, **kwargs: pd.DataFrame(
+            {column: [self.close] for column in price_store.COLUMNS}, index=pd.DatetimeIndex(["2024-06-03"], name="Date"),
+        ))
+        self.store = price_store.PriceStore(directory, downloader=self.download)
+
+    def get_close(self, at):
+        with mock.patch.object(price_store, "_now", return_value=datetime.fromisoformat(at)):
+            return self.store.get_history("AAPL", "2024-06-03")["Close"].iloc[-1]
+
+    def test_refreshes_the_tail_during_a_session(self):
+        self.assertEqual(self.get_close("2024-06-03T11:00:00-04:00"), 100)
+        self.close = 123.0
+
+        self.assertEqual(self.get_close("2024-06-03T13:00:00-04:00"), 123)
+        self.assertEqual(self.download.call_count, 2)
+
+    def test_refreshes_an_intraday_tail_after_the_close(self):
+        self.get_close("2024-06-03T11:00:00-04:00")
+        self.close = 123.0
+
+        self.assertEqual(self.get_close("2024-06-03T17:00:00-04:00"), 123)
+        self.assertEqual(self.download.call_count, 2)
+
+    def test_keeps_a_tail_refreshed_after_the_close(self):
+        self.get_close("2024-06-03T17:00:00-04:00")
+        self.close = 123.0
+
+        self.assertEqual(self.get_close("2024-06-03T22:00:00-04:00"), 100)
+        self.assertEqual(self.get_close("2024-06-04T09:00:00-04:00"), 100)
+        self.assertEqual(self.download.call_count, 1)
+
+
+class DailyRangesTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Trading days of May and June 2024, without Memorial Day (Monday 5/27) and Juneteenth (Wednesday 6/19)
+        dates = pd.bdate_range("2024-05-01", "2024-06-28", name="Date").drop(pd.DatetimeIndex(["2024-05-27", "2024-06-19"]))
+        lows = np.arange(len(dates), dtype=float)
+        self.bars = pd.DataFrame({"Open": lows, "High": lows + 0.5, "Low": lows, "Close": lows, "Volume": 1000.0}, index=dates)
+        self.download = mock.Mock(side_effect=self.fake_download)
+        self.store = price_store.PriceStore(directory, downloader=self.download)
+
+    def fake_download(self, ticker, start=None, end=None, **kwargs):
+        bars = self.bars.loc[str(start)[:10]:] if start else self.bars
+        return bars.loc[:pd.Timestamp(str(end)[:10]) - pd.Timedelta(days=1)] if end else bars
+
+    def trading_dates(self, ticker, days):
+        ranges = self.store.get_daily_ranges(ticker, days)
+        return {day.isoformat(): price_range[0].isoformat() if price_range else None for day, price_range in ranges.items()}
+
+    def test_snaps_to_the_nearest_trading_day(self):
+        self.assertEqual(self.trading_dates("AAPL", ["2024-06-12", "2024-06-08", "2024-06-09", "2024-05-27", "2024-06-19"]), {
+            "2024-06-12": "2024-06-12", # A trading day
+            "2024-06-08": "2024-06-07", # Saturday, a day after Friday
+            "2024-06-09": "2024-06-10", # Sunday, a day before Monday
+            "2024-05-27": "2024-05-28", # Memorial Day, a day before Tuesday and three after Friday
+            "2024-06-19": "2024-06-18", # Juneteenth, as near Tuesday as Thursday, so the earlier day wins
+        })
+
+    def test_returns_none_out_of_range(self):
+        self.assertEqual(self.trading_dates("AAPL", ["2024-01-10", "2024-08-30"]), {"2024-01-10": None, "2024-08-30": None})
+
+    def test_returns_the_trading_day_range(self):
+        trading_date, low, high = self.store.get_daily_range("AAPL", "2024-06-08")
+
+        self.assertEqual(trading_date.isoformat(), "2024-06-07")
+        self.assertEqual((low, high), (self.bars.loc["2024-06-07", "Low"], self.bars.loc["2024-06-07", "High"]))
+
+    def test_downloads_each_ticker_once_for_a_batch(self):
+        for ticker in ("AAPL", "MSFT"):
+            self.store.get_daily_ranges(ticker, ["2024-05-06", "2024-05-27", "2024-06-08", "2024-06-19", "2024-06-26"])
+
+        self.assertEqual([call.args[0] for call in self.download.call_args_list], ["AAPL", "MSFT"])
+
+
+class GetPriceStoreTests(SimpleTestCase):
+    def test_creates_one_store_across_threads(self):
+        barrier = threading.Barrier(8)
+
+        def get_store():
+            barrier.wait()
+            return price_store.get_price_store()
+
+        with mock.patch.object(price_store, "_price_store", None), \
+                mock.patch.object(price_store, "PriceStore", side_effect=lambda *args, **kwargs: (time.sleep(0.01), object())[1]) as create:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                stores = set(executor.map(lambda _: get_store(), range(8)))
+
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(len(stores), 1)
+
+
+@override_settings(TRANSACTION_REBUILD_WINDOW=0)
+class AddTransactionTests(PortfolioTestCase):
+    transaction = {
+        "email": EMAIL, "portfolio": "Main", "stock": "AAPL", "amount": 1,
+        "unit_price": 100, "total_price": 100, "date_purchased": "2024-07-01",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.http = Client(HTTP_HOST="localhost", raise_request_exception=False)
+
+    def add_transaction(self):
+        # The frontend inserts the row before calling add_transaction
+        self.supabase.tables["stock_data"] = self.rows + [dict(self.transaction, owner=EMAIL)]
+        return self.http.post("/backend/add_transaction/", self.transaction, content_type="application/json")
+
+    def history(self):
+        return views.read_snapshot(views.get_cache_key(EMAIL, "Main"))["history"]
+
+    def test_drops_the_snapshot_when_the_patch_fails(self):
+        views.cache_all_portfolios(self.supabase, "stock_data", EMAIL, ["Main"])
+
+        with mock.patch.object(views, "apply_transaction", side_effect=ValueError):
+            response = self.add_transaction()
+
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(views.load_built_at(EMAIL, "Main"))
+
+    def test_keeps_the_patch_over_a_rebuild_that_read_before_it(self):
+        read_at = time.time()
+        main_rows = [row for row in self.rows if row["portfolio"] == "Main"]
+        views.cache_portfolio(main_rows, EMAIL, "Main", read_at=read_at - 1)
+
+        self.assertEqual(self.add_transaction().status_code, 200)
+        views.cache_portfolio(main_rows, EMAIL, "Main", read_at=read_at) # Read before the insert, written after the patch
+
+        self.assertEqual(len(self.history()), len(main_rows) + 1)
+
+    def test_drops_the_snapshot_when_it_changed_during_the_patch(self):
+        main_rows = [row for row in self.rows if row["portfolio"] == "Main"]
+        views.cache_portfolio(main_rows, EMAIL, "Main", read_at=time.time() - 1)
+        apply_transaction = views.apply_transaction
+
+        def apply_while_another_request_patches(info, row, stock_data):
+            apply_transaction(info, row, stock_data)
+            views.cache_portfolio(main_rows, EMAIL, "Main") # A rebuild without the transaction, written after the patch read the snapshot
+
+        with mock.patch.object(views, "apply_transaction", side_effect=apply_while_another_request_patches):
+            self.assertEqual(self.add_transaction().status_code, 200)
+
+        self.assertIsNone(views.load_built_at(EMAIL, "Main"))
+
+    @override_settings(TRANSACTION_REBUILD_WINDOW=60)
+    def test_rebuilds_a_snapshot_that_may_include_the_transaction(self):
+        views.cache_all_portfolios(self.supabase, "stock_data", EMAIL, ["Main"])
+        self.supabase.queries.clear()
+
+        self.assertEqual(self.add_transaction().status_code, 200)
+
+        self.assertEqual(self.supabase.queries, ["stock_data"])
+        self.assertEqual(len(self.history()), len([row for row in self.rows if row["portfolio"] == "Main"]) + 1)
+
+
+class AppendTradingDaysTests(SimpleTestCase):
+    def test_revises_the_last_date_and_appends_later_closes(self):
+        info = {
+            "positions": {"AAPL": {"total_shares": 2}, "MSFT": {"total_shares": 1}},
+            "components": {"AAPL": [["2024-06-03", 200.0], ["2024-06-04", 210.0]], "MSFT": [["2024-06-03", 50.0], ["2024-06-04", 51.0]]},
+            "performance": [["2024-06-03", 250.0], ["2024-06-04", 261.0]], # 2024-06-04 was priced intraday
+        }
+        close_prices = pd.DataFrame({"AAPL": [110.0, 120.0]}, index=pd.to_datetime(["2024-06-04", "2024-06-05"]))
+
+        incremental.append_trading_days(info, close_prices)
+
+        self.assertEqual(info["components"]["AAPL"], [["2024-06-03", 200.0], ["2024-06-04", 220.0], ["2024-06-05", 240.0]])
+        self.assertEqual(info["performance"], [["2024-06-03", 250.0], ["2024-06-04", 271.0], ["2024-06-05", 240.0]])
+
+
+class AnalyticsTests(SimpleTestCase):
+    def analytics(self, values, transactions):
+        dates = ["2024-06-03", "2024-06-04", "2024-06-05"]
+        history = [
+            {"stock": "AAPL", "amount": amount, "unit_price": 10.0, "total_price": total_price, "date_purchased": date}
+            for date, amount, total_price in transactions
+        ]
+        info = {"performance": [[date, value] for date, value in zip(dates, values)], "components": {"AAPL": []}, "history": history}
+        return compute_analytics(info)
+
+    def test_a_buy_at_the_close_is_not_a_gain(self):
+        # 10 shares bought at 10 close at 11 the next day, and 10 more are bought at that close on the third
+        analytics = self.analytics([100.0, 110.0, 220.0], [("2024-06-03", 10, 100.0), ("2024-06-05", 10, 110.0)])
+
+        self.assertEqual([value for _, value in analytics["series"]["daily_returns"]], [0.0, 0.1, 0.0])
+        self.assertAlmostEqual(analytics["summary"]["total_return"], 0.1)
+        self.assertAlmostEqual(analytics["summary"]["return_on_cost"], 10 / 210)
+
+    def test_a_sell_is_not_a_loss(self):
+        # Half of the shares are sold at the day's close of 11, a negative total price
+        analytics = self.analytics([100.0, 110.0, 55.0], [("2024-06-03", 10, 100.0), ("2024-06-05", -5, -55.0)])
+
+        self.assertEqual([value for _, value in analytics["series"]["daily_returns"]], [0.0, 0.1, 0.0])
+        self.assertAlmostEqual(analytics["summary"]["max_drawdown"], 0.0)
+        self.assertAlmostEqual(analytics["summary"]["cost_basis"], 45.0)
+
+    def test_ignores_transactions_of_unpriced_tickers(self):
+        index = pd.DatetimeIndex(["2024-06-03", "2024-06-04"])
+        history = [
+            {"stock": "AAPL", "total_price": 100.0, "date_purchased": "2024-06-01"}, # A Saturday, so it lands on Monday
+            {"stock": "DELISTED", "total_price": 50.0, "date_purchased": "2024-06-04"},
+        ]
+
+        flows = cash_flows(history, index, {"AAPL"})
+
+        self.assertEqual(flows.tolist(), [100.0, 0.0])
+        self.assertEqual(daily_returns(pd.Series([100.0, 105.0], index=index), flows).tolist(), [0.0, 0.05])
+
+
+class RefresherTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.built_at = {}
+        self.rebuild_user = mock.Mock()
+        self.update_closes = mock.Mock()
+        self.refresher = refresh.Refresher(
+            mock.Mock(), self.rebuild_user, self.update_closes, lambda email, portfolio: self.built_at.get(portfolio), workers=1,
+        )
+
+    def test_skips_users_locked_by_another_process(self):
+        with refresh.rebuild_lock(EMAIL) as acquired:
+            self.assertTrue(acquired)
+            self.refresher.refresh_user(EMAIL, ["Main"]).result()
+
+        self.rebuild_user.assert_not_called()
+        self.refresher.refresh_user(EMAIL, ["Main"]).result()
+        self.rebuild_user.assert_called_once_with(EMAIL, ["Main"])
+
+    def test_refreshes_portfolios_of_one_user_at_once(self):
+        started = threading.Barrier(2, timeout=5)
+        rebuild_portfolio = mock.Mock(side_effect=lambda email, portfolio: started.wait())
+        refresher = refresh.Refresher(rebuild_portfolio, self.rebuild_user, self.update_closes, lambda email, portfolio: None, workers=2)
+
+        futures = [refresher.refresh_portfolio(EMAIL, portfolio) for portfolio in ("Main", "Other")]
+        for future in futures:
+            future.result()
+
+        self.assertEqual(rebuild_portfolio.call_count, 2)
+
+    def test_skips_users_rebuilt_since_queued(self):
+        with refresh.rebuild_lock(EMAIL):
+            future = self.refresher.refresh_user(EMAIL, ["Main"])
+            self.built_at["Main"] = time.time() + 1 # Rebuilt by the lock holder
+        future.result()
+
+        self.rebuild_user.assert_not_called()
+
+    def test_updates_closes_unless_a_snapshot_is_missing(self):
+        refresh.mark_active(EMAIL, ["Main", "Other"])
+        self.built_at["Main"] = self.built_at["Other"] = time.time() - 120
+        closed = datetime.fromtimestamp(time.time() - 60).astimezone()
+
+        with mock.patch.object(refresh, "last_market_close", return_value=closed):
+            for future in self.refresher.refresh_active_users():
+                future.result()
+            del self.built_at["Other"]
+            for future in self.refresher.refresh_active_users():
+                future.result()
+
+        self.update_closes.assert_called_once_with(EMAIL, ["Main", "Other"])
+        self.rebuild_user.assert_called_once_with(EMAIL, ["Main", "Other"])
+
+    def test_scheduler_only_starts_in_server_processes(self):
+        for argv, environ, serves in (
+            (["manage.py", "refresh_portfolios"], {}, False),
+            (["manage.py", "migrate"], {}, False),
+            (["manage.py", "runserver"], {}, False),
+            (["manage.py", "runserver"], {"RUN_MAIN": "true"}, True),
+            (["/venv/bin/gunicorn", "backend.wsgi"], {}, True),
+            (["/venv/lib/uvicorn/__main__.py", "backend.asgi:application"], {}, True),
+        ):
+            with self.subTest(argv=argv), mock.patch.object(sys, "argv", argv), mock.patch.dict(os.environ, environ):
+                self.assertEqual(serves_requests(), serves)
+
+
+class RetrieveTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        chunks = [(f"revenue-{i}", f"Revenue grew in segment {i}.") for i in range(4)]
+        chunks += [(f"risk-{i}", f"Supply chain risk number {i}.") for i in range(4)]
+        store = LocalVectorStore(os.path.join(directory, "vectors"), DeterministicFakeEmbedding(size=16))
+        ids, texts = zip(*chunks)
+        store.add_texts(texts, metadatas=[{"ticker": "AAPL", "source": "10-K", "chunk_id": id} for id in ids], ids=list(ids))
+        bm25 = BM25Index(os.path.join(directory, "bm25"))
+        bm25.add("AAPL", chunks, "10-K")
+
+        self.search = mock.patch.object(store, "similarity_search_by_vector_with_score", wraps=store.similarity_search_by_vector_with_score).start()
+        self.addCleanup(mock.patch.stopall)
+        self.pipeline = RAGPipeline(store, FakeListLLM(responses=["answer"]), k=2, sparse_index=bm25, shortlist=3)
+
+    def retrieve(self, query):
+        return self.pipeline.retrieve("AAPL", "AAPL: " + query, embedding=[1.0] * 16)
+
+    def test_rejects_tickers_that_are_not_file_names(self):
+        with self.assertRaises(ValueError):
+            self.pipeline.sparse_index.search("../../evil", "revenue")
+        response = Client(HTTP_HOST="localhost").post("/backend/chatbot/", {"ticker": "../../evil", "query": "revenue"}, content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_narrows_the_vector_search_to_keyword_matches(self):
+        documents = self.retrieve("revenue")
+
+        self.search.assert_called_once()
+        self.assertEqual(len(self.search.call_args.kwargs["filter"]["chunk_id"]["$in"]), 3)
+        self.assertEqual(len(documents), 2)
+        self.assertTrue(all("Revenue" in document.page_content for document in documents))
+
+    def test_searches_every_chunk_without_enough_keyword_matches(self):
+        self.retrieve("dividends")
+
+        self.search.assert_called_once()
+        self.assertNotIn("chunk_id", self.search.call_args.kwargs["filter"])
+
+
+class LocalVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = LocalVectorStore(self.directory, DeterministicFakeEmbedding(size=16))
+
+    def test_parses_only_appended_rows(self):
+        self.store.add_texts([f"first {i}" for i in range(5)], metadatas=[{"ticker": "AAPL"}] * 5)
+
+        with mock.patch.object(local_vector_store.json, "loads", wraps=local_vector_store.json.loads) as loads:
+            self.store.add_texts(["second 0", "second 1"], metadatas=[{"ticker": "MSFT"}] * 2)
+
+        self.assertEqual(loads.call_count, 2)
+        self.assertEqual(len(self.store.similarity_search_by_vector([1.0] * 16, k=10, filter={"ticker": "AAPL"})), 5)
+        self.assertEqual(len(self.store.similarity_search_by_vector([1.0] * 16, k=10, filter={"ticker": "MSFT"})), 2)
+
+    def test_picks_up_rows_added_by_another_process(self):
+        self.store.add_texts(["first"], metadatas=[{"ticker": "AAPL"}])
+        other = LocalVectorStore(self.directory, DeterministicFakeEmbedding(size=16))
+
+        ids = other.add_texts(["second", "first"], metadatas=[{"ticker": "AAPL"}] * 2)
+
+        self.assertEqual(ids[1], self.store.add_texts(["first"], metadatas=[{"ticker": "AAPL"}])[0]) # Default IDs hash the text
+        self.assertEqual(len(self.store.similarity_search_by_vector([1.0] * 16, k=10, filter={"ticker": "AAPL"})), 2)
+
+
+    def test_embeds_outside_the_lock(self):
+        embed_documents = self.store.embedding.embed_documents
+        added = threading.Event()
+
+        def add_shared():
+            self.store.add_texts(["shared"], metadatas=[{"ticker": "AAPL"}])
+            added.set()
+
+        def embed_while_another_thread_adds(texts):
+            if not added.is_set() and len(texts) == 2:
+                # Times out if the lock is held, and otherwise stores "shared" first
+                threading.Thread(target=add_shared).start()
+                self.assertTrue(added.wait(5))
+            return embed_documents(texts)
+
+        with mock.patch.object(self.store, "embedding", mock.Mock(embed_documents=embed_while_another_thread_adds)):
+            self.store.add_texts(["shared", "own"], metadatas=[{"ticker": "AAPL"}] * 2)
+
+        texts = [document.page_content for document in self.store.similarity_search_by_vector([1.0] * 16, k=10)]
+        self.assertEqual(sorted(texts), ["own", "shared"])
+
+class IngestionRecordTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_keeps_the_manifest_and_checkpoint_per_vector_store(self):
+        path = os.path.join(self.directory, "manifest.sqlite3")
+        EmbeddingManifest(path, "pinecone:filings").add(["AAPL:10-K:1:a"], "AAPL", "10-K")
+        Checkpoint(os.path.join(self.directory, "checkpoint.json"), "pinecone:filings").mark_done("AAPL", "10-K")
+
+        self.assertEqual(EmbeddingManifest(path, "pinecone:filings").missing(["AAPL:10-K:1:a"]), set())
+        self.assertEqual(EmbeddingManifest(path, "local:/vectors").missing(["AAPL:10-K:1:a"]), {"AAPL:10-K:1:a"})
+        self.assertIn(("AAPL", "10-K"), Checkpoint(os.path.join(self.directory, "checkpoint.json"), "pinecone:filings"))
+        self.assertNotIn(("AAPL", "10-K"), Checkpoint(os.path.join(self.directory, "checkpoint.json"), "local:/vectors"))
+
+
+def fetch_fake_filing(ticker, form):
+    '''
+    A picklable stand-in for ingest.fetch_latest_filing, returning a filing of six distinct chunks.
+    '''
+    text = "\n\n".join(f"{ticker} {form} section {i}. " + "Revenue grew. " * 100 for i in range(6))
+    return text, f"{ticker}-1", "2024-01-31"
+
+
+class IngestTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = LocalVectorStore(os.path.join(self.directory, "vectors"), DeterministicFakeEmbedding(size=16))
+        self.checkpoint_path = os.path.join(self.directory, "checkpoint.json")
+        self.manifest = EmbeddingManifest(os.path.join(self.directory, "manifest.sqlite3"), "local:vectors")
+
+    def ingest(self, fetch_filing, add_texts):
+        with mock.patch.object(self.store, "add_texts", side_effect=add_texts) as add:
+            failed = ingest.ingest(
+                [("AAPL", "10-K"), ("MSFT", "10-K")], self.store, fetch_filing=fetch_filing,
+                checkpoint=Checkpoint(self.checkpoint_path, "local:vectors"), manifest=self.manifest,
+                processes=0, embed_workers=1, batch_size=2,
+            )
+        return failed, [id for call in add.call_args_list for id in call.kwargs["ids"]]
+
+    def test_resumes_after_a_failed_filing(self):
+        add_texts = self.store.add_texts
+        msft_batches = []
+
+        def fail_on_the_second_msft_batch(texts, metadatas=None, ids=None):
+            if ids[0].startswith("MSFT"):
+                msft_batches.append(ids)
+                if len(msft_batches) == 2:
+                    raise ConnectionError("Embedding failed")
+            return add_texts(texts, metadatas=metadatas, ids=ids)
+
+        with self.assertLogs("backend.rag.ingest", "ERROR"):
+            failed, _ = self.ingest(fetch_fake_filing, fail_on_the_second_msft_batch)
+        fetch = mock.Mock(wraps=fetch_fake_filing)
+        refailed, added_ids = self.ingest(fetch, add_texts)
+
+        self.assertEqual(failed, [("MSFT", "10-K")])
+        self.assertEqual(len(msft_batches), 3)
+        self.assertEqual(refailed, [])
+        fetch.assert_called_once_with("MSFT", "10-K") # The checkpoint skips AAPL
+        self.assertEqual(added_ids, msft_batches[1]) # The manifest skips the MSFT batches that were embedded
+        self.assertEqual(len(self.store.similarity_search_by_vector([1.0] * 16, k=20)), 12)
+
+
+class WordCountLLM(FakeListLLM):
+    def get_num_tokens(self, text):
+        return len(text.split())
+
+
+async def collect(chunks):
+    return "".join([chunk async for chunk in chunks])
+
+
+class VectorSearchTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = LocalVectorStore(directory, DeterministicFakeEmbedding(size=16))
+        store.add_texts(["Revenue was $383 billion."], metadatas=[{"ticker": "AAPL", "source": "10-K"}])
+        self.llm = WordCountLLM(responses=[" Revenue was $383 billion."] * 2)
+        for patcher in (
+            mock.patch.object(chatbot, "_pipeline", RAGPipeline(store, self.llm)),
+            mock.patch.object(chatbot, "_answer_cache", AnswerCache(max_entries=10, ttl=60)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_escapes_answers_the_same_way_in_every_variant(self):
+        expected = "Revenue was \\$383 billion."
+
+        self.assertEqual(chatbot.vector_search("AAPL", "revenue?"), expected)
+        self.assertEqual("".join(chatbot.stream_vector_search("AAPL", "revenue growth?")), expected)
+        self.assertEqual(chatbot.vector_search("AAPL", "Revenue growth?"), expected) # Cached from the stream
+        self.assertEqual(asyncio.run(chatbot.avector_search("AAPL", "revenue in 2023?")), expected)
+        self.assertEqual(asyncio.run(collect(chatbot.astream_vector_search("AAPL", "revenue in 2024?"))), expected)
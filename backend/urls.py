@@ -14,22 +14,49 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, re_path
 from django.views.generic import TemplateView
-from . import views
+from . import async_views, views
+
+# Endpoints with an async version, served in place of the sync views with settings.ASYNC_VIEWS
+# and always under backend/async/
+ASYNC_ROUTES = {
+    "all_portfolios/": async_views.get_all_portfolios,
+    "portfolio_performance/": async_views.get_portfolio_performance,
+    "portfolio_holdings/": async_views.get_portfolio_holdings,
+    "portfolio_history/": async_views.get_portfolio_history,
+    "portfolio_analytics/": async_views.get_portfolio_analytics,
+    "daily_price_range/": async_views.get_daily_price_range,
+    "daily_price_ranges/": async_views.get_daily_price_ranges,
+    "chatbot/": async_views.get_chatbot_response,
+    "chatbot/stream/": async_views.get_chatbot_stream,
+}
+
+
+def backend_view(route, view):
+    return ASYNC_ROUTES[route] if settings.ASYNC_VIEWS else view
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", TemplateView.as_view(template_name="index.html")),
-    path("backend/all_portfolios/", views.get_all_portfolios, name="get_all_portfolios"),
-    path("backend/portfolio_performance/", views.get_portfolio_performance, name="get_portfolio_performance"),
-    path("backend/portfolio_holdings/", views.get_portfolio_holdings, name="get_portfolio_holdings"),
-    path("backend/portfolio_history/", views.get_portfolio_history, name="get_portfolio_history"),
-    path("backend/daily_price_range/", views.get_daily_price_range, name="get_daily_price_range"),
+    path("backend/all_portfolios/", backend_view("all_portfolios/", views.get_all_portfolios), name="get_all_portfolios"),
+    path("backend/portfolio_performance/", backend_view("portfolio_performance/", views.get_portfolio_performance), name="get_portfolio_performance"),
+    path("backend/portfolio_holdings/", backend_view("portfolio_holdings/", views.get_portfolio_holdings), name="get_portfolio_holdings"),
+    path("backend/portfolio_history/", backend_view("portfolio_history/", views.get_portfolio_history), name="get_portfolio_history"),
+    path("backend/portfolio_analytics/", backend_view("portfolio_analytics/", views.get_portfolio_analytics), name="get_portfolio_analytics"),
+    path("backend/add_transaction/", views.add_transaction, name="add_transaction"),
+    path("backend/daily_price_range/", backend_view("daily_price_range/", views.get_daily_price_range), name="get_daily_price_range"),
+    path("backend/daily_price_ranges/", backend_view("daily_price_ranges/", views.get_daily_price_ranges), name="get_daily_price_ranges"),
     path("backend/premium/", views.get_premium, name="get_premium"),
     path("backend/tickers/", views.get_tickers, name="get_tickers"),
-    path("backend/chatbot/", views.get_chatbot_response, name="get_chatbot_response"),
+    path("backend/chatbot/", backend_view("chatbot/", views.get_chatbot_response), name="get_chatbot_response"),
+    path("backend/chatbot/stream/", backend_view("chatbot/stream/", views.get_chatbot_stream), name="get_chatbot_stream"),
+    path("backend/chatbot/cache_stats/", views.get_chatbot_cache_stats, name="get_chatbot_cache_stats"),
+    path("backend/metrics/", views.get_metrics, name="get_metrics"),
+    *[path("backend/async/" + route, view, name="async_" + view.__name__) for route, view in ASYNC_ROUTES.items()],
     path("dashboard/", TemplateView.as_view(template_name="index.html")),
     re_path(r'^.*$', TemplateView.as_view(template_name='index.html')),
 ]
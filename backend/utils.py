@@ -1,24 +1,81 @@
+import asyncio
 import os
+import weakref
 import supabase
 from pinecone import Pinecone
+from .metrics import timed
+from .rag.ticker_registry import get_ticker_registry
+
+
+_supabase_client = None
+_async_supabase_clients = weakref.WeakKeyDictionary() # One per event loop, since their HTTP connections are bound to it
 
 
 def get_supabase_client():
     '''
-    Creates a Supabase client using the environment variables.
+    Returns the process-wide Supabase client, creating it from the environment variables on first use.
     Assumes load_dotenv() is always called before this function.
 
     Returns:
         client (supabase.Client): The Supabase client
     '''
-    SUPABASE_URL = os.environ.get("SUPABASE_URL")
-    SUPABASE_API_KEY = os.environ.get("SUPABASE_API_KEY")
-    return supabase.create_client(SUPABASE_URL, SUPABASE_API_KEY)
+    global _supabase_client
+    if _supabase_client is None:
+        SUPABASE_URL = os.environ.get("SUPABASE_URL")
+        SUPABASE_API_KEY = os.environ.get("SUPABASE_API_KEY")
+        _supabase_client = supabase.create_client(SUPABASE_URL, SUPABASE_API_KEY)
+    return _supabase_client
+
+
+async def get_async_supabase_client():
+    '''
+    Returns the running event loop's async Supabase client, used by the async views,
+    creating it from the environment variables on first use.
+    Assumes load_dotenv() is always called before this function.
+
+    Returns:
+        client (supabase.AsyncClient): The async Supabase client
+    '''
+    loop = asyncio.get_running_loop()
+    client = _async_supabase_clients.get(loop)
+    if client is None:
+        SUPABASE_URL = os.environ.get("SUPABASE_URL")
+        SUPABASE_API_KEY = os.environ.get("SUPABASE_API_KEY")
+        client = _async_supabase_clients[loop] = await supabase.acreate_client(SUPABASE_URL, SUPABASE_API_KEY)
+    return client
+
+
+def load_ticker_registry():
+    '''
+    Returns the ticker registry written by embed.py.
+    If there is no registry yet (e.g. the index was populated before it existed),
+    it is seeded once from the Pinecone index metadata.
+    Assumes load_dotenv() is always called before this function.
+
+    Returns:
+        registry (TickerRegistry): The ticker registry
+    '''
+    registry = get_ticker_registry()
+    if not registry.exists():
+        registry.update({ticker: [] for ticker in scan_index_tickers()})
+    return registry
 
 
 def retrieve_tickers():
+    '''
+    Retrieves all unique stock tickers from the ticker registry.
+    Assumes load_dotenv() is always called before this function.
+
+    Returns:
+        tickers (list): A list of all unique stock tickers
+    '''
+    return load_ticker_registry().tickers()
+
+
+def scan_index_tickers():
     '''
     Retrieves all unique stock tickers from the Pinecone index metadata.
+    Only finds tickers within the 10000 results a single query can return.
     Assumes load_dotenv() is always called before this function.
 
     Returns:
@@ -29,11 +86,12 @@ def retrieve_tickers():
 
     # Get the top 10000 results to ensure all tickers are included
     vector_dimension = 1536
-    results = index.query(
-        vector=[0] * vector_dimension,
-        top_k=10000, # Adjust based on dataset size
-        include_metadata=True
-    )
+    with timed("pinecone", "scan_tickers"):
+        results = index.query(
+            vector=[0] * vector_dimension,
+            top_k=10000, # Adjust based on dataset size
+            include_metadata=True
+        )
 
     # Extract unique tickers from the metadata
     tickers = set()
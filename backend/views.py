@@ -1,101 +1,451 @@
 import json
+import logging
 import os
-import yfinance as yf
+import time
+import numpy as np
 from collections import defaultdict
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
 from django.core.cache import cache
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
 from dotenv import load_dotenv
-from rest_framework.decorators import api_view
-from .utils import get_supabase_client, retrieve_tickers
-from .rag.chatbot import vector_search
+from rest_framework.decorators import api_view, permission_classes
+from .analytics import compute_analytics
+from .downsample import RESOLUTIONS, compute_levels, select_points
+from .incremental import append_trading_days, apply_transaction
+from .ledger import Ledger
+from .metrics import IsAdminOrMetricsToken, record_cache_lookup, render_metrics, timed
+from .performance import close_matrix, compute_components, series_to_points
+from .price_store import get_price_store, is_valid_ticker
+from .refresh import get_refresher, mark_active
+from .snapshot import decode_snapshot, decode_stamp, encode_snapshot
+from .utils import get_supabase_client, load_ticker_registry, retrieve_tickers
+from .rag.chatbot import get_answer_cache, stream_vector_search, vector_search
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ALL_USERS_TABLE = os.environ.get("ALL_USERS_TABLE")
+PORTFOLIOS_TABLE = os.environ.get("PORTFOLIOS_TABLE")
+STOCK_DATA_TABLE = os.environ.get("STOCK_DATA_TABLE")
+STOCK_DATA_COLUMNS = ("portfolio", "stock", "amount", "unit_price", "total_price", "date_purchased")
+
+
+def get_cache_key(email, portfolio):
+    '''
+    Helper function for building the cache key of a user's portfolio.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        cache_key (str): The cache key, e.g. "user@example.com_my_portfolio"
+    '''
+    portfolio_name = portfolio.replace(" ", "_").lower()
+    return f"{email}_{portfolio_name}"
+
+
+def cache_portfolio(rows, email, portfolio, price_histories=None, read_at=None):
+    '''
+    Helper function for caching one of the user's portfolios in the database.
+    The snapshot is not written if the cached one was rebuilt or patched since the rows were read,
+    since the rows may then be missing a transaction that the cached snapshot includes.
+
+    Args:
+        rows (list): The portfolio's rows from the stock data table
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+        price_histories (dict): Each ticker's price history from its earliest purchase (or earlier),
+        if already read. Otherwise they are read from the price store.
+        read_at (float): When the rows were read from the database, as a Unix timestamp. Defaults to now.
+
+    Returns:
+        info (dict): The portfolio's performance, positions and history
+    '''
+    read_at = read_at or time.time()
+    info = {
+        "built_at": read_at, # Rows and prices are up to date as of then
+        "updated_at": read_at, # Moved forward by every patch
+        "performance": [], # [[date, total_value], ...]
+        "levels": {}, # {resolution: {dates, open, high, low, close}}, downsampled performance
+        "components": {}, # {stock: [[date, value], ...]}, for incremental updates
+        "positions": {}, # {stock: {total_value, total_shares}}
+        "history": [], # [{stock, amount, unit_price, total_price, date_purchased}]
+        "analytics": {} # {series, summary, benchmark}
+    }
+
+    # Read each ticker's price history once, starting from its earliest purchase
+    if price_histories is None:
+        price_histories = read_price_histories(rows)
+
+    history = []
+    for row in rows:
+        stock, amount, total_price = row["stock"], row["amount"], row["total_price"]
+
+        if stock in info["positions"]:
+            info["positions"][stock]["total_value"] += total_price
+            info["positions"][stock]["total_shares"] += amount
+        else:
+            info["positions"][stock] = {
+                "total_value": total_price,
+                "total_shares": amount
+            }
+
+        # Populate history of transactions
+        history.append({
+            "stock": stock,
+            "amount": amount,
+            "unit_price": row["unit_price"],
+            "total_price": total_price,
+            "date_purchased": row["date_purchased"]
+        })
+    info["history"] = Ledger(history).entries # Sorted once by date purchased
+
+    # Sum up the total value of each stock in the portfolio
+    lots = [(row["stock"], row["amount"], row["date_purchased"]) for row in rows]
+    components = compute_components(lots, close_matrix(price_histories))
+    info["performance"] = series_to_points(components.sum(axis=1, min_count=1).dropna())
+    info["components"] = {stock: series_to_points(components[stock].dropna()) for stock in components.columns}
+    update_derived(info)
+
+    # Store in cache with email, portfolio as key
+    write_snapshot(get_cache_key(email, portfolio), info, unless_updated_after=read_at) # Timeout is set in settings, fresh for 3600s
+    return info
+
+
+def read_price_histories(rows, executor=None):
+    '''
+    Helper function for reading the price history of every ticker in the rows once, from its earliest purchase.
+
+    Args:
+        rows (list): Rows from the stock data table
+        executor (ThreadPoolExecutor): If given, the tickers are read concurrently on it
+
+    Returns:
+        price_histories (dict): {stock: OHLCV DataFrame}
+    '''
+    price_store = get_price_store()
+    earliest_purchase = earliest_purchases(rows)
+    histories = (executor.map if executor else map)(price_store.get_history, earliest_purchase.keys(), earliest_purchase.values())
+    return dict(zip(earliest_purchase, histories))
+
+
+def earliest_purchases(rows):
+    '''
+    Helper function for finding the date each ticker was first bought, where its price history must start.
+
+    Args:
+        rows (list): Rows from the stock data table
+
+    Returns:
+        earliest_purchase (dict): {stock: date_purchased}
+    '''
+    earliest_purchase = {}
+    for row in rows:
+        stock, date_purchased = row["stock"], row["date_purchased"]
+        if stock not in earliest_purchase or date_purchased < earliest_purchase[stock]:
+            earliest_purchase[stock] = date_purchased
+    return earliest_purchase
+
+
+def read_snapshot(cache_key, components=False):
+    '''
+    Helper function for reading a portfolio snapshot from the cache, recording the lookup's latency and hit or miss.
+
+    Args:
+        cache_key (str): The portfolio's cache key
+        components (bool): Whether to decode each ticker's component series, needed only to patch the snapshot
+
+    Returns:
+        info (dict): The portfolio snapshot, or None on a miss
+    '''
+    with timed("cache", "get"):
+        data = cache.get(cache_key)
+    info = decode_snapshot(data, components)
+    record_cache_lookup("portfolio", info is not None)
+    return info
+
+
+def read_stamp(cache_key):
+    '''
+    Helper function for reading when a cached portfolio snapshot was built and last updated, without decoding it.
+
+    Args:
+        cache_key (str): The portfolio's cache key
+
+    Returns:
+        stamp (dict): {built_at, updated_at}, or None on a miss
+    '''
+    with timed("cache", "get"):
+        data = cache.get(cache_key)
+    return decode_stamp(data)
+
+
+def write_snapshot(cache_key, info, unless_updated_after=None):
+    '''
+    Helper function for writing a portfolio snapshot to the cache, recording the write's latency.
+
+    Args:
+        cache_key (str): The portfolio's cache key
+        info (dict): The portfolio snapshot
+        unless_updated_after (float): If given, the snapshot is not written when the cached one
+        was updated after this Unix timestamp, so that a slow rebuild does not overwrite a newer snapshot
+
+    Returns:
+        written (bool): Whether the snapshot was written
+    '''
+    if unless_updated_after is not None:
+        cached = read_stamp(cache_key)
+        if cached is not None and cached["updated_at"] > unless_updated_after:
+            logger.info("Not overwriting %s, which was updated since it was read", cache_key)
+            return False
+    data = encode_snapshot(info)
+    with timed("cache", "set"):
+        cache.set(cache_key, data)
+    return True
+
+
+def update_derived(info):
+    '''
+    Helper function for computing what a portfolio snapshot derives from its performance and history:
+    the downsampled performance levels, and the analytics compared against settings.BENCHMARK_TICKER.
+    Called whenever the performance series changes.
+
+    Args:
+        info (dict): The portfolio snapshot, updated in place
+
+    Returns:
+        info (dict): The updated portfolio snapshot
+    '''
+    info["levels"] = compute_levels(info["performance"])
+
+    benchmark_closes = None
+    if settings.BENCHMARK_TICKER and info["performance"]:
+        try:
+            benchmark_closes = get_price_store().get_history(settings.BENCHMARK_TICKER, info["performance"][0][0])["Close"]
+        except Exception:
+            logger.exception("Failed to read benchmark %s", settings.BENCHMARK_TICKER)
+    info["analytics"] = compute_analytics(info, benchmark_closes, settings.BENCHMARK_TICKER)
+    return info
+
+
+def load_portfolio(email, portfolio):
+    '''
+    Helper function for reading a portfolio from the cache.
+    On a cache miss (e.g. the request landed on a worker that has not cached it yet,
+    or the entry expired), the portfolio is rebuilt from the database and cached again.
+    A stale snapshot (older than settings.CACHE_TIMEOUT) is served as is while it is rebuilt in the background.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        info (dict): The portfolio's performance, positions and history
+    '''
+    info = read_snapshot(get_cache_key(email, portfolio))
+    if info is None:
+        return rebuild_portfolio(email, portfolio)
+    if time.time() - info["built_at"] > settings.CACHE_TIMEOUT:
+        get_refresher().refresh_portfolio(email, portfolio)
+    return info
+
+
+def rebuild_portfolio(email, portfolio):
+    '''
+    Helper function for rebuilding one of the user's portfolios from the database and caching it.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        info (dict): The portfolio's performance, positions and history
+    '''
+    client = get_supabase_client()
+    read_at = time.time()
+    with timed("supabase", "stock_data"):
+        response = client.table(STOCK_DATA_TABLE).select(*STOCK_DATA_COLUMNS).eq("owner", email).eq("portfolio", portfolio).execute()
+    return cache_portfolio(response.data, email, portfolio, read_at=read_at)
+
+
+def rebuild_user_portfolios(email, portfolios):
+    '''
+    Helper function for rebuilding all the user's portfolios from the database, used by the background refresher.
+
+    Args:
+        email (str): The user's email
+        portfolios (list): A list of the user's portfolios
+
+    Returns:
+        failed (list): The portfolios that could not be cached
+    '''
+    return cache_all_portfolios(get_supabase_client(), STOCK_DATA_TABLE, email, portfolios)
+
+
+def load_built_at(email, portfolio):
+    '''
+    Helper function for checking when a cached portfolio was built, used by the background refresher.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        built_at (float): When the portfolio's prices were last brought up to date, or None if it is not cached
+    '''
+    stamp = read_stamp(get_cache_key(email, portfolio))
+    return stamp["built_at"] if stamp else None
+
+
+def update_portfolio_closes(email, portfolio):
+    '''
+    Helper function for bringing a cached portfolio up to the latest closes without rebuilding it from every lot:
+    its last date is revised, since it may have been priced before its session closed, and later trading days are appended.
+    The snapshot is not written if it was patched in the meantime.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+
+    Returns:
+        info (dict): The updated portfolio, or None if it is not cached
+    '''
+    cache_key = get_cache_key(email, portfolio)
+    info = read_snapshot(cache_key, components=True)
+    if info is None:
+        return None
+
+    now = time.time()
+    if info["performance"] and info["components"]:
+        last_date = info["performance"][-1][0]
+        price_store = get_price_store()
+        price_histories = {stock: price_store.get_history(stock, last_date) for stock in info["components"]}
+        append_trading_days(info, close_matrix(price_histories))
+        update_derived(info)
+    read_updated_at, info["built_at"], info["updated_at"] = info["updated_at"], now, now
+    write_snapshot(cache_key, info, unless_updated_after=read_updated_at)
+    return info
+
+
+def update_user_closes(email, portfolios):
+    '''
+    Helper function for bringing all the user's cached portfolios up to the latest closes, used by the background refresher.
+    A portfolio that is no longer cached is rebuilt from the database instead.
+
+    Args:
+        email (str): The user's email
+        portfolios (list): A list of the user's portfolios
+
+    Returns:
+        failed (list): The portfolios that could not be updated
+    '''
+    failed = []
+    for portfolio in portfolios:
+        try:
+            if update_portfolio_closes(email, portfolio) is None:
+                rebuild_portfolio(email, portfolio)
+        except Exception:
+            logger.exception("Failed to update the closes of portfolio %r for %s", portfolio, email)
+            failed.append(portfolio)
+    return failed
 
 
 def cache_all_portfolios(client, table_name, email, portfolios):
     '''
     Helper function for caching all the user's portfolios in the database.
+    All of the user's stock rows are fetched in a single query and partitioned by portfolio.
+    The price history of every ticker across the portfolios is read once (from its earliest purchase in any of them),
+    then the portfolios are built concurrently on a thread pool of settings.PORTFOLIO_WORKERS threads.
+    A portfolio that fails to build is logged and skipped, so the others are still cached.
 
     Args:
         client (supabase.Client): The Supabase client
         table_name (str): The name of the table to retrieve the data from
         email (str): The user's email
         portfolios (list): A list of the user's portfolios
-    '''
-    for portfolio in portfolios:
-        response = client.table(table_name).select("*").eq("owner", email).eq("portfolio", portfolio).execute()
-
-        info = {
-            "performance": [], # [[date, total_value], ...]
-            "positions": {}, # {stock: {total_value, total_shares}}
-            "history": [] # [{stock, amount, unit_price, total_price, date_purchased}]
-        }
 
-        # Sum up the total value of each stock in the portfolio
-        combined_price_history = defaultdict(float)
-        for row in response.data:
-            stock, amount, total_price = row["stock"], row["amount"], row["total_price"]
-            stock_data = yf.download(stock, start=row["date_purchased"], progress=False)
-
-            if stock in info["positions"]:
-                info["positions"][stock]["total_value"] += total_price
-                info["positions"][stock]["total_shares"] += amount
-            else:
-                info["positions"][stock] = {
-                    "total_value": total_price,
-                    "total_shares": amount
-                }
-
-            # Populate history of transactions
-            info["history"].append({
-                "stock": stock,
-                "amount": amount,
-                "unit_price": row["unit_price"],
-                "total_price": total_price,
-                "date_purchased": row["date_purchased"]
-            })
-            info["history"] = sorted(info["history"], key=lambda x: x["date_purchased"])
-
-            # Update combined_price_history
-            for date, row in stock_data.iterrows():
-                date = date.strftime("%Y-%m-%d")
-                combined_price_history[date] += row['Close'] * amount
-
-        combined_price_history = sorted([[date, value] for date, value in combined_price_history.items()])
-        info["performance"] = combined_price_history
-
-        # Store in cache with email, portfolio as key
-        portfolio_name = portfolio.replace(" ", "_").lower()
-        cache_key = f"{email}_{portfolio_name}"
-        cache.set(cache_key, info) # Timeout is set in settings, 3600s
+    Returns:
+        failed (list): The portfolios that could not be cached
+    '''
+    read_at = time.time()
+    with timed("supabase", "stock_data"):
+        response = client.table(table_name).select(*STOCK_DATA_COLUMNS).eq("owner", email).execute()
+    rows_by_portfolio = defaultdict(list)
+    for row in response.data:
+        rows_by_portfolio[row["portfolio"]].append(row)
+
+    rows = [row for portfolio in portfolios for row in rows_by_portfolio[portfolio]]
+
+    def read_price_histories_safely(executor=None):
+        try:
+            return read_price_histories(rows, executor)
+        except Exception:
+            # Let each portfolio read its own tickers, so that one failing ticker only fails its portfolios
+            logger.exception("Failed to read price histories for %s", email)
+            return None
+
+    def cache_portfolio_safely(portfolio, price_histories):
+        portfolio_rows = rows_by_portfolio[portfolio]
+        if price_histories is not None:
+            stocks = {row["stock"] for row in portfolio_rows}
+            price_histories = {stock: history for stock, history in price_histories.items() if stock in stocks}
+        try:
+            cache_portfolio(portfolio_rows, email, portfolio, price_histories, read_at)
+            return True
+        except Exception:
+            logger.exception("Failed to cache portfolio %r for %s", portfolio, email)
+            return False
+
+    if settings.PORTFOLIO_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=settings.PORTFOLIO_WORKERS) as executor:
+            price_histories = read_price_histories_safely(executor)
+            succeeded = list(executor.map(lambda portfolio: cache_portfolio_safely(portfolio, price_histories), portfolios))
+    else:
+        price_histories = read_price_histories_safely()
+        succeeded = [cache_portfolio_safely(portfolio, price_histories) for portfolio in portfolios]
+
+    return [portfolio for portfolio, ok in zip(portfolios, succeeded) if not ok]
 
 
 @api_view(["POST"])
 def get_all_portfolios(request):
     '''
     Endpoint for retrieving all the portfolios for a given user.
+    Portfolios with a fresh snapshot are served from the cache, stale ones are rebuilt in the background,
+    and only missing ones are built during the request.
 
     Args:
         email (str): The user's email
+        [Optional] rebuild (list): Portfolios to rebuild even if cached, e.g. after add_transaction failed
     
     Returns:
         portfolios (list): A list of all the user's portfolios
         [Excluded] are_public (dict): A dictionary mapping each portfolio to whether it is public or not
     '''
-    load_dotenv()
-    PORTFOLIOS_TABLE = os.environ.get("PORTFOLIOS_TABLE")
-    STOCK_DATA_TABLE = os.environ.get("STOCK_DATA_TABLE")
     client = get_supabase_client()
 
     # Extract email from POST request body
     data = json.loads(request.body.decode("utf-8"))
     email = data["email"]
+    rebuild = set(data.get("rebuild") or [])
 
     # Fetch all the user's portfolios
-    response = client.table(PORTFOLIOS_TABLE).select("portfolio", "is_public").eq("email", email).execute()
+    with timed("supabase", "portfolios"):
+        response = client.table(PORTFOLIOS_TABLE).select("portfolio", "is_public").eq("email", email).execute()
     portfolios = [row["portfolio"] for row in response.data]
 
-    # Store in cache
-    cache_all_portfolios(client, STOCK_DATA_TABLE, email, portfolios)
+    # Store in cache, rebuilding only what is not cached yet
+    snapshots = {portfolio: None if portfolio in rebuild else load_built_at(email, portfolio) for portfolio in portfolios}
+    missing = [portfolio for portfolio, built_at in snapshots.items() if built_at is None]
+    if missing:
+        cache_all_portfolios(client, STOCK_DATA_TABLE, email, missing)
+    if any(built_at is not None and time.time() - built_at > settings.CACHE_TIMEOUT for built_at in snapshots.values()):
+        get_refresher().refresh_user(email, portfolios)
+    mark_active(email, portfolios)
 
     return JsonResponse(portfolios, safe=False) # , {row["portfolio"]: row["is_public"] for row in response.data}
 
@@ -104,25 +454,65 @@ def get_all_portfolios(request):
 def get_portfolio_performance(request):
     '''
     Endpoint for retrieving the performance of a given portfolio.
+    Weekly and monthly resolutions are precomputed OHLC buckets, and max_points
+    reduces the series with LTTB so that the chart keeps its shape.
 
     Args:
         email (str): The user's email
         portfolio (str): The name of the portfolio
+        [Optional] resolution (str): "daily" (default), "weekly" or "monthly"
+        [Optional] max_points (int): The maximum number of points to return
+        [Optional] format (str): "pairs" (default) or "columnar"
 
     Returns:
         performance (list): A list of the portfolio's performance data
-        [[date, total_value], ...]
+        [[date, total_value], ...], where total_value is the bucket's close for weekly and monthly resolutions
+        With format "columnar": {dates: [...], values: [...]}, plus open, high and low for weekly and monthly resolutions,
+        with values rounded to cents
     '''
     # Extract email and portfolio from POST request body
     data = json.loads(request.body.decode("utf-8"))
     email = data["email"]
     portfolio = data["portfolio"]
-    portfolio_name = portfolio.replace(" ", "_").lower()
 
     # Fetch the portfolio performance data from the cache
-    cache_key = f"{email}_{portfolio_name}"
-    portfolio_data = cache.get(cache_key)
-    return JsonResponse(portfolio_data["performance"], safe=False)
+    portfolio_data = load_portfolio(email, portfolio)
+    return performance_response(portfolio_data, data)
+
+
+def performance_response(portfolio_data, data):
+    '''
+    Helper function for selecting the performance requested from a portfolio snapshot.
+
+    Args:
+        portfolio_data (dict): The portfolio snapshot
+        data (dict): The request body, with the optional resolution, max_points and format
+
+    Returns:
+        response (JsonResponse): The performance, as described in get_portfolio_performance,
+        or a 400 error if the resolution, max_points or format is invalid
+    '''
+    resolution = data.get("resolution", "daily")
+    if resolution != "daily" and resolution not in RESOLUTIONS:
+        return JsonResponse({"error": f"Unknown resolution: {resolution}"}, status=400)
+    if data.get("format", "pairs") not in ("pairs", "columnar"):
+        return JsonResponse({"error": f"Unknown format: {data['format']}"}, status=400)
+    max_points = data.get("max_points")
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except (TypeError, ValueError):
+            return JsonResponse({"error": f"max_points must be an integer: {max_points}"}, status=400)
+        if max_points <= 0:
+            return JsonResponse({"error": f"max_points must be positive: {max_points}"}, status=400)
+    if resolution == "daily" and max_points is None and data.get("format") != "columnar":
+        return JsonResponse(portfolio_data["performance"], safe=False)
+
+    columns = select_points(portfolio_data, resolution, max_points)
+    if data.get("format") == "columnar":
+        # Values are dollar amounts, so cents are enough and keep the payload small
+        return JsonResponse({name: column if name == "dates" else np.round(column, 2).tolist() for name, column in columns.items()})
+    return JsonResponse([list(point) for point in zip(columns["dates"], columns["values"])], safe=False)
 
 
 @api_view(["POST"])
@@ -142,11 +532,9 @@ def get_portfolio_holdings(request):
     data = json.loads(request.body.decode("utf-8"))
     email = data["email"]
     portfolio = data["portfolio"]
-    portfolio_name = portfolio.replace(" ", "_").lower()
 
     # Fetch the portfolio holdings data from the cache
-    cache_key = f"{email}_{portfolio_name}"
-    portfolio_data = cache.get(cache_key)
+    portfolio_data = load_portfolio(email, portfolio)
     return JsonResponse(portfolio_data["positions"])
 
 
@@ -158,27 +546,166 @@ def get_portfolio_history(request):
     Args:
         email (str): The user's email
         portfolio (str): The name of the portfolio
+        [Optional] start_date (str): The first date to include (YYYY-MM-DD)
+        [Optional] end_date (str): The last date to include (YYYY-MM-DD)
+        [Optional] offset (int): The number of transactions in the date range to skip
+        [Optional] limit (int): The maximum number of transactions to return
 
     Returns:
-        history (list): A list of the portfolio's history data
+        history (list): A list of the portfolio's history data, ordered by date
         [{stock, amount, unit_price, date_purchased, action}]
+        The total number of transactions in the date range is sent in the X-Total-Count header.
     '''
     # Extract email and portfolio from POST request body
     data = json.loads(request.body.decode("utf-8"))
     email = data["email"]
     portfolio = data["portfolio"]
-    portfolio_name = portfolio.replace(" ", "_").lower()
 
     # Fetch the portfolio history data from the cache
-    cache_key = f"{email}_{portfolio_name}"
-    portfolio_data = cache.get(cache_key)
-    return JsonResponse(portfolio_data["history"], safe=False)
+    portfolio_data = load_portfolio(email, portfolio)
+    return history_response(portfolio_data, data)
+
+
+def history_response(portfolio_data, data):
+    '''
+    Helper function for selecting the page of transactions requested from a portfolio snapshot.
+
+    Args:
+        portfolio_data (dict): The portfolio snapshot
+        data (dict): The request body, with the optional start_date, end_date, offset and limit
+
+    Returns:
+        response (JsonResponse): The transactions, with the X-Total-Count header,
+        or a 400 error if the offset or limit is not a non-negative integer
+    '''
+    start_date = data.get("start_date")
+    end_date = data.get("end_date")
+    offset, limit = data.get("offset", 0), data.get("limit")
+    try:
+        offset = int(offset)
+        limit = int(limit) if limit is not None else None
+    except (TypeError, ValueError):
+        return JsonResponse({"error": f"offset and limit must be integers: {offset}, {limit}"}, status=400)
+    if offset < 0 or (limit is not None and limit < 0):
+        return JsonResponse({"error": f"offset and limit must not be negative: {offset}, {limit}"}, status=400)
+
+    history, total = Ledger(portfolio_data["history"]).page(start_date, end_date, offset, limit)
+    response = JsonResponse(history, safe=False)
+    response["X-Total-Count"] = total
+    return response
+
+
+@api_view(["POST"])
+def get_portfolio_analytics(request):
+    '''
+    Endpoint for retrieving the analytics of a given portfolio, precomputed when it is cached.
+    Returns are time-weighted, so buying or selling shares does not count as a gain or loss.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+        [Optional] series (list): The names of the series to include (default all)
+
+    Returns:
+        analytics (dict): The portfolio's analytics
+        {
+            summary: {total_return, annualized_return, return_on_cost, cost_basis, volatility, max_drawdown, peak, trough,
+                      benchmark_return, excess_return, beta, correlation},
+            series: {daily_returns, cumulative_return, cost_basis, return_on_cost, drawdown, rolling_volatility, benchmark_return},
+            benchmark: ticker
+        }
+        Each series is a list of [date, value] pairs.
+    '''
+    # Extract email and portfolio from POST request body
+    data = json.loads(request.body.decode("utf-8"))
+    email = data["email"]
+    portfolio = data["portfolio"]
+
+    # Fetch the portfolio analytics from the cache
+    portfolio_data = load_portfolio(email, portfolio)
+    return analytics_response(portfolio_data, data)
+
+
+def analytics_response(portfolio_data, data):
+    '''
+    Helper function for selecting the analytics series requested from a portfolio snapshot.
+
+    Args:
+        portfolio_data (dict): The portfolio snapshot
+        data (dict): The request body, with the optional series names
+
+    Returns:
+        response (JsonResponse): The analytics, as described in get_portfolio_analytics
+    '''
+    names = data.get("series")
+    analytics = portfolio_data["analytics"]
+    if names is not None:
+        analytics = dict(analytics, series={name: points for name, points in analytics["series"].items() if name in names})
+    return JsonResponse(analytics)
+
+
+@api_view(["POST"])
+def add_transaction(request):
+    '''
+    Endpoint for applying a transaction that was just inserted into the database to the cached portfolio.
+    Only the transaction's ticker is recomputed, instead of rebuilding the whole portfolio.
+    A snapshot built within settings.TRANSACTION_REBUILD_WINDOW seconds may have read the transaction already,
+    so it is rebuilt instead of patched. A rebuild that read the database before the transaction
+    does not overwrite the patched snapshot (see cache_portfolio), and a snapshot that was rebuilt or patched
+    while this patch was computed is dropped rather than overwritten.
+
+    Args:
+        email (str): The user's email
+        portfolio (str): The name of the portfolio
+        stock (str): The stock ticker (e.g. AAPL)
+        amount (float): The number of shares bought (negative if sold)
+        unit_price (float): The price per share
+        total_price (float): The total price of the transaction
+        date_purchased (str): The date of the transaction (YYYY-MM-DD)
+
+    Returns:
+        positions (dict): A dictionary of the portfolio's updated positions
+        {stock: {total_value, total_shares}}
+    '''
+    # Extract the transaction from POST request body
+    data = json.loads(request.body.decode("utf-8"))
+    email = data["email"]
+    portfolio = data["portfolio"]
+    row = {
+        "stock": data["stock"],
+        "amount": float(data["amount"]), # Form fields may arrive as strings
+        "unit_price": float(data["unit_price"]),
+        "total_price": float(data["total_price"]),
+        "date_purchased": data["date_purchased"].split("T")[0], # Remove timezone info
+    }
+
+    cache_key = get_cache_key(email, portfolio)
+    info = read_snapshot(cache_key, components=True)
+    if info is None or time.time() - info["built_at"] < settings.TRANSACTION_REBUILD_WINDOW:
+        # Not cached, or possibly built after the insert, so rebuild from the database, which includes the transaction
+        info = rebuild_portfolio(email, portfolio)
+    else:
+        try:
+            earliest_purchase = min(entry["date_purchased"] for entry in info["history"] + [row] if entry["stock"] == row["stock"])
+            stock_data = get_price_store().get_history(row["stock"], earliest_purchase)
+            apply_transaction(info, row, stock_data)
+            update_derived(info)
+            read_updated_at, info["updated_at"] = info["updated_at"], time.time()
+            if not write_snapshot(cache_key, info, unless_updated_after=read_updated_at):
+                # Rebuilt or patched since it was read, perhaps without this transaction, so the next read rebuilds it
+                cache.delete(cache_key)
+        except Exception:
+            # Drop the snapshot instead of serving it without the transaction, so the next read rebuilds it
+            cache.delete(cache_key)
+            raise
+    return JsonResponse(info["positions"])
 
 
 @api_view(["POST"])
 def get_daily_price_range(request):
     '''
     Endpoint for retrieving the daily price range of a given stock.
+    Weekends and holidays snap to the nearest trading day.
     
     Args:
         ticker (str): The stock ticker (e.g. AAPL)
@@ -191,16 +718,106 @@ def get_daily_price_range(request):
     data = json.loads(request.body.decode("utf-8"))
     ticker = data["ticker"]
     date_str = data["date"].split("T")[0] # Remove timezone info
-    date = datetime.strptime(date_str, "%Y-%m-%d")
-
-    # Fetch the daily price range of the stock
-    next_day = date + timedelta(days=1)
-    next_day_str = next_day.strftime("%Y-%m-%d")
-    stock_data = yf.download(ticker, start=date_str, end=next_day_str, progress=False)
-    low, high = stock_data["Low"].values[0], stock_data["High"].values[0]
+    if not is_valid_ticker(ticker):
+        return invalid_ticker_response(ticker)
+
+    # Fetch the daily price range of the stock, memoized per (ticker, date)
+    price_range = get_price_store().get_daily_range(ticker, date_str)
+    if price_range is None:
+        return JsonResponse({"error": f"No trading day near {date_str} for {ticker}"}, status=404)
+    _, low, high = price_range
     return JsonResponse((low, high), safe=False)
 
 
+@api_view(["POST"])
+def get_daily_price_ranges(request):
+    '''
+    Endpoint for validating many trade entries at once against their daily price ranges.
+    Entries are grouped by ticker, so each ticker needs only one range read.
+
+    Args:
+        entries (list): A list of entries to look up
+        [{ticker, date (YYYY-MM-DD), [Optional] price}]
+
+    Returns:
+        price_ranges (list): One result per entry, in order
+        [{ticker, date, trading_date, low, high, valid}]
+        trading_date, low and high are null if there is no trading day near the date,
+        and valid (whether the price is within the range) is only included if a price is given.
+    '''
+    # Extract entries from POST request body
+    data = json.loads(request.body.decode("utf-8"))
+    entries = [dict(entry, date=entry["date"].split("T")[0]) for entry in data["entries"]] # Remove timezone info
+    invalid = [entry["ticker"] for entry in entries if not is_valid_ticker(entry["ticker"])]
+    if invalid:
+        return invalid_ticker_response(*invalid)
+
+    # Look up each ticker's dates together
+    price_store = get_price_store()
+    ranges_by_ticker = {
+        ticker: price_store.get_daily_ranges(ticker, dates)
+        for ticker, dates in group_dates_by_ticker(entries).items()
+    }
+    return price_ranges_response(entries, ranges_by_ticker)
+
+
+def invalid_ticker_response(*tickers):
+    '''
+    Helper function for rejecting tickers that fail price_store.is_valid_ticker.
+
+    Args:
+        tickers (str): The invalid tickers
+
+    Returns:
+        response (JsonResponse): A 400 naming the tickers
+    '''
+    return JsonResponse({"error": f"Invalid ticker: {', '.join(map(str, tickers))}"}, status=400)
+
+
+def group_dates_by_ticker(entries):
+    '''
+    Helper function for grouping trade entries' dates by ticker.
+
+    Args:
+        entries (list): [{ticker, date (YYYY-MM-DD)}]
+
+    Returns:
+        dates_by_ticker (dict): {ticker: [date, ...]}
+    '''
+    dates_by_ticker = defaultdict(list)
+    for entry in entries:
+        dates_by_ticker[entry["ticker"]].append(entry["date"])
+    return dates_by_ticker
+
+
+def price_ranges_response(entries, ranges_by_ticker):
+    '''
+    Helper function for matching trade entries to their daily price ranges.
+
+    Args:
+        entries (list): [{ticker, date (YYYY-MM-DD), [Optional] price}]
+        ranges_by_ticker (dict): {ticker: {date: (trading_date, low, high) or None}}
+
+    Returns:
+        response (JsonResponse): One result per entry, as described in get_daily_price_ranges
+    '''
+    price_ranges = []
+    for entry in entries:
+        price_range = ranges_by_ticker[entry["ticker"]][datetime.strptime(entry["date"], "%Y-%m-%d").date()]
+        trading_date, low, high = price_range if price_range else (None, None, None)
+        result = {
+            "ticker": entry["ticker"],
+            "date": entry["date"],
+            "trading_date": trading_date.isoformat() if trading_date else None,
+            "low": low,
+            "high": high,
+        }
+        if entry.get("price") is not None:
+            result["valid"] = price_range is not None and low <= float(entry["price"]) <= high
+        price_ranges.append(result)
+    return JsonResponse(price_ranges, safe=False)
+
+
 @api_view(["POST"])
 def get_premium(request):
     '''
@@ -217,23 +834,27 @@ def get_premium(request):
     email = data["email"]
 
     # Check if the user is a premium user by retrieving from Supabase
-    load_dotenv()
-    ALL_USERS_TABLE = os.environ.get("ALL_USERS_TABLE")
     client = get_supabase_client()
-    response = client.table(ALL_USERS_TABLE).select("is_premium").eq("email", email).execute()
+    with timed("supabase", "all_users"):
+        response = client.table(ALL_USERS_TABLE).select("is_premium").eq("email", email).execute()
     is_premium = response.data[0]["is_premium"]
     return JsonResponse(is_premium, safe=False)
 
 
+@condition(
+    etag_func=lambda request: load_ticker_registry().etag,
+    last_modified_func=lambda request: load_ticker_registry().last_modified,
+)
 @api_view(["GET"])
 def get_tickers(request):
     '''
-    Endpoint for retrieving all the unique stock tickers from the Pinecone index metadata.
+    Endpoint for retrieving all the unique stock tickers with embedded filings.
+    Served from the in-memory ticker registry, with ETag and Last-Modified headers
+    so that unchanged lists can be revalidated with a 304.
 
     Returns:
         tickers (list): A list of all unique stock tickers
     '''
-    load_dotenv()
     tickers = retrieve_tickers()
     return JsonResponse(tickers, safe=False)
 
@@ -246,6 +867,9 @@ def get_chatbot_response(request):
     Args:
         ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
         query (str): The question inputted by the user.
+        [Optional] form (str): Only use the company's 10-K or 10-Q filings
+        [Optional] start_date (str): Only use filings filed on or after this date (YYYY-MM-DD)
+        [Optional] end_date (str): Only use filings filed on or before this date (YYYY-MM-DD)
     
     Returns:
         response (str): The chatbot's answer.
@@ -254,7 +878,69 @@ def get_chatbot_response(request):
     data = json.loads(request.body.decode("utf-8"))
     ticker = data["ticker"]
     query = data["query"]
+    filters = {key: data.get(key) for key in ("form", "start_date", "end_date")}
+    if not is_valid_ticker(ticker):
+        return invalid_ticker_response(ticker)
 
     # Perform vector search and generate chatbot response
-    response = vector_search(ticker, query)
-    return JsonResponse(response, safe=False)
\ No newline at end of file
+    response = vector_search(ticker, query, filters)
+    return JsonResponse(response, safe=False)
+
+
+@api_view(["POST"])
+def get_chatbot_stream(request):
+    '''
+    Endpoint for streaming the chatbot response to a user query as server-sent events.
+    Each event's data is a JSON-encoded chunk of the answer, followed by a final "done" event.
+
+    Args:
+        ticker (str): The stock ticker (e.g. AAPL) specified for filtering.
+        query (str): The question inputted by the user.
+        [Optional] form (str): Only use the company's 10-K or 10-Q filings
+        [Optional] start_date (str): Only use filings filed on or after this date (YYYY-MM-DD)
+        [Optional] end_date (str): Only use filings filed on or before this date (YYYY-MM-DD)
+
+    Returns:
+        response (text/event-stream): The chatbot's answer, chunk by chunk.
+    '''
+    # Extract ticker and query from POST request body
+    data = json.loads(request.body.decode("utf-8"))
+    ticker = data["ticker"]
+    query = data["query"]
+    filters = {key: data.get(key) for key in ("form", "start_date", "end_date")}
+    if not is_valid_ticker(ticker):
+        return invalid_ticker_response(ticker)
+
+    def events():
+        for chunk in stream_vector_search(ticker, query, filters):
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "event: done\ndata: \n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # Stop proxies from buffering the stream
+    return response
+
+
+@api_view(["GET"])
+def get_chatbot_cache_stats(request):
+    '''
+    Endpoint for monitoring the chatbot answer cache.
+
+    Returns:
+        stats (dict): The number of cached answers, exact hits, semantic hits and misses
+    '''
+    return JsonResponse(get_answer_cache().stats())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminOrMetricsToken])
+def get_metrics(request):
+    '''
+    Endpoint for scraping this process's request latencies, upstream call latencies and counts,
+    and cache hit rates, in the Prometheus text format. Staff users only, or with settings.METRICS_TOKEN.
+
+    Returns:
+        metrics (text/plain): The metrics
+    '''
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
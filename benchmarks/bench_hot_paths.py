@@ -0,0 +1,238 @@
+'''
+Times the backend hot paths offline, on synthetic fixtures (see fixtures.py):
+generated portfolios of --lots lots over --tickers tickers, random-walk OHLCV frames served
+in place of Yahoo, an in-memory Supabase client, and a deterministic embedder and LLM.
+Everything is seeded, so runs with the same parameters are comparable.
+
+Cases:
+    cache_all_portfolios         builds and caches --portfolios portfolios from a warm price store
+    portfolio_performance        get_portfolio_performance on a cached portfolio
+    portfolio_performance_weekly get_portfolio_performance, weekly, columnar and reduced to 500 points
+    portfolio_holdings           get_portfolio_holdings on a cached portfolio
+    portfolio_history            get_portfolio_history on a cached portfolio
+    retrieve_tickers             retrieve_tickers from a registry of --registry-tickers tickers
+    split_text                   the text splitting of generate_embeddings, on a --filing-chars filing
+    vector_search                vector_search with a new question every time, so the answer is generated
+    vector_search_cached         vector_search with the same question, so the answer comes from the cache
+
+Each case is run once to warm up, then --repeat times, and reports the min, median, p95 and mean in milliseconds.
+With --compare, the medians are compared against an earlier --output, and the exit status is 1
+if any case got slower than --threshold (e.g. 0.2 for 20%).
+
+Usage:
+    python benchmarks/bench_hot_paths.py --output baseline.json
+    python benchmarks/bench_hot_paths.py --compare baseline.json --threshold 0.2
+'''
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from fixtures import (
+    StubEmbeddings, StubLLM, StubSupabase, configure_django, frame_downloader,
+    synthetic_filing, synthetic_histories, synthetic_rows,
+)
+
+CASES = (
+    "cache_all_portfolios", "portfolio_performance", "portfolio_performance_weekly", "portfolio_holdings",
+    "portfolio_history", "retrieve_tickers", "split_text", "vector_search", "vector_search_cached",
+)
+# Arguments that do not change what is measured, so runs that differ only in these are comparable
+REPORTING_ARGS = ("cases", "output", "compare", "threshold")
+EMAIL = "bench@example.com"
+
+
+def build_cases(args):
+    '''
+    Installs the stubbed upstreams and returns the cases, as functions running one iteration.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments
+
+    Returns:
+        cases (dict): {case: function}
+    '''
+    from django.conf import settings
+    from django.test import RequestFactory
+
+    from backend import price_store, utils, views
+    from backend.rag import chatbot
+    from backend.rag.answer_cache import AnswerCache
+    from backend.rag.bm25 import BM25Index
+    from backend.rag.embed import split_text
+    from backend.rag.local_vector_store import LocalVectorStore
+    from backend.rag.ticker_registry import get_ticker_registry
+
+    # Portfolios, with the benchmark ticker's history so that the analytics are computed as in production
+    tickers = [f"T{i:03d}" for i in range(args.tickers)]
+    histories = synthetic_histories(tickers + [settings.BENCHMARK_TICKER], args.years)
+    portfolios = [f"Portfolio {i}" for i in range(args.portfolios)]
+    rows = synthetic_rows({ticker: histories[ticker] for ticker in tickers}, args.lots, portfolios, EMAIL)
+    client = StubSupabase({views.STOCK_DATA_TABLE: rows})
+    utils._supabase_client = client
+    price_store._price_store = price_store.PriceStore(os.environ["PRICE_STORE_DIR"], downloader=frame_downloader(histories))
+
+    factory = RequestFactory(HTTP_HOST="localhost")
+
+    def post(view, **body):
+        body = {"email": EMAIL, "portfolio": portfolios[0], **body}
+        def run():
+            response = view(factory.post("/", json.dumps(body), content_type="application/json"))
+            assert response.status_code == 200, response.content
+        return run
+
+    # Ticker registry, as written at ingestion time
+    get_ticker_registry().update({f"R{i:05d}": ["10-K"] for i in range(args.registry_tickers)})
+
+    # Vector store and keyword index, with one filing per ticker
+    filing = synthetic_filing(args.filing_chars)
+    chunks = split_text(filing)
+    store = LocalVectorStore(os.environ["LOCAL_VECTOR_STORE_DIR"], StubEmbeddings())
+    bm25 = BM25Index(os.environ["BM25_INDEX_DIR"])
+    chunk_tickers = tickers[:args.chunk_tickers]
+    for ticker in chunk_tickers:
+        ids = [f"{ticker}-{i}" for i in range(len(chunks))]
+        store.add_texts(chunks, metadatas=[{"ticker": ticker, "source": "10-K", "text": chunk} for chunk in chunks], ids=ids)
+        bm25.add(ticker, list(zip(ids, chunks)), "10-K")
+    chatbot._pipeline = chatbot.RAGPipeline(store, StubLLM(), sparse_index=bm25, context_tokens=settings.CHATBOT_CONTEXT_TOKENS)
+    chatbot._answer_cache = AnswerCache(max_entries=settings.CHATBOT_CACHE_SIZE, ttl=settings.CHATBOT_CACHE_TTL)
+    questions = itertools.count()
+
+    def search_new_question():
+        i = next(questions)
+        chatbot.vector_search(chunk_tickers[i % len(chunk_tickers)], f"How did the operating margin change in quarter {i}?")
+
+    return {
+        "cache_all_portfolios": lambda: views.cache_all_portfolios(client, views.STOCK_DATA_TABLE, EMAIL, portfolios),
+        "portfolio_performance": post(views.get_portfolio_performance),
+        "portfolio_performance_weekly": post(views.get_portfolio_performance, resolution="weekly", max_points=500, format="columnar"),
+        "portfolio_holdings": post(views.get_portfolio_holdings),
+        "portfolio_history": post(views.get_portfolio_history),
+        "retrieve_tickers": utils.retrieve_tickers,
+        "split_text": lambda: split_text(filing),
+        "vector_search": search_new_question,
+        "vector_search_cached": lambda: chatbot.vector_search(chunk_tickers[0], "What were the main risk factors?"),
+    }
+
+
+def measure(function, repeat):
+    '''
+    Runs a function once to warm up, then times it repeat times.
+
+    Args:
+        function (callable): The function
+        repeat (int): The number of timed runs
+
+    Returns:
+        result (dict): The min, median, p95 and mean in milliseconds
+    '''
+    function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": round(float(np.min(samples)), 3),
+        "median_ms": round(float(np.median(samples)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "mean_ms": round(float(np.mean(samples)), 3),
+    }
+
+
+def compare(results, baseline, threshold):
+    '''
+    Adds each case's ratio to its baseline median, and returns the cases that got slower than the threshold.
+
+    Args:
+        results (dict): The results of this run
+        baseline (dict): The output of an earlier run
+        threshold (float): The tolerated slowdown, e.g. 0.2 for 20%
+
+    Returns:
+        regressions (list): The cases whose median grew by more than the threshold
+    '''
+    regressions = []
+    for case, result in results["results"].items():
+        if case not in baseline["results"]:
+            continue
+        result["baseline_median_ms"] = baseline["results"][case]["median_ms"]
+        result["ratio"] = round(result["median_ms"] / result["baseline_median_ms"], 3)
+        if result["ratio"] > 1 + threshold:
+            regressions.append(case)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="*", default=list(CASES), choices=CASES)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--lots", type=int, default=500, help="Lots per portfolio")
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--portfolios", type=int, default=2)
+    parser.add_argument("--registry-tickers", type=int, default=5000)
+    parser.add_argument("--filing-chars", type=int, default=300_000, help="Length of the synthetic filing, about that of a 10-K")
+    parser.add_argument("--chunk-tickers", type=int, default=10, help="Tickers in the vector store, one filing each")
+    parser.add_argument("--output", help="Writes the results to this file as well")
+    parser.add_argument("--compare", help="Compares against the results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    configure_django(tempfile.mkdtemp(prefix="bench_hot_paths_"), BENCHMARK_TICKER="SPY")
+    logging.disable(logging.INFO) # vector_search logs every answer
+    cases = build_cases(args)
+
+    params = {key: value for key, value in vars(args).items() if key not in REPORTING_ARGS}
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "params": params,
+        },
+        "results": {},
+    }
+    for case in args.cases:
+        results["results"][case] = measure(cases[case], args.repeat)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["params"] != params:
+            print(f"Warning: {args.compare} was run with different parameters: {baseline['meta']['params']}", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if regressions:
+        print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Compares building a portfolio's transaction history with the Ledger against the
+original approach of re-sorting the whole list after every appended row, and
+compares paginated history reads against serializing the full history.
+
+The original approach is quadratic, so it is timed on a sample of transactions
+and extrapolated quadratically to the full count.
+
+Usage:
+    python benchmarks/bench_ledger.py --transactions 50000
+'''
+import argparse
+import json
+import time
+
+from fixtures import synthetic_histories, synthetic_rows
+from backend.ledger import Ledger
+
+
+def legacy_history(rows):
+    '''
+    The original construction: append each row and sort the whole list again.
+    '''
+    history = []
+    for row in rows:
+        history.append(row)
+        history = sorted(history, key=lambda x: x["date_purchased"])
+    return history
+
+
+def insert_all(rows):
+    '''
+    Builds the ledger one transaction at a time, as incremental updates do.
+    '''
+    ledger = Ledger()
+    for row in rows:
+        ledger.add(row)
+    return ledger
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument("--legacy-sample", type=int, default=5000, help="Number of transactions to time the original loop on")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    # Transactions in random date order over 20 years, as they come back from the database
+    histories = synthetic_histories([f"T{i:03d}" for i in range(50)], years=20)
+    rows = synthetic_rows(histories, args.transactions)
+    sample = rows[:args.legacy_sample]
+
+    ledger, build = timed(Ledger, rows)
+    _, insert = timed(insert_all, rows)
+    legacy, legacy_sample = timed(legacy_history, sample)
+    legacy_estimate = legacy_sample * (len(rows) / len(sample)) ** 2
+    assert legacy == Ledger(sample).entries
+
+    _, full_read = timed(lambda: json.dumps(ledger.entries))
+    _, page_read = timed(lambda: json.dumps(ledger.page("2015-01-01", "2015-12-31", 0, args.page_size)[0]))
+
+    print(f"transactions={len(rows)}")
+    print(f"ledger build (one sort):     {build * 1000:.1f}ms")
+    print(f"ledger build (bisect adds):  {insert * 1000:.1f}ms")
+    print(f"legacy ({len(sample)} rows):        {legacy_sample:.2f}s")
+    print(f"legacy (estimated):          {legacy_estimate:.1f}s")
+    print(f"full history read:           {full_read * 1000:.1f}ms")
+    print(f"one year, {args.page_size} per page:      {page_read * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+'''
+Compares the vectorized portfolio performance engine against the original
+per-row iterrows accumulation from cache_all_portfolios.
+
+The original loop is far too slow to run on every lot at this scale, so it is
+timed on a sample of lots and extrapolated linearly to the full lot count.
+
+Usage:
+    python benchmarks/bench_performance.py --lots 10000 --years 20
+'''
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from fixtures import synthetic_histories, synthetic_rows
+from backend.performance import close_matrix, compute_performance
+
+
+def legacy_performance(lots, histories):
+    '''
+    The original accumulation: one iterrows pass per lot into a dict, then a sort.
+    '''
+    combined_price_history = defaultdict(float)
+    for stock, amount, date_purchased in lots:
+        stock_data = histories[stock].loc[date_purchased:]
+        for date, row in stock_data.iterrows():
+            date = date.strftime("%Y-%m-%d")
+            combined_price_history[date] += row['Close'] * amount
+    return sorted([[date, value] for date, value in combined_price_history.items()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lots", type=int, default=10000)
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--legacy-sample", type=int, default=50, help="Number of lots to time the original loop on")
+    args = parser.parse_args()
+
+    histories = synthetic_histories([f"T{i:03d}" for i in range(args.tickers)], args.years)
+    lots = [(row["stock"], row["amount"], row["date_purchased"]) for row in synthetic_rows(histories, args.lots)]
+
+    start = time.perf_counter()
+    performance = compute_performance(lots, close_matrix(histories))
+    vectorized = time.perf_counter() - start
+
+    sample = lots[:args.legacy_sample]
+    start = time.perf_counter()
+    legacy = legacy_performance(sample, histories)
+    legacy_sample = time.perf_counter() - start
+    legacy_estimate = legacy_sample * len(lots) / len(sample)
+
+    # Sanity check both implementations agree on the sampled lots
+    check = compute_performance(sample, close_matrix(histories))
+    assert np.allclose([value for _, value in legacy], check.values)
+
+    print(f"lots={len(lots)} tickers={args.tickers} days={len(performance)}")
+    print(f"vectorized:        {vectorized:.3f}s")
+    print(f"legacy ({len(sample)} lots): {legacy_sample:.3f}s")
+    print(f"legacy (estimated): {legacy_estimate:.1f}s")
+    print(f"speedup (estimated): {legacy_estimate / vectorized:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+'''
+Measures ticker-filtered top-k query latency of the local vector store on a synthetic
+corpus, and of the Pinecone index when PINECONE_API_KEY and VECTOR_SEARCH_INDEX are set.
+
+Both are queried with precomputed embeddings, so only the search itself is timed.
+The local corpus is embedded with random vectors and written to a temporary directory.
+
+Usage:
+    python benchmarks/bench_vector_search.py --chunks 200000 --tickers 500 --dimension 1536
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.rag.local_vector_store import LocalVectorStore
+
+
+class RandomEmbeddings:
+    '''
+    Embeds every text as a random vector, so building the corpus costs no API calls.
+    '''
+    def __init__(self, dimension, seed=0):
+        self.dimension = dimension
+        self.rng = np.random.default_rng(seed)
+
+    def embed_documents(self, texts):
+        return self.rng.standard_normal((len(texts), self.dimension), dtype=np.float32)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return {"p50_ms": round(float(np.percentile(latencies, 50)), 3), "p95_ms": round(float(np.percentile(latencies, 95)), 3)}
+
+
+def time_queries(store, queries, tickers, k):
+    latencies = []
+    for query, ticker in zip(queries, tickers):
+        start = time.perf_counter()
+        store.similarity_search_by_vector_with_score(query, k=k, filter={"ticker": ticker})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    embedding = RandomEmbeddings(args.dimension)
+    results = {"chunks": args.chunks, "tickers": args.tickers, "dimension": args.dimension, "k": args.k}
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = LocalVectorStore(directory, embedding)
+        start = time.perf_counter()
+        # Each ticker's chunks are ingested together, as the ingestion CLI does
+        per_ticker = args.chunks // args.tickers
+        for offset in range(0, per_ticker * args.tickers, args.batch_size):
+            rows = range(offset, min(offset + args.batch_size, per_ticker * args.tickers))
+            store.add_texts(
+                [f"chunk {row}" for row in rows],
+                metadatas=[{"ticker": f"T{row // per_ticker:04d}", "source": "10-K"} for row in rows],
+                ids=[str(row) for row in rows],
+            )
+        results["local_build_s"] = round(time.perf_counter() - start, 3)
+
+        queries = embedding.embed_documents(["query"] * args.queries)
+        tickers = [f"T{i:04d}" for i in rng.integers(0, args.tickers, args.queries)]
+        results["local"] = percentiles(time_queries(store, queries, tickers, args.k))
+
+        # Reopening the store measures the cold start of a new process
+        start = time.perf_counter()
+        LocalVectorStore(directory, embedding).similarity_search_by_vector_with_score(queries[0], k=args.k, filter={"ticker": tickers[0]})
+        results["local_cold_start_s"] = round(time.perf_counter() - start, 3)
+
+    if os.getenv("PINECONE_API_KEY") and os.getenv("VECTOR_SEARCH_INDEX"):
+        from backend.rag.vector_store import build_vector_store
+        from backend.rag.ticker_registry import get_ticker_registry
+
+        store = build_vector_store("pinecone")
+        registered = get_ticker_registry().tickers() or ["AAPL"]
+        dimension = len(store.embeddings.embed_query("query"))
+        queries = rng.standard_normal((args.queries, dimension))
+        tickers = [registered[i] for i in rng.integers(0, len(registered), args.queries)]
+        results["pinecone"] = percentiles(time_queries(store, queries.tolist(), tickers, args.k))
+    else:
+        results["pinecone"] = "skipped (PINECONE_API_KEY and VECTOR_SEARCH_INDEX not set)"
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+'''
+Synthetic fixtures and stubbed upstreams shared by the benchmarks, so that they run fully offline:
+random-walk OHLCV frames served in place of yf.download, generated portfolios,
+an in-memory Supabase client, and a deterministic embedder and LLM.
+Everything is seeded, so that results are comparable across runs.
+'''
+import asyncio
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure_django(directory, **environ):
+    '''
+    Points every on-disk store of the backend at a scratch directory, sets the table names
+    the stub Supabase client serves, and sets up Django. Must run before the backend modules are imported.
+
+    Args:
+        directory (str): The scratch directory
+        **environ: Extra environment variables, e.g. BENCHMARK_TICKER=""
+    '''
+    os.environ.update({
+        "DJANGO_SETTINGS_MODULE": "backend.settings",
+        "ALL_USERS_TABLE": "all_users",
+        "PORTFOLIOS_TABLE": "portfolios",
+        "STOCK_DATA_TABLE": "stock_data",
+        "PRICE_STORE_DIR": os.path.join(directory, "price_store"),
+        "BM25_INDEX_DIR": os.path.join(directory, "bm25_index"),
+        "LOCAL_VECTOR_STORE_DIR": os.path.join(directory, "vector_store"),
+        "TICKER_REGISTRY_PATH": os.path.join(directory, "ticker_registry.json"),
+        "CACHE_BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        **environ,
+    })
+    import django
+    django.setup()
+
+
+def synthetic_histories(tickers, years, end="2024-12-31", seed=0):
+    '''
+    Generates random-walk OHLCV frames, one per ticker, over the given number of years.
+
+    Args:
+        tickers (list): The tickers
+        years (int): The number of years of daily bars
+        end (str): The last day (YYYY-MM-DD)
+        seed (int): The random seed
+
+    Returns:
+        histories (dict): {ticker: OHLCV DataFrame indexed by date}
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end, periods=252 * years, name="Date")
+    histories = {}
+    for ticker in tickers:
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(dates))))
+        histories[ticker] = pd.DataFrame({
+            "Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": 1_000_000.0,
+        }, index=dates)
+    return histories
+
+
+def synthetic_rows(histories, n_lots, portfolios=("Main",), owner="bench@example.com", seed=0):
+    '''
+    Generates stock data table rows: n_lots lots per portfolio, of random tickers on random trading days.
+
+    Args:
+        histories (dict): The tickers' OHLCV frames
+        n_lots (int): The number of lots per portfolio
+        portfolios (tuple): The portfolio names
+        owner (str): The owner's email
+        seed (int): The random seed
+
+    Returns:
+        rows (list): [{owner, portfolio, stock, amount, unit_price, total_price, date_purchased}]
+    '''
+    rng = np.random.default_rng(seed)
+    tickers = list(histories)
+    rows = []
+    for portfolio in portfolios:
+        for _ in range(n_lots):
+            ticker = tickers[rng.integers(len(tickers))]
+            day = rng.integers(len(histories[ticker]))
+            amount = float(rng.integers(1, 100))
+            unit_price = float(histories[ticker]["Close"].iloc[day])
+            rows.append({
+                "owner": owner, "portfolio": portfolio, "stock": ticker, "amount": amount,
+                "unit_price": unit_price, "total_price": amount * unit_price,
+                "date_purchased": histories[ticker].index[day].strftime("%Y-%m-%d"),
+            })
+    return rows
+
+
+def synthetic_filing(n_chars, seed=0):
+    '''
+    Generates filing-like text: paragraphs of sentences drawn from a small financial vocabulary,
+    some longer than a chunk, and tables of one line per row, so that the splitter recurses as on real filings.
+
+    Args:
+        n_chars (int): The approximate length of the text
+        seed (int): The random seed
+
+    Returns:
+        text (str): The text
+    '''
+    words = (
+        "revenue income net operating margin fiscal year quarter increased decreased compared "
+        "primarily due to services products cash flows liquidity risk factors segment growth "
+        "million billion percent tax expense research development customers supply chain"
+    ).split()
+    rng = np.random.default_rng(seed)
+    paragraphs, length = [], 0
+    while length < n_chars:
+        if rng.random() < 0.2:
+            lines = [" ".join(rng.choice(words, 3)) + "".join(f" {value:,}" for value in rng.integers(100, 100_000, 4)) for _ in range(rng.integers(5, 60))]
+            paragraphs.append("\n".join(lines))
+        else:
+            sentences = [" ".join(rng.choice(words, rng.integers(8, 25))).capitalize() + "." for _ in range(rng.integers(2, 30))]
+            paragraphs.append(" ".join(sentences))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+
+def frame_downloader(histories, latency=0.0):
+    '''
+    A yf.download stand-in serving slices of the synthetic frames, optionally after sleeping.
+    Unknown tickers get an empty frame, as yf.download returns.
+    '''
+    def download(ticker, start=None, end=None, progress=False, **kwargs):
+        time.sleep(latency)
+        frame = histories.get(ticker)
+        if frame is None:
+            return pd.DataFrame()
+        frame = frame.loc[str(start)[:10]:] if start else frame
+        return frame.loc[:pd.Timestamp(str(end)[:10]) - pd.Timedelta(days=1)] if end else frame.copy()
+    return download
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class StubQuery:
+    '''
+    A Supabase query builder over in-memory rows, filtering on eq() and sleeping on execute().
+    With shared_users, every owner or email sees the same rows, so each request can use a new user.
+    '''
+    def __init__(self, rows, latency, shared_users):
+        self.rows = rows
+        self.latency = latency
+        self.shared_users = shared_users
+        self.filters = []
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        if not (self.shared_users and column in ("owner", "email")):
+            self.filters.append((column, value))
+        return self
+
+    def _rows(self):
+        return [row for row in self.rows if all(row.get(column) == value for column, value in self.filters)]
+
+    def execute(self):
+        time.sleep(self.latency)
+        return Response(self._rows())
+
+
+class AsyncStubQuery(StubQuery):
+    async def execute(self):
+        await asyncio.sleep(self.latency)
+        return Response(self._rows())
+
+
+class StubSupabase:
+    '''
+    A Supabase client serving in-memory tables.
+
+    Args:
+        tables (dict): {table name: rows}
+        latency (float): The seconds each query sleeps
+        query (type): StubQuery, or AsyncStubQuery for the async client
+        shared_users (bool): Whether every user sees the same rows
+    '''
+    def __init__(self, tables, latency=0.0, query=StubQuery, shared_users=False):
+        self.tables = tables
+        self.latency = latency
+        self.query = query
+        self.shared_users = shared_users
+
+    def table(self, name):
+        return self.query(self.tables[name], self.latency, self.shared_users)
+
+
+class StubEmbeddings(Embeddings):
+    '''
+    Embeds each text as a unit vector seeded by its CRC32, so the same text always gets the same vector.
+    '''
+    def __init__(self, latency=0.0, dimension=64):
+        self.latency = latency
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+class StubLLM(LLM):
+    '''
+    Answers every prompt with the same sentence, optionally after sleeping. Tokens are counted as words.
+    '''
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return "Revenue grew."
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return "Revenue grew."
+
+    def get_num_tokens(self, text):
+        return len(text.split())
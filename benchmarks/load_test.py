@@ -0,0 +1,168 @@
+'''
+Load tests the sync views (under WSGI) against the async views (under ASGI) in-process,
+with stubbed upstreams that only add latency: Supabase queries, Yahoo downloads,
+the query embedding and the LLM.
+
+The sync views are served by a fixed pool of --workers threads, as a threaded WSGI worker would;
+the async views are served by one event loop thread, as a single ASGI worker would.
+Both are sent --requests requests with up to --concurrency in flight, and report requests per second.
+
+Scenarios:
+    portfolios    all_portfolios for a new user on every request, so both portfolios are built
+    holdings      portfolio_holdings for a cached portfolio
+    price_ranges  daily_price_ranges for a batch of entries over --tickers tickers
+    chatbot       chatbot with a new question on every request, so the answer is generated
+
+Usage:
+    python benchmarks/load_test.py --workers 4 --concurrency 64 --requests 200 --latency 0.05
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fixtures import (
+    AsyncStubQuery, StubEmbeddings, StubLLM, StubSupabase, configure_django, frame_downloader, synthetic_histories,
+)
+
+STUB_DIR = tempfile.mkdtemp(prefix="load_test_")
+configure_django(STUB_DIR, BENCHMARK_TICKER="")
+
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+
+from backend import utils
+from backend.rag import chatbot
+from backend.rag.bm25 import BM25Index
+from backend.rag.local_vector_store import LocalVectorStore
+
+
+def setup_stubs(args):
+    '''
+    Installs the stubbed upstreams and returns the stock data tables.
+    '''
+    from backend import price_store
+
+    rng = np.random.default_rng(0)
+    tickers = [f"T{i:03d}" for i in range(args.tickers)]
+    stock_data = [
+        {
+            "portfolio": portfolio, "stock": tickers[rng.integers(len(tickers))], "amount": 1.0,
+            "unit_price": 100.0, "total_price": 100.0, "date_purchased": f"2024-{rng.integers(1, 13):02d}-15",
+        }
+        for portfolio in ("Main", "Other") for _ in range(args.lots)
+    ]
+    tables = {
+        "portfolios": [{"portfolio": "Main", "is_public": False}, {"portfolio": "Other", "is_public": False}],
+        "stock_data": stock_data,
+    }
+    utils._supabase_client = StubSupabase(tables, args.latency, shared_users=True)
+    downloader = frame_downloader(synthetic_histories(tickers, years=5), args.latency)
+    price_store._price_store = price_store.PriceStore(os.environ["PRICE_STORE_DIR"], downloader=downloader)
+
+    store = LocalVectorStore(os.environ["LOCAL_VECTOR_STORE_DIR"], StubEmbeddings(args.latency))
+    texts = [f"Revenue of T{i:03d} grew {i}% in fiscal year 2023." for i in range(200)]
+    store.add_texts(texts, metadatas=[{"ticker": "T000", "source": "10-K"} for _ in texts], ids=[str(i) for i in range(len(texts))])
+    chatbot._pipeline = chatbot.RAGPipeline(store, StubLLM(latency=args.latency * 4), sparse_index=BM25Index(os.environ["BM25_INDEX_DIR"]))
+    return tables, tickers
+
+
+def scenario_requests(scenario, n, tickers, run):
+    '''
+    Builds the n (path, body) requests of a scenario; run keeps users and questions unique across runs.
+    '''
+    rng = np.random.default_rng(1)
+    if scenario == "portfolios":
+        return [("all_portfolios/", {"email": f"{run}-{i}@example.com"}) for i in range(n)]
+    if scenario == "holdings":
+        return [("portfolio_holdings/", {"email": "warm@example.com", "portfolio": "Main"}) for _ in range(n)]
+    if scenario == "price_ranges":
+        return [
+            ("daily_price_ranges/", {"entries": [
+                {"ticker": tickers[rng.integers(len(tickers))], "date": f"2024-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}", "price": 100}
+                for _ in range(10)
+            ]})
+            for _ in range(n)
+        ]
+    if scenario == "chatbot":
+        return [("chatbot/", {"ticker": "T000", "query": f"How much did revenue grow? ({run} {i})"}) for i in range(n)]
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def run_sync(requests, workers):
+    app = get_wsgi_application()
+
+    def send(request):
+        path, body = request
+        with httpx.Client(transport=httpx.WSGITransport(app=app), base_url="http://localhost") as client:
+            return client.post("/backend/" + path, json=body).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = list(executor.map(send, requests))
+    return time.perf_counter() - start, statuses
+
+
+def run_async(requests, concurrency, tables, latency):
+    app = get_asgi_application()
+
+    async def main():
+        utils._async_supabase_clients[asyncio.get_running_loop()] = StubSupabase(tables, latency, AsyncStubQuery, shared_users=True)
+        in_flight = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://localhost") as client:
+            async def send(request):
+                path, body = request
+                async with in_flight:
+                    return (await client.post("/backend/async/" + path, json=body)).status_code
+
+            start = time.perf_counter()
+            statuses = await asyncio.gather(*(send(request) for request in requests))
+            return time.perf_counter() - start, statuses
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="*", default=["portfolios", "holdings", "price_ranges", "chatbot"])
+    parser.add_argument("--workers", type=int, default=4, help="Threads serving the sync views")
+    parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to each upstream call (4x for the LLM)")
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--lots", type=int, default=50, help="Lots per portfolio")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO) # The views log every chatbot answer
+    tables, tickers = setup_stubs(args)
+    results = {key: getattr(args, key) for key in ("workers", "concurrency", "requests", "latency")}
+
+    # Warm the price store and the cached portfolio, so the runs measure the request path
+    run_sync([("all_portfolios/", {"email": "warm@example.com"})], 1)
+    run_sync(scenario_requests("price_ranges", 50, tickers, "warm"), args.workers)
+
+    for scenario in args.scenarios:
+        results[scenario] = {}
+        for mode in ("sync", "async"):
+            requests = scenario_requests(scenario, args.requests, tickers, mode)
+            if mode == "sync":
+                elapsed, statuses = run_sync(requests, args.workers)
+            else:
+                elapsed, statuses = run_async(requests, args.concurrency, tables, args.latency)
+            results[scenario][mode] = {
+                "requests_per_s": round(len(requests) / elapsed, 1),
+                "errors": sum(status != 200 for status in statuses),
+            }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import DatePicker from 'react-datepicker';
 import 'react-datepicker/dist/react-datepicker.css';
 import { useAuth0 } from '@auth0/auth0-react';
 import supabase from '../../utils/CreateSupabaseClient'
+import { markPortfolioStale } from '../../utils/StalePortfolios'
 import axios from 'axios';
 
 const portfoliosTable = process.env.REACT_APP_SUPABASE_PORTFOLIOS_TABLE;
@@ -129,6 +130,22 @@ const AddPosition = ({ resetTrigger, onResetComplete }) => {
             setError('Could not store position into database. Please try again later.');
             return;
         }
+
+        /* Apply the transaction to the cached portfolio */
+        try {
+            await axios.post('/backend/add_transaction/', {
+                email: email,
+                portfolio: selectedPortfolio === 'createNew' ? newPortfolioName : selectedPortfolio,
+                stock: ticker,
+                amount: amount,
+                unit_price: purchasePrice,
+                total_price: amount * purchasePrice,
+                date_purchased: datePurchased,
+            });
+        } catch (error) {
+            console.error('Error updating cached portfolio:', error);
+            markPortfolioStale(selectedPortfolio === 'createNew' ? newPortfolioName : selectedPortfolio); // Rebuilt on the next dashboard load
+        }
     };
 
     return (
@@ -7,6 +7,7 @@ import axios from 'axios';
 import AddPosition from '../AddPosition/AddPosition';
 import SellPosition from '../SellPosition/SellPosition';
 import Chatbot from '../Chatbot/Chatbot';
+import { clearStalePortfolios, getStalePortfolios } from '../../utils/StalePortfolios';
 
 const COLORS = ['#0088FE', '#00C49F', '#FFBB28', '#FF8042', '#8884d8'];
 
@@ -45,7 +46,8 @@ const Dashboard = () => {
 
         const fetchPortfolios = async () => {
             try {
-                const response = await axios.post('/backend/all_portfolios/', { email: user.email });
+                const response = await axios.post('/backend/all_portfolios/', { email: user.email, rebuild: getStalePortfolios() });
+                clearStalePortfolios();
                 setPortfolios(response.data);
                 if (response.data.length > 0) setSelectedPortfolio(response.data[0]);
             } catch (err) {
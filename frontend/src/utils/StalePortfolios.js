@@ -0,0 +1,12 @@
+/* Portfolios whose cached snapshot missed a transaction, which the backend rebuilds on the next dashboard load */
+const STALE_PORTFOLIOS_KEY = 'stalePortfolios';
+
+export const getStalePortfolios = () => JSON.parse(localStorage.getItem(STALE_PORTFOLIOS_KEY) || '[]');
+
+export const markPortfolioStale = (portfolio) => {
+    const stalePortfolios = new Set(getStalePortfolios());
+    stalePortfolios.add(portfolio);
+    localStorage.setItem(STALE_PORTFOLIOS_KEY, JSON.stringify([...stalePortfolios]));
+};
+
+export const clearStalePortfolios = () => localStorage.removeItem(STALE_PORTFOLIOS_KEY);